@@ -1,38 +1,243 @@
-import asyncio
-import time
-from src.utils.config import load_config
+import argparse
+import copy
+import os
+import shutil
+from src.utils.config import load_config, load_ingest_roots
 from src.utils.logger import setup_logger
-from src.models.clip_model import CLIPModel
-from src.models.blip_model import BLIPModel
-from src.models.llm_model import LocalLLM
-from src.interfaces.gradio_interface import GradioInterface
+from src.models.lazy import ModelRegistry
+from src.models.llm_cache import CachedLLM
+from src.search.ann_index import IVFIndex
+from src.search.lexical_index import BM25Index
+from src.utils.scheduler import MaintenanceScheduler
+from src.utils.status_server import StatusServer
 
-async def periodic_cleanup(interface, interval=60):
-    """Run cleanup of expired sessions every `interval` seconds."""
-    logger = setup_logger()
-    while True:
-        logger.info("Running periodic cleanup of expired sessions...")
-        status = interface.session_manager.cleanup_expired_sessions()
-        logger.info(status)
-        await asyncio.sleep(interval)
+def start_maintenance(config, interface):
+    """Schedule session expiry, cache eviction, embedding compaction, index training and saves and LLM cache saves."""
+    jobs = config["maintenance"]["jobs"]
+    jitter = config["maintenance"]["jitter"]
+    scheduler = MaintenanceScheduler()
+
+    def save_index(deadline):
+        if interface.ann_index.needs_training():
+            interface.ann_index.train()
+        if interface.ann_index.dirty:
+            interface.ann_index.save(config["index"]["path"])
+        lexical_index = getattr(interface, "lexical_index", None)
+        if lexical_index is not None and lexical_index.dirty:
+            lexical_index.save(config["lexical"]["path"])
+
+    min_dead_fraction = jobs["embedding_store"]["min_dead_fraction"]
+    job_fns = {
+        "download_cache": interface.download_cache.evict,
+        "embedding_store": lambda deadline: interface.embedding_store.compact(min_dead_fraction),
+    }
+    # The headless API is stateless and keeps no ANN index.
+    if hasattr(interface, "session_manager"):
+        job_fns["sessions"] = lambda deadline: interface.session_manager.cleanup_expired_sessions()
+    if hasattr(interface, "ann_index"):
+        job_fns["index"] = save_index
+    if isinstance(interface.query_processor.llm_model, CachedLLM):
+        job_fns["llm_cache"] = lambda deadline: interface.query_processor.llm_model.save()
+    for name, fn in job_fns.items():
+        scheduler.add_job(name, fn, jobs[name]["interval_seconds"], jitter, jobs[name]["budget_seconds"])
+    scheduler.start()
+    return scheduler
+
+def register_models(config):
+    """Register the models as lazy proxies; each loads (and imports its framework) on first use."""
+    models = config["models"]
+    registry = ModelRegistry()
+
+    def load_clip():
+        from src.models.clip_model import CLIPModel
+        return CLIPModel(
+            models["clip"], device="cpu", backend=models["clip_backend"],
+            backend_options=models["clip_backend_options"], parity_min_cosine=models["clip_parity_min_cosine"],
+            parity_image_dir=config["data"]["image_dir"]
+        )
+
+    def load_blip():
+        from src.models.blip_model import BLIPModel
+        return BLIPModel(
+            models["blip"], device="cpu",
+            cache_path=config["captions"]["cache_path"], batch_size=config["captions"]["batch_size"]
+        )
+
+    def load_llm():
+        from src.models.llm_model import LocalLLM
+        return LocalLLM(models["llm"], device="cpu")
+
+    registry.register("clip", load_clip, model_name=models["clip"], device="cpu")
+    registry.register("blip", load_blip)
+    registry.register("llm", load_llm)
+    if not config["startup"]["lazy_models"]:
+        for model in registry.models.values():
+            model.load()
+    return registry
+
+def wrap_clip(config, clip_model):
+    """Put the batching front end around `clip_model` when `batching.enabled`."""
+    if not config["batching"]["enabled"]:
+        return clip_model
+    from src.models.batching import BatchingCLIPModel
+    return BatchingCLIPModel(clip_model, config["batching"]["max_batch_size"], config["batching"]["max_wait_ms"])
+
+def wrap_models(config, registry):
+    """Put the batching and caching front ends (which own threads) around the registered models."""
+    clip_model, blip_model, llm_model = (registry.models[name] for name in ("clip", "blip", "llm"))
+    clip_model = wrap_clip(config, clip_model)
+    cache_config = config["llm_cache"]
+    if cache_config["enabled"]:
+        llm_model = CachedLLM(
+            llm_model, cache_config["path"], cache_config["max_entries"], cache_config["ttl_seconds"],
+            clip_model, cache_config["semantic_threshold"], cache_config["empty_ttl_seconds"]
+        )
+    return clip_model, blip_model, llm_model
+
+def start_status_server(host, port, registry, interface=None, scheduler=None):
+    status_server = StatusServer(host, port)
+    status_server.add_route("/healthz", registry.healthz)
+    status_server.add_route("/readyz", registry.readyz)
+    if interface is not None:
+        status_server.add_route("/profile", interface.toggle_profiling)
+    if scheduler is not None:
+        status_server.add_route("/maintenance", scheduler.status)
+    status_server.start()
+    return status_server
+
+def start_pipeline(config, registry, status_port, base_indexes=None):
+    """Build the search pipeline and its background services in the current process."""
+    from src.interfaces.gradio_interface import GradioInterface
+    clip_model, blip_model, llm_model = wrap_models(config, registry)
+    interface = GradioInterface(config, clip_model, blip_model, llm_model, base_indexes)
+    scheduler = start_maintenance(config, interface)
+    if status_port:
+        start_status_server(config["observability"]["status_host"], status_port, registry, interface, scheduler)
+    registry.start_warmup(config["startup"]["warmup"])
+    return interface
+
+def load_base_indexes(config):
+    """The shared ANN and lexical indexes, loaded once in the parent so forked workers share them read-only."""
+    base_indexes = {}
+    if os.path.exists(config["index"]["path"]):
+        base_indexes["index"] = IVFIndex.load(config["index"]["path"], nprobe=config["index"]["nprobe"])
+    if config["lexical"]["enabled"] and os.path.exists(config["lexical"]["path"]):
+        base_indexes["lexical"] = BM25Index.load(config["lexical"]["path"])
+    return base_indexes
+
+def sync_from_shared(shared_path, worker_path):
+    """Copy a shared file over a worker's copy when the shared one changed since the last copy.
+
+    Workers write to their copies, so mtimes can't be compared directly; the
+    shared mtime of the last copy is kept next to the worker's file instead.
+    """
+    if not os.path.exists(shared_path):
+        return
+    marker_path = f"{worker_path}.source"
+    shared_mtime = os.stat(shared_path).st_mtime_ns
+    if os.path.exists(worker_path) and os.path.exists(marker_path):
+        with open(marker_path, "r") as f:
+            if int(f.read().strip() or 0) >= shared_mtime:
+                return
+    os.makedirs(os.path.dirname(worker_path) or ".", exist_ok=True)
+    shutil.copyfile(shared_path, f"{worker_path}.tmp")
+    os.replace(f"{worker_path}.tmp", worker_path)
+    with open(marker_path, "w") as f:
+        f.write(str(shared_mtime))
+
+def worker_config(config, index):
+    """Per-worker paths for the files a process rewrites without cross-process locking.
+
+    The embedding store is shared as is (it locks across processes). The
+    ANN and lexical index paths become per-worker overlays holding only
+    what the worker added on top of the shared indexes from
+    `load_base_indexes`. The LLM cache is copied from the shared one when
+    that changed. Downloads go to a per-worker image directory with an
+    equal share of the cache budget, since eviction rewrites the URL logs
+    and notifies only the evicting process's indexes.
+    """
+    config = copy.deepcopy(config)
+    data = config["data"]
+    data["image_dir"] = os.path.join(data["image_dir"], f"worker-{index}")
+    if data["cache_max_bytes"] is not None:
+        data["cache_max_bytes"] //= config["serving"]["workers"]
+    shared_llm_cache = config["llm_cache"]["path"]
+    for section in ("index", "lexical", "llm_cache"):
+        root, ext = os.path.splitext(config[section]["path"])
+        config[section]["path"] = f"{root}.worker-{index}{ext}"
+    sync_from_shared(shared_llm_cache, config["llm_cache"]["path"])
+    return config
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="AI image search server.")
+    parser.add_argument("--mode", choices=["gradio", "api"], default="gradio",
+                        help="Gradio UI, or the headless JSON API on api.host:api.port")
+    parser.add_argument("--stub-images", help="API mode: serve this local image directory instead of "
+                                              "searching the web, with a stub LLM (for load tests)")
+    parser.add_argument("--stub-latency", type=float, default=0.0, help="Simulated seconds per stub LLM/fetch call")
+    return parser.parse_args()
+
+def run_api(config, registry, args):
+    # Imported per mode, so the API never imports Gradio and the Gradio app never loads the API server.
+    from src.interfaces.http_api import HTTPSearchAPI
+    from src.utils.stubs import StubFetcher, StubLLM
+    clip_model, blip_model, llm_model = wrap_models(config, registry)
+    fetcher = None
+    if args.stub_images:
+        paths = [
+            os.path.join(root, name) for root, _, files in os.walk(args.stub_images)
+            for name in sorted(files) if name.lower().endswith((".jpg", ".jpeg", ".png", ".webp"))
+        ]
+        fetcher = StubFetcher(paths, args.stub_latency)
+        llm_model = StubLLM(args.stub_latency)
+    api = HTTPSearchAPI(config, clip_model, blip_model, llm_model, fetcher)
+    scheduler = start_maintenance(config, api)
+    status_port = config["observability"]["status_port"]
+    if status_port:
+        start_status_server(config["observability"]["status_host"], status_port, registry, scheduler=scheduler)
+    registry.start_warmup(config["startup"]["warmup"])
+    api.run()
 
 def main():
+    args = parse_args()
     config = load_config()
     logger = setup_logger()
     logger.info("Initializing models...")
-    clip_model = CLIPModel(config["models"]["clip"], device="cpu")
-    blip_model = BLIPModel(config["models"]["blip"], device="cpu")
-    llm_model = LocalLLM(config["models"]["llm"], device="cpu")
-    interface = GradioInterface(config, clip_model, blip_model, llm_model)
+    registry = register_models(config)
+    if args.mode == "api":
+        logger.info("Launching HTTP API...")
+        run_api(config, registry, args)
+        return
+    from src.interfaces.gradio_interface import build_app
+    serving = config["serving"]
+    status_port = config["observability"]["status_port"]
+    if serving["workers"] > 1:
+        from src.interfaces.worker_pool import WorkerPool
+        # Loaded before forking so the workers share the weights and base indexes copy-on-write.
+        for name in serving["preload"]:
+            registry.models[name].load()
+        base_indexes = load_base_indexes(config)
+        pool = WorkerPool(
+            lambda index: start_pipeline(
+                worker_config(config, index), registry, status_port + 1 + index if status_port else 0, base_indexes
+            ),
+            serving["workers"], serving["torch_threads"]
+        )
+        pool.start()
+        if status_port:
+            start_status_server(config["observability"]["status_host"], status_port, registry)
+        app = build_app(pool)
+    else:
+        if serving["torch_threads"]:
+            import torch
+            torch.set_num_threads(serving["torch_threads"])
+        interface = start_pipeline(config, registry, status_port)
+        app = interface.create_interface()
     logger.info("Launching Gradio interface...")
-    app = interface.create_interface()
-    
-    # Start periodic cleanup in the background
-    loop = asyncio.get_event_loop()
-    loop.create_task(periodic_cleanup(interface, interval=60))
     
     # Launch Gradio app
-    app.launch(server_name="0.0.0.0", server_port=7860)
+    # Bulk-ingested images can live outside the working directory; Gradio refuses to serve those otherwise.
+    app.launch(server_name="0.0.0.0", server_port=7860, allowed_paths=load_ingest_roots(config))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
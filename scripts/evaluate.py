@@ -0,0 +1,304 @@
+"""Offline retrieval-quality and latency benchmark.
+
+Runs the app's ranking path (ImageSearcher, or StreamingSearcher with
+--streaming, with the configured decode, diversity and fusion settings) over
+a labelled local fixture with the LLM and DuckDuckGo replaced by
+deterministic stubs. Prints a JSON report with recall@k, MRR, nDCG@k,
+per-query latency percentiles for every stage (expand, fetch and search, plus
+the pipeline's decode, clip_image, clip_text and rank spans), per-stage span
+totals, embedding throughput and peak RSS.
+Reports from different commits can be diffed directly.
+
+Fixture format:
+
+    {
+      "image_dir": "fixtures/images",
+      "queries": [
+        {"query": "a red car", "relevant": ["car_01.jpg", "car_02.jpg"]},
+        {"query": "a dog on a beach", "relevant": ["dog_03.jpg"], "candidates": ["dog_03.jpg", "..."]}
+      ]
+    }
+
+`candidates` restricts the pool the stub fetcher returns for that query;
+by default every image in `image_dir` is a candidate.
+
+    python scripts/evaluate.py fixtures/eval.json --output reports/eval.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from src.data.embedding_store import EmbeddingStore
+from src.data.preprocessing import PreprocessedCache, fast_decode_enabled
+from src.models.clip_model import CLIPModel
+from src.search.image_searcher import ImageSearcher
+from src.search.streaming import StreamingSearcher
+from src.utils.config import load_config
+from src.utils.metrics import metrics
+from src.utils.stubs import StubFetcher, StubLLM
+
+TIMED_STAGES = ("expand", "fetch", "search")
+SPAN_STAGES = ("decode", "clip_image", "clip_text", "rank")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+
+def recall_at_k(ranked, relevant, k):
+    return len(set(ranked[:k]) & relevant) / len(relevant) if relevant else 0.0
+
+
+def reciprocal_rank(ranked, relevant):
+    for rank, item in enumerate(ranked, start=1):
+        if item in relevant:
+            return 1.0 / rank
+    return 0.0
+
+
+def ndcg_at_k(ranked, relevant, k):
+    dcg = sum(1.0 / np.log2(rank + 1) for rank, item in enumerate(ranked[:k], start=1) if item in relevant)
+    ideal = sum(1.0 / np.log2(rank + 1) for rank in range(1, min(len(relevant), k) + 1))
+    return dcg / ideal if ideal else 0.0
+
+
+def percentiles(samples):
+    values = np.asarray(samples, dtype=np.float64) * 1000
+    if not len(values):
+        return {}
+    return {
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "p99": float(np.percentile(values, 99)),
+        "mean": float(values.mean()),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def span_totals():
+    """{stage: (seconds, count)} for every `stage_seconds` histogram recorded so far."""
+    with metrics.lock:
+        histograms = dict(metrics.histograms)
+    totals = {}
+    for (name, labels), histogram in histograms.items():
+        if name == "stage_seconds":
+            snapshot = histogram.snapshot()
+            totals[dict(labels)["stage"]] = (snapshot["sum"], snapshot["count"])
+    return totals
+
+
+class TimedFetcher:
+    """Wraps a fetcher and records how long each fetch (or, streamed, the whole stream) took."""
+
+    def __init__(self, fetcher, samples):
+        self.fetcher = fetcher
+        self.samples = samples
+
+    async def fetch_images(self, queries, max_results=20):
+        started = time.perf_counter()
+        try:
+            return await self.fetcher.fetch_images(queries, max_results)
+        finally:
+            self.samples.append(time.perf_counter() - started)
+
+    async def stream_images(self, queries, max_results, queue):
+        # Overlaps with embedding, so this is the producer's wall time rather than a share of the query.
+        started = time.perf_counter()
+        try:
+            await self.fetcher.stream_images(queries, max_results, queue)
+        finally:
+            self.samples.append(time.perf_counter() - started)
+
+
+class Benchmark:
+    """Runs each fixture query through the app's own ranking path.
+
+    Images are embedded and ranked by `ImageSearcher` (or `StreamingSearcher`
+    with `--streaming`) with the configured decode, diversity and fusion
+    options, against an embedding store in a temporary directory, so changes
+    to that path show up in the report. Per-stage time comes from the
+    pipeline's `stage_seconds` spans (decode, clip_image, clip_text, rank),
+    taken per query as the change in each span's total over that query.
+    """
+
+    def __init__(self, clip_model, fixture, config, args, work_dir):
+        self.clip_model = clip_model
+        self.config = config
+        self.image_dir = fixture["image_dir"]
+        self.queries = fixture["queries"]
+        self.all_images = sorted(
+            name for name in os.listdir(self.image_dir) if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        data_config = config["data"]
+        self.embedding_store = EmbeddingStore(
+            os.path.join(work_dir, "embeddings"), clip_model.model_name, data_config["embedding_dtype"],
+            fast_decode=fast_decode_enabled(data_config)
+        )
+        preprocessed_cache = None
+        if data_config["preprocessed_dir"]:
+            preprocessed_cache = PreprocessedCache(os.path.join(work_dir, "preprocessed"))
+        self.searcher_options = {
+            "dataset_options": {"fast_decode": data_config["fast_decode"], "preprocessed_cache": preprocessed_cache},
+            "decode_workers": data_config["decode_workers"],
+            "decode_backend": data_config["decode_backend"],
+            "diversity": config["diversity"],
+        }
+        self.llm = StubLLM(latency=args.llm_latency)
+        self.batch_size = args.batch_size
+        self.fusion = args.fusion
+        self.streaming = args.streaming
+        self.num_variations = args.num_variations
+        self.fetch_latency = args.fetch_latency
+        self.ks = args.k
+        self.timings = {stage: [] for stage in TIMED_STAGES + SPAN_STAGES}
+
+    def _timed(self, stage, fn, *args):
+        started = time.perf_counter()
+        result = fn(*args)
+        self.timings[stage].append(time.perf_counter() - started)
+        return result
+
+    def _search(self, loop, fetcher, query, queries, top_k):
+        if self.streaming:
+            search_config = self.config["search"]
+            searcher = StreamingSearcher(
+                self.clip_model, fetcher, self.embedding_store, self.batch_size, search_config["queue_size"],
+                search_config["batch_wait_ms"] / 1000, self.fusion, searcher_options=self.searcher_options
+            )
+            return loop.run_until_complete(
+                searcher.search([query] + queries, queries, top_k=top_k, deadline=search_config["deadline_seconds"])
+            )
+        paths = loop.run_until_complete(fetcher.fetch_images(queries))
+        searcher = ImageSearcher(
+            self.clip_model, paths, self.batch_size, self.embedding_store, self.fusion, **self.searcher_options
+        )
+        return searcher.search([query] + queries, top_k)
+
+    def run_query(self, loop, entry):
+        query = entry["query"]
+        candidates = entry.get("candidates") or self.all_images
+        fetcher = TimedFetcher(
+            StubFetcher([os.path.join(self.image_dir, name) for name in candidates], self.fetch_latency),
+            self.timings["fetch"]
+        )
+        spans_before = span_totals()
+        queries = self._timed("expand", self.llm.enhance_query, query, self.num_variations)
+        results = self._timed("search", self._search, loop, fetcher, query, queries, max(self.ks))
+        spans_after = span_totals()
+        for stage in SPAN_STAGES:
+            # Zero when the stage didn't run for this query (e.g. every embedding was cached).
+            seconds = spans_after.get(stage, (0.0, 0))[0] - spans_before.get(stage, (0.0, 0))[0]
+            self.timings[stage].append(seconds)
+        return [os.path.relpath(path, self.image_dir) for path, _ in results]
+
+    def run(self):
+        loop = asyncio.new_event_loop()
+        scores = {f"recall@{k}": [] for k in self.ks}
+        scores.update({f"ndcg@{k}": [] for k in self.ks})
+        scores["mrr"] = []
+        spans_before = span_totals()
+        started = time.perf_counter()
+        try:
+            for entry in self.queries:
+                ranked = self.run_query(loop, entry)
+                relevant = set(entry["relevant"])
+                for k in self.ks:
+                    scores[f"recall@{k}"].append(recall_at_k(ranked, relevant, k))
+                    scores[f"ndcg@{k}"].append(ndcg_at_k(ranked, relevant, k))
+                scores["mrr"].append(reciprocal_rank(ranked, relevant))
+        finally:
+            loop.close()
+        elapsed = time.perf_counter() - started
+        spans = {}
+        for stage, (seconds, count) in span_totals().items():
+            before_seconds, before_count = spans_before.get(stage, (0.0, 0))
+            if count > before_count:
+                spans[stage] = {
+                    "total_ms": (seconds - before_seconds) * 1000,
+                    "count": count - before_count,
+                    "mean_ms": (seconds - before_seconds) * 1000 / (count - before_count),
+                }
+        images_embedded = metrics.counters.get(("cache_misses_total", (("cache", "embedding"),)), 0)
+        embed_seconds = spans.get("clip_image", {}).get("total_ms", 0.0) / 1000
+        return {
+            "quality": {name: float(np.mean(values)) if values else 0.0 for name, values in scores.items()},
+            # With decode_backend "processes", decode spans are recorded in the workers and don't show here.
+            "latency_ms": {stage: percentiles(samples) for stage, samples in self.timings.items() if samples},
+            "stages": spans,
+            "throughput": {
+                "queries": len(self.queries),
+                "queries_per_sec": len(self.queries) / elapsed if elapsed else 0.0,
+                "images_embedded": images_embedded,
+                "images_per_sec": images_embedded / embed_seconds if embed_seconds else 0.0,
+            },
+            # ru_maxrss is in kilobytes on Linux.
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark retrieval quality and latency on a local fixture.")
+    parser.add_argument("fixture", help="Path to the fixture JSON file")
+    parser.add_argument("--config", default="config/app_config.yaml")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 5, 10])
+    parser.add_argument("--batch-size", type=int, default=None, help="Defaults to data.batch_size")
+    parser.add_argument("--fusion", default=None, help="Defaults to search.fusion")
+    parser.add_argument("--num-variations", type=int, default=5)
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Simulated LLM seconds per call")
+    parser.add_argument("--fetch-latency", type=float, default=0.0, help="Simulated fetch seconds per query")
+    parser.add_argument("--streaming", action="store_true", help="Rank with StreamingSearcher instead of ImageSearcher")
+    parser.add_argument("--clip-backend", default=None, help="Defaults to models.clip_backend")
+    parser.add_argument("--device", default="cpu")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    config = load_config(args.config)
+    args.batch_size = args.batch_size or config["data"]["batch_size"]
+    args.fusion = args.fusion or config["search"]["fusion"]
+    with open(args.fixture, "r") as f:
+        fixture = json.load(f)
+    models = config["models"]
+    clip_model = CLIPModel(
+        models["clip"], device=args.device, backend=args.clip_backend or models["clip_backend"],
+        backend_options=models["clip_backend_options"], parity_min_cosine=models["clip_parity_min_cosine"],
+        parity_image_dir=config["data"]["image_dir"]
+    )
+    report = {
+        "commit": git_commit(),
+        "fixture": os.path.abspath(args.fixture),
+        "settings": {
+            "clip": config["models"]["clip"], "clip_backend": clip_model.backend_name, "batch_size": args.batch_size, "fusion": args.fusion,
+            "num_variations": args.num_variations, "k": args.k, "streaming": args.streaming,
+            "fast_decode": config["data"]["fast_decode"], "decode_workers": config["data"]["decode_workers"],
+            "diversity": config["diversity"],
+        },
+    }
+    # A fresh embedding store per run, so every report measures cold embedding.
+    with tempfile.TemporaryDirectory(prefix="evaluate-") as work_dir:
+        report.update(Benchmark(clip_model, fixture, config, args, work_dir).run())
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
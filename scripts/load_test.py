@@ -0,0 +1,324 @@
+"""Concurrent-session load test for the Gradio handlers.
+
+Drives `GradioInterface.search_images`, `refine_with_feedback`,
+`refine_with_image` and `reset` from N simulated users on one event loop,
+the way Gradio calls them. Images are downloaded through the real
+`ImageFetcher` from a local HTTP server over `--images`, DuckDuckGo is
+replaced by a stub that returns that server's URLs, and the LLM by
+`StubLLM`; each stand-in has its own latency and failure rate. CLIP and
+BLIP are the configured models.
+
+Each `--users` value is one scenario, run against fresh cache directories
+so scenarios are comparable. The JSON report has, per scenario and
+operation, throughput, latency percentiles and error rates, plus CPU time,
+peak RSS, thread count, event-loop lag (how long the loop was blocked) and
+the pipeline's metric counters.
+
+    python scripts/load_test.py --images fixtures/images --users 1 4 16 --duration 60 --output reports/load.json
+"""
+import argparse
+import asyncio
+import copy
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp import web
+from main import register_models, wrap_clip
+from scripts.evaluate import git_commit, percentiles
+from src.data.image_fetcher import ImageFetcher
+from src.interfaces.gradio_interface import GradioInterface
+from src.utils.config import load_config
+from src.utils.metrics import metrics
+from src.utils.stubs import StubLLM
+
+OPERATIONS = ("search", "refine_feedback", "refine_image", "reset")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+QUERIES = [
+    "a red car", "a dog on a beach", "mountain landscape at sunset", "city skyline at night",
+    "a cat sleeping", "fresh fruit on a table", "people walking in the rain", "an old wooden boat",
+]
+FEEDBACK = ["brighter", "more close up", "remove people", "in winter", "black and white"]
+
+
+class ImageServer:
+    """Serves `image_dir` as `/img/<n>.jpg`, with per-request latency and a 503 failure rate."""
+
+    def __init__(self, image_dir, latency=0.0, failure_rate=0.0, seed=0):
+        self.paths = sorted(
+            os.path.join(root, name) for root, _, files in os.walk(image_dir)
+            for name in files if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        if not self.paths:
+            raise ValueError(f"No images found in {image_dir}")
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.runner = None
+        self.base_url = None
+
+    async def _image(self, request):
+        if self.latency:
+            await asyncio.sleep(self.random.uniform(0.5, 1.5) * self.latency)
+        if self.failure_rate and self.random.random() < self.failure_rate:
+            raise web.HTTPServiceUnavailable()
+        index = int(request.match_info["index"])
+        if index >= len(self.paths):
+            raise web.HTTPNotFound()
+        return web.FileResponse(self.paths[index], headers={"Content-Type": "image/jpeg"})
+
+    async def start(self):
+        app = web.Application()
+        app.add_routes([web.get(r"/img/{index:\d+}.jpg", self._image)])
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.base_url = f"http://127.0.0.1:{port}"
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+class LocalImageFetcher(ImageFetcher):
+    """ImageFetcher whose DuckDuckGo search returns a query-seeded sample of `server`'s URLs."""
+
+    def __init__(self, server, latency=0.0, failure_rate=0.0, seed=0, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.server = server
+        self.search_latency = latency
+        self.search_failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+
+    def _search_urls(self, query, max_results):
+        with self.random_lock:
+            failed = self.search_failure_rate and self.random.random() < self.search_failure_rate
+        if self.search_latency:
+            time.sleep(self.search_latency)
+        if failed:
+            raise RuntimeError("Stub DuckDuckGo failure")
+        indices = random.Random(query).sample(range(len(self.server.paths)), min(max_results, len(self.server.paths)))
+        return [f"{self.server.base_url}/img/{index}.jpg" for index in indices]
+
+
+def scenario_config(config, work_dir):
+    """Point every cache and state file at `work_dir` so a scenario starts cold and leaves no trace."""
+    data = config["data"]
+    data["image_dir"] = os.path.join(work_dir, "images")
+    data["temp_dir"] = os.path.join(work_dir, "temp")
+    data["embedding_dir"] = os.path.join(work_dir, "embeddings")
+    if data["preprocessed_dir"]:
+        data["preprocessed_dir"] = os.path.join(work_dir, "preprocessed")
+    config["index"]["path"] = os.path.join(work_dir, "index", "ivf_index.npz")
+    config["lexical"]["path"] = os.path.join(work_dir, "index", "lexical_index.json")
+    config["captions"]["cache_path"] = os.path.join(work_dir, "captions.jsonl")
+    config["session"]["sqlite_path"] = os.path.join(work_dir, "sessions.db")
+    return config
+
+
+def scenario_captioner(blip_model, cache_path):
+    """The loaded BLIP model behind its own empty caption cache, so captions don't carry over between scenarios."""
+    captioner = copy.copy(blip_model)
+    captioner.cache_path = cache_path
+    captioner.captions = {}
+    captioner.lock = threading.Lock()
+    return captioner
+
+
+def counter_snapshot():
+    with metrics.lock:
+        counters = dict(metrics.counters)
+    return {
+        name + ("{" + ",".join(f"{k}={v}" for k, v in labels) + "}" if labels else ""): value
+        for (name, labels), value in counters.items()
+    }
+
+
+class LoadTest:
+    def __init__(self, interface, args):
+        self.interface = interface
+        self.args = args
+        self.latencies = {operation: [] for operation in OPERATIONS}
+        self.errors = {operation: 0 for operation in OPERATIONS}
+        self.error_samples = []
+        self.loop_lag = []
+
+    async def _timed(self, operation, handler, *args):
+        started = time.perf_counter()
+        try:
+            # Gradio runs sync handlers in its thread pool, so do the same.
+            if asyncio.iscoroutinefunction(handler):
+                result = await handler(*args)
+            else:
+                result = await asyncio.to_thread(handler, *args)
+        except Exception as e:
+            self.errors[operation] += 1
+            if len(self.error_samples) < 20:
+                self.error_samples.append(f"{operation}: {e!r}")
+            return None
+        finally:
+            self.latencies[operation].append(time.perf_counter() - started)
+        return result
+
+    async def _user(self, index, stop_at):
+        rng = random.Random(self.args.seed + index)
+        session_id = self.interface.create_session()
+        iterations = 0
+        while time.monotonic() < stop_at and (not self.args.iterations or iterations < self.args.iterations):
+            response = await self._timed("search", self.interface.search_images, rng.choice(QUERIES), session_id)
+            await asyncio.sleep(rng.uniform(0, 2 * self.args.think_time))
+            if response and response[0]:
+                await self._timed(
+                    "refine_feedback", self.interface.refine_with_feedback, rng.choice(FEEDBACK), session_id
+                )
+                await asyncio.sleep(rng.uniform(0, 2 * self.args.think_time))
+                _, results = self.interface.session_manager.get_session_data(session_id)
+                if results:
+                    await self._timed(
+                        "refine_image", self.interface.refine_with_image, rng.randrange(len(results)), session_id
+                    )
+            response = await self._timed("reset", self.interface.reset, session_id)
+            if response:
+                session_id = response[2]
+            iterations += 1
+        self.interface.end_session(session_id)
+
+    async def _watch_loop(self, interval=0.05):
+        """Sample how late the loop wakes up; lag means a handler blocked it."""
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(interval)
+            self.loop_lag.append(max(loop.time() - started - interval, 0.0))
+
+    async def run(self, users):
+        counters_before = counter_snapshot()
+        usage_before = resource.getrusage(resource.RUSAGE_SELF)
+        watcher = asyncio.ensure_future(self._watch_loop())
+        started = time.perf_counter()
+        stop_at = time.monotonic() + self.args.duration
+        await asyncio.gather(*(self._user(index, stop_at) for index in range(users)))
+        elapsed = time.perf_counter() - started
+        watcher.cancel()
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        counters_after = counter_snapshot()
+        operations = {}
+        for operation in OPERATIONS:
+            count = len(self.latencies[operation])
+            operations[operation] = {
+                "count": count,
+                "per_sec": count / elapsed if elapsed else 0.0,
+                "error_rate": self.errors[operation] / count if count else 0.0,
+                "latency_ms": percentiles(self.latencies[operation]),
+            }
+        lag = percentiles(self.loop_lag)
+        lag["max"] = max(self.loop_lag) * 1000 if self.loop_lag else 0.0
+        return {
+            "users": users,
+            "elapsed_sec": elapsed,
+            "operations": operations,
+            "errors": self.error_samples,
+            "resources": {
+                "cpu_sec": (usage.ru_utime + usage.ru_stime) - (usage_before.ru_utime + usage_before.ru_stime),
+                # ru_maxrss is in kilobytes on Linux.
+                "peak_rss_mb": usage.ru_maxrss / 1024,
+                "threads": threading.active_count(),
+                "event_loop_lag_ms": lag,
+            },
+            "counters": {
+                name: value - counters_before.get(name, 0) for name, value in counters_after.items()
+                if value != counters_before.get(name, 0)
+            },
+        }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Simulate concurrent Gradio sessions against local stand-ins.")
+    parser.add_argument("--images", required=True, help="Directory of images the local HTTP server serves")
+    parser.add_argument("--config", default="config/app_config.yaml")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 4, 16], help="One scenario per value")
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds per scenario")
+    parser.add_argument("--iterations", type=int, default=0, help="Stop each user after this many rounds (0: no limit)")
+    parser.add_argument("--think-time", type=float, default=0.5, help="Mean seconds a user pauses between actions")
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--llm-failure-rate", type=float, default=0.0)
+    parser.add_argument("--ddg-latency", type=float, default=0.3)
+    parser.add_argument("--ddg-failure-rate", type=float, default=0.0)
+    parser.add_argument("--image-latency", type=float, default=0.1, help="Mean seconds per image download")
+    parser.add_argument("--image-failure-rate", type=float, default=0.05)
+    parser.add_argument("--feedback-mode", choices=["embedding", "caption"], default=None,
+                        help="Defaults to feedback.mode")
+    parser.add_argument("--work-dir", default=None, help="Where scenario caches go (default: a temp directory)")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+async def run_scenarios(args, config, registry):
+    server = ImageServer(args.images, args.image_latency, args.image_failure_rate, args.seed)
+    await server.start()
+    # Only the batching front end: the LLM is stubbed per scenario, so no CachedLLM on the app's cache file.
+    clip_model = wrap_clip(config, registry.models["clip"])
+    blip_model = registry.models["blip"].load()
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="load-test-")
+    scenarios = []
+    try:
+        for users in args.users:
+            scenario = scenario_config(load_config(args.config), os.path.join(work_dir, f"users-{users}"))
+            if args.feedback_mode:
+                scenario["feedback"]["mode"] = args.feedback_mode
+            llm_model = StubLLM(args.llm_latency, args.llm_failure_rate, args.seed)
+            captioner = scenario_captioner(blip_model, scenario["captions"]["cache_path"])
+            interface = GradioInterface(scenario, clip_model, captioner, llm_model)
+            data = scenario["data"]
+            interface.fetcher = LocalImageFetcher(
+                server, args.ddg_latency, args.ddg_failure_rate, args.seed,
+                data["image_dir"], interface.download_cache, interface.executors, data["ddg_cache_ttl_seconds"],
+                **data["fetch"]
+            )
+            if interface.prefetcher is not None:
+                interface.prefetcher.fetcher = interface.fetcher
+            report = await LoadTest(interface, args).run(users)
+            report["llm_calls"] = llm_model.calls
+            scenarios.append(report)
+            await interface.fetcher.close()
+            interface.executors.shutdown()
+    finally:
+        await server.stop()
+    return scenarios
+
+
+def main():
+    args = parse_args()
+    config = load_config(args.config)
+    registry = register_models(config)
+    # Load up front so the first scenario doesn't measure model loading.
+    for name in ("clip", "blip"):
+        registry.models[name].load()
+    report = {
+        "commit": git_commit(),
+        "settings": {
+            key: value for key, value in vars(args).items() if key not in ("output", "config")
+        },
+        "scenarios": asyncio.run(run_scenarios(args, config, registry)),
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+"""Bulk-ingest images into the embedding store and local ANN index.
+
+Walks an image directory and/or downloads a URL list, decodes and resizes
+images in a process pool, encodes them with CLIP in large batches and writes
+the embeddings to the EmbeddingStore and IVF index used by the app, plus one
+metadata line per image. Progress is checkpointed, so a killed run resumes
+where it stopped.
+
+With `--tag`, each image is also captioned with BLIP (and, with
+`--expand-tags N`, the caption expanded into N variants by the LLM), and the
+text goes into the BM25 lexical index that hybrid local search uses.
+
+    python scripts/preprocess_images.py --image-dir /data/photos
+    python scripts/preprocess_images.py --url-list urls.txt --batch-size 512
+    python scripts/preprocess_images.py --image-dir /data/photos --tag --expand-tags 3
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aiohttp
+import numpy as np
+from PIL import Image
+from src.data.download_cache import DownloadCache
+from src.data.embedding_store import EmbeddingStore
+from src.data.preprocessing import decode_and_resize, fast_decode_enabled, find_normalize, find_resize, to_clip_tensor
+from src.models.clip_model import CLIPModel
+from src.search.ann_index import IVFIndex
+from src.search.lexical_index import BM25Index
+from src.utils.config import load_config, record_ingest_roots
+from src.utils.hashing import file_hash
+from src.utils.logger import setup_logger
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+logger = setup_logger()
+
+
+def iter_image_paths(image_dir):
+    for root, _, files in os.walk(image_dir):
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(root, name)
+
+
+async def download_urls(urls, cache, concurrency=32):
+    """Download `urls` into the download cache, returning [(url, path)] for successes."""
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async def fetch(url):
+            path = cache.lookup(url)
+            if path is not None:
+                return url, path
+            async with semaphore:
+                try:
+                    async with session.get(url, timeout=aiohttp.ClientTimeout(total=15)) as response:
+                        if response.status == 200:
+                            return url, cache.store(url, await response.read())
+                except Exception as e:
+                    logger.error(f"Failed to download {url}: {e}")
+            return url, None
+        results = await asyncio.gather(*(fetch(url) for url in urls))
+    return [(url, path) for url, path in results if path]
+
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return set()
+    with open(path, "r") as f:
+        return {line.rstrip("\n") for line in f if line.strip()}
+
+
+def _decode(path, resize=None):
+    """Process-pool worker: returns (path, content_hash, uint8 image) or (path, None, None).
+
+    Images are draft-decoded unless `resize` (CLIP's pre-tensor steps, see
+    `find_resize`) is given, which reproduces CLIP's preprocess exactly.
+    """
+    try:
+        if resize is None:
+            return path, file_hash(path), decode_and_resize(path, draft=True)
+        with Image.open(path) as image:
+            return path, file_hash(path), np.asarray(resize(image.convert("RGB")), dtype=np.uint8)
+    except Exception:
+        return path, None, None
+
+
+class Ingestor:
+    def __init__(self, config, clip_model, args, blip_model=None, llm_model=None):
+        data_config, index_config, lexical_config = config["data"], config["index"], config["lexical"]
+        self.clip_model = clip_model
+        self.normalize = find_normalize(clip_model.preprocess)
+        fast_decode = fast_decode_enabled(data_config)
+        self.store = EmbeddingStore(
+            data_config["embedding_dir"], clip_model.model_name, data_config["embedding_dtype"], fast_decode=fast_decode
+        )
+        # Decoded the way the app decodes, so both share the store's rows for the same model and mode.
+        self.decode = _decode if fast_decode else partial(_decode, resize=find_resize(clip_model.preprocess))
+        self.index_path = index_config["path"]
+        if os.path.exists(self.index_path):
+            self.index = IVFIndex.load(self.index_path)
+        else:
+            self.index = IVFIndex(nlist=index_config["nlist"], nprobe=index_config["nprobe"])
+        self.blip_model = blip_model
+        self.llm_model = llm_model
+        self.expand_tags = args.expand_tags
+        self.lexical_path = lexical_config["path"]
+        self.lexical_index = None
+        if blip_model is not None:
+            if os.path.exists(self.lexical_path):
+                self.lexical_index = BM25Index.load(self.lexical_path)
+            else:
+                self.lexical_index = BM25Index(lexical_config["k1"], lexical_config["b"])
+        self.metadata_path = os.path.join(os.path.dirname(self.index_path), "metadata.jsonl")
+        self.checkpoint_path = args.checkpoint
+        self.done = load_checkpoint(self.checkpoint_path)
+        self.batch_size = args.batch_size
+        self.workers = args.workers
+        self.save_every = args.save_every
+        self.uncheckpointed = []
+        self.unsaved_metadata = []
+        self.ingested = 0
+        self.failed = 0
+
+    def _encode(self, images):
+        tensor = to_clip_tensor(np.stack(images), self.normalize).to(self.clip_model.device)
+        return self.clip_model.encode_image_batch(tensor).float().cpu().numpy()
+
+    def _embed(self, decoded):
+        """Embeddings for decoded images; ones already in the store skip the forward pass."""
+        hashes = [h for _, h, _ in decoded]
+        cached, found = self.store.get_many(hashes)
+        misses = np.flatnonzero(~found)
+        if len(misses) == 0:
+            return cached
+        encoded = self._encode([decoded[i][2] for i in misses])
+        vectors = np.zeros((len(decoded), encoded.shape[1]), dtype=np.float32)
+        vectors[misses] = encoded
+        if found.any():
+            vectors[found] = cached[found]
+        self.store.put_many([hashes[i] for i in misses], encoded)
+        return vectors
+
+    def _tag(self, paths):
+        """Caption `paths` in one BLIP pass and append LLM expansions; returns one text (or None) per path."""
+        tags = []
+        for caption in self.blip_model.generate_captions(paths):
+            if caption and self.llm_model is not None and self.expand_tags:
+                try:
+                    caption = " ".join([caption] + self.llm_model.enhance_query(caption, self.expand_tags))
+                except Exception as e:
+                    logger.error(f"Failed to expand tags for '{caption}': {e}")
+            tags.append(caption)
+        return tags
+
+    def _commit(self, chunk, decoded, vectors, sources, tags=None):
+        """Index one batch and log its metadata; its paths are checkpointed on the next save."""
+        if decoded:
+            paths = [p for p, _, _ in decoded]
+            self.index.add(paths, vectors)
+            tags = tags or [None] * len(decoded)
+            tagged = [(path, tag) for path, tag in zip(paths, tags) if tag]
+            if tagged:
+                self.lexical_index.add([path for path, _ in tagged], [tag for _, tag in tagged])
+            for (path, content_hash, _), tag in zip(decoded, tags):
+                entry = {"path": path, "hash": content_hash, "source": sources.get(path, path)}
+                if tag:
+                    entry["tags"] = tag
+                self.unsaved_metadata.append(json.dumps(entry) + "\n")
+        # Undecodable files are checkpointed too so a resume doesn't retry them forever.
+        self.uncheckpointed.extend(chunk)
+
+    def _save(self):
+        """Persist the index, then log metadata for and checkpoint everything it now contains.
+
+        Metadata is written here rather than per batch, so batches redone
+        after a crash don't leave duplicate lines.
+
+        The embedding store is written as we go, so work lost between saves is
+        redone from cached embeddings rather than re-encoded.
+        """
+        if self.index.needs_training():
+            self.index.train()
+        self.index.save(self.index_path)
+        if self.lexical_index is not None:
+            self.lexical_index.save(self.lexical_path)
+        with open(self.metadata_path, "a") as f:
+            f.writelines(self.unsaved_metadata)
+        self.unsaved_metadata = []
+        with open(self.checkpoint_path, "a") as f:
+            f.writelines(f"{path}\n" for path in self.uncheckpointed)
+        self.uncheckpointed = []
+
+    def run(self, paths, sources=None):
+        sources = sources or {}
+        # With tagging on, images ingested by an earlier untagged run are redone (their embeddings are cached).
+        pending = [
+            p for p in paths if p not in self.done or (self.lexical_index is not None and p not in self.lexical_index)
+        ]
+        logger.info(f"{len(paths) - len(pending)} images already ingested, {len(pending)} to go")
+        os.makedirs(os.path.dirname(self.metadata_path) or ".", exist_ok=True)
+        os.makedirs(os.path.dirname(self.checkpoint_path) or ".", exist_ok=True)
+        started = time.time()
+        batches_since_save = 0
+        with ProcessPoolExecutor(self.workers) as pool:
+            for start in range(0, len(pending), self.batch_size):
+                chunk = pending[start:start + self.batch_size]
+                decoded = [d for d in pool.map(self.decode, chunk, chunksize=16) if d[1] is not None]
+                self.failed += len(chunk) - len(decoded)
+                vectors = self._embed(decoded) if decoded else None
+                tags = self._tag([p for p, _, _ in decoded]) if decoded and self.lexical_index is not None else None
+                self._commit(chunk, decoded, vectors, sources, tags)
+                self.ingested += len(decoded)
+                batches_since_save += 1
+                if batches_since_save >= self.save_every:
+                    self._save()
+                    batches_since_save = 0
+                elapsed = time.time() - started
+                logger.info(
+                    f"{start + len(chunk)}/{len(pending)} processed, {self.ingested} ingested, "
+                    f"{self.failed} failed, {self.ingested / max(elapsed, 1e-9):.1f} images/sec"
+                )
+        self._save()
+        elapsed = time.time() - started
+        logger.info(
+            f"Done: {self.ingested} images in {elapsed:.1f}s "
+            f"({self.ingested / max(elapsed, 1e-9):.1f} images/sec), {self.failed} failed"
+        )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Bulk-ingest images into the search index.")
+    parser.add_argument("--image-dir", help="Directory to walk for images")
+    parser.add_argument("--url-list", help="Text file with one image URL per line")
+    parser.add_argument("--download-dir", default="data/corpus",
+                        help="Where --url-list images are stored; kept outside the evicting app cache")
+    parser.add_argument("--config", default="config/app_config.yaml")
+    parser.add_argument("--batch-size", type=int, default=256, help="Images per CLIP forward pass")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Decode processes")
+    parser.add_argument("--checkpoint", default="data/index/ingest_checkpoint.txt")
+    parser.add_argument("--save-every", type=int, default=20, help="Save the index every N batches")
+    parser.add_argument("--tag", action="store_true", help="Caption images with BLIP into the lexical index")
+    parser.add_argument("--expand-tags", type=int, default=0,
+                        help="With --tag, add this many LLM expansions of each caption")
+    parser.add_argument("--device", default="cpu")
+    args = parser.parse_args()
+    if not args.image_dir and not args.url_list:
+        parser.error("one of --image-dir or --url-list is required")
+    return args
+
+
+def main():
+    args = parse_args()
+    config = load_config(args.config)
+    paths, sources = [], {}
+    if args.url_list:
+        with open(args.url_list, "r") as f:
+            urls = list(dict.fromkeys(line.strip() for line in f if line.strip()))
+        cache = DownloadCache(args.download_dir)
+        logger.info(f"Downloading {len(urls)} URLs...")
+        for url, path in asyncio.run(download_urls(urls, cache)):
+            sources.setdefault(path, url)
+        paths.extend(sources)
+    if args.image_dir:
+        paths.extend(iter_image_paths(args.image_dir))
+    paths = list(dict.fromkeys(paths))
+    # The Gradio app only serves files from directories it is told about.
+    roots = ([args.download_dir] if args.url_list else []) + ([args.image_dir] if args.image_dir else [])
+    record_ingest_roots(config, roots)
+    logger.info("Loading CLIP...")
+    models = config["models"]
+    clip_model = CLIPModel(
+        models["clip"], device=args.device, backend=models["clip_backend"],
+        backend_options=models["clip_backend_options"], parity_min_cosine=models["clip_parity_min_cosine"],
+        parity_image_dir=args.image_dir or config["data"]["image_dir"]
+    )
+    blip_model = llm_model = None
+    if args.tag:
+        logger.info("Loading BLIP...")
+        from src.models.blip_model import BLIPModel
+        blip_model = BLIPModel(
+            models["blip"], device=args.device,
+            cache_path=config["captions"]["cache_path"], batch_size=config["captions"]["batch_size"]
+        )
+        if args.expand_tags:
+            from src.models.llm_model import LocalLLM
+            llm_model = LocalLLM(models["llm"], device=args.device)
+    Ingestor(config, clip_model, args, blip_model, llm_model).run(paths, sources)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+import hashlib
+import os
+import re
+import tempfile
+import time
+from threading import Lock
+from src.utils.hashing import bytes_hash, perceptual_hash
+from src.utils.logger import setup_logger
+from src.utils.metrics import metrics
+
+_CACHE_FILE = re.compile(r"^[0-9a-f]{64}\.jpg$")
+# Size-based eviction trims to this fraction of max_bytes so it doesn't rerun on every store.
+_LOW_WATERMARK = 0.9
+
+
+def _url_key(url):
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+class DownloadCache:
+    """Content-addressed store for downloaded images.
+
+    Every image is written once to `<image_dir>/<sha256>.jpg` through a temp
+    file and `os.replace`, so concurrent sessions never see partial or
+    overwritten files and byte-identical downloads share one file.
+    `urls.log` is an append-only `<url hash> <content hash>` map that lets
+    repeat URLs skip the network entirely. Files are evicted oldest-access
+    first once the directory exceeds `max_bytes`, or when older than
+    `max_age_seconds`.
+
+    With `phash_max_distance` set, a download whose dHash is within that
+    many bits of a cached image (the same photo re-encoded or resized) is
+    recorded as its near-duplicate in `duplicates.log`
+    (`<content hash> <cached content hash>`), and `canonical` maps it to
+    the earlier file so a fetch can drop it. Each URL still maps to its own
+    bytes: dHash also collides for unrelated sparse images (simple shapes
+    or text on a plain background), so it is a hint, never an alias.
+    `phash.log` holds `<content hash> <dhash>` lines, and lookups split
+    hashes into `phash_max_distance + 1` bands: two hashes within the
+    distance must agree exactly on at least one band.
+    """
+
+    def __init__(self, image_dir, max_bytes=None, max_age_seconds=None, phash_max_distance=None):
+        self.image_dir = image_dir
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.phash_max_distance = phash_max_distance
+        self.index_path = os.path.join(image_dir, "urls.log")
+        self.phash_path = os.path.join(image_dir, "phash.log")
+        self.duplicates_path = os.path.join(image_dir, "duplicates.log")
+        self.urls = {}  # {url_hash: content_hash}
+        self.phashes = {}  # {content_hash: dhash}
+        self.phash_bands = {}  # {(band, bits): {content_hash}}
+        self.duplicates = {}  # {content_hash: content hash of the cached image it nearly duplicates}
+        if phash_max_distance is not None:
+            bounds = [round(i * 64 / (phash_max_distance + 1)) for i in range(phash_max_distance + 2)]
+            self.band_masks = [(lo, (1 << (hi - lo)) - 1) for lo, hi in zip(bounds, bounds[1:])]
+        self.total_bytes = 0
+        self.eviction_listeners = []
+        self.lock = Lock()
+        self.evict_lock = Lock()
+        self.logger = setup_logger()
+        os.makedirs(image_dir, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r") as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) == 2:
+                        self.urls[parts[0]] = parts[1]
+        if self.phash_max_distance is not None and os.path.exists(self.phash_path):
+            with open(self.phash_path, "r") as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) == 2 and os.path.exists(self.path_for(parts[0])):
+                        self._add_phash(parts[0], int(parts[1], 16))
+        if self.phash_max_distance is not None and os.path.exists(self.duplicates_path):
+            with open(self.duplicates_path, "r") as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) == 2:
+                        self.duplicates[parts[0]] = parts[1]
+        self.total_bytes = sum(size for _, size, _ in self._entries())
+
+    def _entries(self):
+        """Yield (path, size, last_access) for every cache-managed file."""
+        with os.scandir(self.image_dir) as it:
+            for entry in it:
+                if _CACHE_FILE.match(entry.name):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    yield entry.path, stat.st_size, stat.st_mtime
+
+    def _bands(self, dhash):
+        return [(band, (dhash >> lo) & mask) for band, (lo, mask) in enumerate(self.band_masks)]
+
+    def _add_phash(self, content_hash, dhash):
+        self.phashes[content_hash] = dhash
+        for key in self._bands(dhash):
+            self.phash_bands.setdefault(key, set()).add(content_hash)
+
+    def _remove_phash(self, content_hash):
+        dhash = self.phashes.pop(content_hash, None)
+        if dhash is None:
+            return
+        for key in self._bands(dhash):
+            members = self.phash_bands.get(key)
+            if members is not None:
+                members.discard(content_hash)
+                if not members:
+                    del self.phash_bands[key]
+
+    def _near_duplicate(self, dhash):
+        """Content hash of a cached image within `phash_max_distance` bits of `dhash`, or None."""
+        with self.lock:
+            candidates = set()
+            for key in self._bands(dhash):
+                candidates |= self.phash_bands.get(key, set())
+            for content_hash in candidates:
+                if bin(self.phashes[content_hash] ^ dhash).count("1") <= self.phash_max_distance:
+                    return content_hash
+        return None
+
+    def path_for(self, content_hash):
+        return os.path.join(self.image_dir, f"{content_hash}.jpg")
+
+    def canonical(self, path):
+        """The cached image `path` nearly duplicates (see `phash_max_distance`), or `path` itself."""
+        original = self.duplicates.get(os.path.splitext(os.path.basename(path))[0])
+        if original is not None:
+            original_path = self.path_for(original)
+            if os.path.exists(original_path):
+                return original_path
+        return path
+
+    def _touch(self, path):
+        # mtime doubles as last-access time for eviction; atime is often disabled.
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def lookup(self, url):
+        """Return the cached path for `url`, or None if it must be downloaded."""
+        content_hash = self.urls.get(_url_key(url))
+        if content_hash is None:
+            return None
+        path = self.path_for(content_hash)
+        return path if self._touch(path) else None
+
+    def store(self, url, data):
+        """Write downloaded bytes (deduplicated by content) and return the cached path."""
+        content_hash = bytes_hash(data)
+        path = self.path_for(content_hash)
+        exists, dhash, duplicate = self._touch(path), None, None
+        if not exists and self.phash_max_distance is not None:
+            try:
+                dhash = perceptual_hash(data)
+            except Exception:
+                pass  # not decodable here; store as-is and let decoding downstream decide
+            duplicate = self._near_duplicate(dhash) if dhash is not None else None
+            if duplicate is not None and os.path.exists(self.path_for(duplicate)):
+                metrics.inc("near_duplicates_total", stage="download")
+            else:
+                duplicate = None
+        if not exists:
+            fd, tmp_path = tempfile.mkstemp(dir=self.image_dir, suffix=".part")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            with self.lock:
+                self.total_bytes += len(data)
+                if duplicate is not None:
+                    # Only originals join the bands, so duplicates never chain.
+                    self.duplicates[content_hash] = duplicate
+                    with open(self.duplicates_path, "a") as f:
+                        f.write(f"{content_hash} {duplicate}\n")
+                elif dhash is not None:
+                    self._add_phash(content_hash, dhash)
+                    with open(self.phash_path, "a") as f:
+                        f.write(f"{content_hash} {dhash:016x}\n")
+        url_key = _url_key(url)
+        with self.lock:
+            if self.urls.get(url_key) != content_hash:
+                self.urls[url_key] = content_hash
+                with open(self.index_path, "a") as f:
+                    f.write(f"{url_key} {content_hash}\n")
+            over_budget = self.max_bytes is not None and self.total_bytes > self.max_bytes
+        if over_budget:
+            self.evict()
+        return path
+
+    def evict(self, deadline=None):
+        """Remove expired files, then the least recently used until under `max_bytes`.
+
+        Stops early once `time.monotonic()` passes `deadline`; the next run picks up the rest.
+        """
+        with self.evict_lock:
+            now = time.time()
+            entries = sorted(self._entries(), key=lambda e: e[2])
+            total = sum(size for _, size, _ in entries)
+            target_bytes = self.max_bytes * _LOW_WATERMARK if self.max_bytes is not None else None
+            evicted = []
+            for path, size, last_access in entries:
+                expired = self.max_age_seconds is not None and now - last_access > self.max_age_seconds
+                over_budget = target_bytes is not None and total > target_bytes
+                if not (expired or over_budget):
+                    # Entries are oldest first, so nothing later can be expired either.
+                    break
+                if deadline is not None and time.monotonic() > deadline:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                evicted.append(path)
+            with self.lock:
+                self.total_bytes = total
+            if evicted:
+                self._compact_index()
+        if evicted:
+            self.logger.info(f"Evicted {len(evicted)} cached images from {self.image_dir}")
+            for listener in self.eviction_listeners:
+                listener(evicted)
+        return len(evicted)
+
+    def _compact_index(self):
+        """Rewrite `urls.log` (and `phash.log`, `duplicates.log`) without entries whose files are gone.
+
+        Files are checked against a snapshot without holding `self.lock`, so
+        lookups and stores aren't stalled behind a stat per cached image; only
+        the (few) missing hashes are rechecked under the lock, in case a
+        concurrent store brought one back.
+        """
+        with self.lock:
+            hashes = set(self.urls.values()) | set(self.phashes) | set(self.duplicates) | set(self.duplicates.values())
+        missing = [h for h in hashes if not os.path.exists(self.path_for(h))]
+        with self.lock:
+            gone = set(h for h in missing if not os.path.exists(self.path_for(h)))
+            self.urls = {k: h for k, h in self.urls.items() if h not in gone}
+            tmp_path = f"{self.index_path}.tmp"
+            with open(tmp_path, "w") as f:
+                f.writelines(f"{k} {h}\n" for k, h in self.urls.items())
+            os.replace(tmp_path, self.index_path)
+            if self.phash_max_distance is None:
+                return
+            for content_hash in gone:
+                self._remove_phash(content_hash)
+            tmp_path = f"{self.phash_path}.tmp"
+            with open(tmp_path, "w") as f:
+                f.writelines(f"{h} {d:016x}\n" for h, d in self.phashes.items())
+            os.replace(tmp_path, self.phash_path)
+            self.duplicates = {h: o for h, o in self.duplicates.items() if h not in gone and o not in gone}
+            tmp_path = f"{self.duplicates_path}.tmp"
+            with open(tmp_path, "w") as f:
+                f.writelines(f"{h} {o}\n" for h, o in self.duplicates.items())
+            os.replace(tmp_path, self.duplicates_path)
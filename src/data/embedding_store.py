@@ -0,0 +1,323 @@
+import fcntl
+import os
+import re
+import numpy as np
+from contextlib import contextmanager
+from threading import Lock
+from src.utils.hashing import file_hash
+from src.utils.logger import setup_logger
+
+
+def model_store_dir(store_dir, model_name):
+    """Directory under `store_dir` holding the embeddings of `model_name`."""
+    return os.path.join(store_dir, re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name))
+
+
+@contextmanager
+def _file_lock(path, operation=fcntl.LOCK_EX):
+    """Hold a `flock` on `path` (created if missing); released when the file is closed."""
+    with open(path, "a") as f:
+        fcntl.flock(f, operation)
+        yield
+
+
+class EmbeddingStore:
+    """On-disk CLIP embedding cache keyed by image content hash.
+
+    Vectors live in a memory-mapped `embeddings.dat` matrix, one row per
+    unique image; `index.log` is an append-only list of `<hash> <row>` lines
+    mapping content hashes to rows, with `<hash> -1` marking a removal.
+    `compact` rewrites both without dead rows. Each CLIP model gets its own directory,
+    so switching models never mixes incompatible vectors; so does `fast_decode`,
+    since draft-decoded crops embed slightly differently from CLIP's preprocess.
+
+    Several processes can share a store (the app and a bulk ingest, say).
+    Writes hold an exclusive `flock` on `store.lock` and first replay the
+    lines other processes appended to `index.log`, so a row is never handed
+    out twice; reads replay them under a shared lock when the log changed.
+    A compaction elsewhere replaces the files, which shows up as a new
+    `index.log` inode and triggers a full reload.
+    """
+
+    def __init__(self, store_dir, model_name, dtype="float16", initial_capacity=1024, fast_decode=False):
+        self.model_name = model_name
+        self.store_dir = model_store_dir(store_dir, f"{model_name}-fast" if fast_decode else model_name)
+        self.dtype = np.dtype(dtype)
+        self.initial_capacity = initial_capacity
+        self.matrix_path = os.path.join(self.store_dir, "embeddings.dat")
+        self.index_path = os.path.join(self.store_dir, "index.log")
+        self.meta_path = os.path.join(self.store_dir, "meta.txt")
+        self.lock_path = os.path.join(self.store_dir, "store.lock")
+        self.compact_lock_path = os.path.join(self.store_dir, "compact.lock")
+        self.matrix = None
+        self._reset()
+        self.lock = Lock()
+        self.logger = setup_logger()
+        os.makedirs(self.store_dir, exist_ok=True)
+        with self.lock, _file_lock(self.lock_path):
+            self._finish_compaction()
+            self._load()
+
+    def _reset(self):
+        if self.matrix is not None:
+            self.matrix.flush()
+        self.dead_rows = 0
+        self.rows = {}  # {content_hash: row}
+        self.next_row = 0
+        self.dim = None
+        self.capacity = 0
+        self.matrix = None
+        self.index_offset = 0  # bytes of index.log applied so far
+        self.index_inode = None
+
+    def _finish_compaction(self):
+        """Complete or roll back a compaction interrupted by a crash (call with the store file lock held).
+
+        `compact` replaces the matrix before the index, both under the store
+        file lock; a leftover new index with no leftover new matrix means only
+        the index swap is missing. A leftover new matrix is removed unless
+        another compaction still holds `compact.lock`.
+        """
+        new_index, new_matrix = f"{self.index_path}.new", f"{self.matrix_path}.new"
+        if os.path.exists(new_matrix):
+            try:
+                with _file_lock(self.compact_lock_path, fcntl.LOCK_EX | fcntl.LOCK_NB):
+                    os.remove(new_matrix)
+                    if os.path.exists(new_index):
+                        os.remove(new_index)
+            except BlockingIOError:
+                pass
+        elif os.path.exists(new_index):
+            os.replace(new_index, self.index_path)
+
+    def _file_rows(self):
+        row_bytes = self.dim * self.dtype.itemsize
+        return os.path.getsize(self.matrix_path) // row_bytes if os.path.exists(self.matrix_path) else 0
+
+    def _load(self):
+        if not os.path.exists(self.meta_path):
+            return
+        with open(self.meta_path, "r") as f:
+            dim, dtype = f.read().split()
+        if np.dtype(dtype) != self.dtype:
+            self.logger.warning(
+                f"Embedding store {self.store_dir} uses {dtype}, ignoring requested {self.dtype}"
+            )
+            self.dtype = np.dtype(dtype)
+        self.dim = int(dim)
+        self._read_index()
+        file_rows = self._file_rows()
+        # Drop index entries whose rows never made it to disk (e.g. a crash mid-grow).
+        self.rows = {h: r for h, r in self.rows.items() if r < file_rows}
+        self.next_row = min(self.next_row, file_rows)
+        self.dead_rows = self.next_row - len(self.rows)
+        self._open_matrix(max(file_rows, self.initial_capacity))
+        self.logger.info(f"Loaded {len(self.rows)} cached embeddings from {self.store_dir}")
+
+    def _read_index(self):
+        """Apply the `index.log` lines written (by any process) since the last read."""
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, "rb") as f:
+            self.index_inode = os.fstat(f.fileno()).st_ino
+            f.seek(self.index_offset)
+            data = f.read()
+        # A torn final line (a writer crashed mid-append) is left unread.
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].decode("utf-8").splitlines():
+            parts = line.split()
+            if len(parts) != 2:
+                continue
+            if parts[1] == "-1":
+                self.rows.pop(parts[0], None)
+            else:
+                row = int(parts[1])
+                self.rows[parts[0]] = row
+                self.next_row = max(self.next_row, row + 1)
+        self.index_offset += end
+        self.dead_rows = self.next_row - len(self.rows)
+
+    def _stale(self):
+        try:
+            stat = os.stat(self.index_path)
+        except FileNotFoundError:
+            return self.dim is None and os.path.exists(self.meta_path)
+        return stat.st_ino != self.index_inode or stat.st_size != self.index_offset
+
+    def _sync(self):
+        """Catch up with what other processes wrote to the store (call with the store file lock held)."""
+        if not self._stale():
+            return
+        try:
+            stat = os.stat(self.index_path)
+        except FileNotFoundError:
+            stat = None
+        if self.dim is None or stat is None or stat.st_ino != self.index_inode or stat.st_size < self.index_offset:
+            # The first vectors were stored elsewhere, or another process compacted the files.
+            self._reset()
+            self._finish_compaction()
+            self._load()
+            return
+        self._read_index()
+        if self.next_row > self.capacity:
+            self._open_matrix(self._file_rows())
+
+    def _append_index(self, lines):
+        with open(self.index_path, "ab") as f:
+            if f.tell() > self.index_offset:
+                f.write(b"\n")  # terminate a torn line so ours parse
+            f.write("".join(lines).encode("utf-8"))
+            self.index_offset = f.tell()
+            self.index_inode = os.fstat(f.fileno()).st_ino
+
+    def _open_matrix(self, capacity):
+        row_bytes = self.dim * self.dtype.itemsize
+        if self.matrix is not None:
+            self.matrix.flush()
+            self.matrix = None
+        with open(self.matrix_path, "ab") as f:
+            if f.tell() < capacity * row_bytes:
+                f.truncate(capacity * row_bytes)
+        self.matrix = np.memmap(self.matrix_path, dtype=self.dtype, mode="r+", shape=(capacity, self.dim))
+        self.capacity = capacity
+
+    def _init_dim(self, dim):
+        self.dim = dim
+        with open(self.meta_path, "w") as f:
+            f.write(f"{dim} {self.dtype.name}")
+        self._open_matrix(self.initial_capacity)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, content_hash):
+        return content_hash in self.rows
+
+    def hash_paths(self, paths):
+        """Return the content hash of each path, or None for unreadable files."""
+        hashes = []
+        for path in paths:
+            try:
+                hashes.append(file_hash(path))
+            except OSError:
+                hashes.append(None)
+        return hashes
+
+    def get_many(self, hashes):
+        """Return a float32 (len(hashes), dim) matrix and a boolean mask of hits."""
+        with self.lock:
+            if self._stale():
+                with _file_lock(self.lock_path, fcntl.LOCK_SH):
+                    self._sync()
+            found = np.array([h in self.rows for h in hashes], dtype=bool)
+            if self.dim is None:
+                return np.zeros((len(hashes), 0), dtype=np.float32), found
+            vectors = np.zeros((len(hashes), self.dim), dtype=np.float32)
+            if found.any():
+                rows = [self.rows[h] for h, hit in zip(hashes, found) if hit]
+                vectors[found] = self.matrix[rows]
+            return vectors, found
+
+    def put_many(self, hashes, vectors):
+        """Store one vector per hash; hashes already present are left untouched."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self.lock, _file_lock(self.lock_path):
+            self._sync()
+            if self.dim is None:
+                self._init_dim(vectors.shape[1])
+            new_rows = []
+            for content_hash, vector in zip(hashes, vectors):
+                if content_hash is None or content_hash in self.rows:
+                    continue
+                row = self.next_row
+                if row >= self.capacity:
+                    self._open_matrix(max(self.capacity * 2, self._file_rows()))
+                self.matrix[row] = vector
+                self.rows[content_hash] = row
+                self.next_row += 1
+                new_rows.append(f"{content_hash} {row}\n")
+            if new_rows:
+                # Rows hit the matrix before the index references them.
+                self.matrix.flush()
+                self._append_index(new_rows)
+            return len(new_rows)
+
+    def remove(self, hashes):
+        """Forget the given hashes; their rows stay on disk until `compact`."""
+        with self.lock, _file_lock(self.lock_path):
+            self._sync()
+            removed = [h for h in hashes if self.rows.pop(h, None) is not None]
+            if removed:
+                self._append_index([f"{h} -1\n" for h in removed])
+                self.dead_rows += len(removed)
+            return len(removed)
+
+    def compact(self, min_dead_fraction=0.0):
+        """Rewrite the matrix and index without dead rows.
+
+        Skipped (returning 0) unless at least `min_dead_fraction` of the used
+        rows are dead, or while another thread or process is compacting this
+        store; otherwise returns the number of rows reclaimed.
+
+        Rows are never rewritten once stored, so the live rows of a snapshot
+        are copied without holding the store locks; searches and `put_many`
+        (here or in other processes) keep running meanwhile. The locks are
+        only taken again to append rows stored (and mark rows removed) since
+        the snapshot, then swap files.
+        """
+        try:
+            with _file_lock(self.compact_lock_path, fcntl.LOCK_EX | fcntl.LOCK_NB):
+                reclaimed = self._compact(min_dead_fraction)
+        except BlockingIOError:  # another thread or process is compacting
+            return 0
+        if reclaimed:
+            self.logger.info(f"Compacted {self.store_dir}: reclaimed {reclaimed} rows, {len(self.rows)} live")
+        return reclaimed
+
+    def _compact(self, min_dead_fraction):
+        with self.lock, _file_lock(self.lock_path):
+            self._sync()
+            used = self.next_row
+            if self.dim is None or not self.dead_rows or self.dead_rows < min_dead_fraction * used:
+                return 0
+            live = sorted(self.rows.items(), key=lambda item: item[1])
+            source = self.matrix
+        new_matrix_path, new_index_path = f"{self.matrix_path}.new", f"{self.index_path}.new"
+        with open(new_matrix_path, "wb") as f:
+            self._copy_rows(source, [row for _, row in live], f)
+        with open(new_index_path, "w") as f:
+            f.writelines(f"{h} {row}\n" for row, (h, _) in enumerate(live))
+        del source
+
+        with self.lock, _file_lock(self.lock_path):
+            self._sync()
+            rows = {h: row for row, (h, _) in enumerate(live)}
+            removed = [h for h in rows if h not in self.rows]
+            added = sorted(((h, r) for h, r in self.rows.items() if r >= used), key=lambda item: item[1])
+            with open(new_matrix_path, "ab") as f:
+                self._copy_rows(self.matrix, [row for _, row in added], f)
+                f.flush()
+                os.fsync(f.fileno())
+            with open(new_index_path, "a") as f:
+                f.writelines(f"{h} {len(live) + i}\n" for i, (h, _) in enumerate(added))
+                f.writelines(f"{h} -1\n" for h in removed)
+                f.flush()
+                os.fsync(f.fileno())
+            self.matrix.flush()
+            self.matrix = None
+            os.replace(new_matrix_path, self.matrix_path)
+            os.replace(new_index_path, self.index_path)
+            stat = os.stat(self.index_path)
+            self.index_offset, self.index_inode = stat.st_size, stat.st_ino
+            for h in removed:
+                del rows[h]
+            rows.update((h, len(live) + i) for i, (h, _) in enumerate(added))
+            self.rows = rows
+            self.next_row = len(live) + len(added)
+            self.dead_rows = len(removed)
+            self._open_matrix(max(self.initial_capacity, self.next_row))
+        return used - len(live)
+
+    def _copy_rows(self, source, rows, f, chunk_rows=4096):
+        for start in range(0, len(rows), chunk_rows):
+            f.write(np.ascontiguousarray(source[rows[start:start + chunk_rows]], dtype=self.dtype).tobytes())
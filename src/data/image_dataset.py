@@ -1,20 +1,47 @@
 from torch.utils.data import Dataset, DataLoader
 from PIL import Image
 import torch
+from src.data.preprocessing import decode_and_resize, find_normalize, to_clip_tensor
+from src.utils.hashing import file_hash
+from src.utils.metrics import metrics
 
 class ImageDataset(Dataset):
-    def __init__(self, image_paths, transform):
+    def __init__(self, image_paths, transform, fast_decode=False, preprocessed_cache=None):
+        """With `fast_decode` (or a `preprocessed_cache`), images are draft-decoded to a
+        uint8 224px crop and normalized directly, instead of running `transform` on
+        the full-resolution image.
+        """
         self.image_paths = image_paths
         self.transform = transform
+        self.fast_decode = fast_decode or preprocessed_cache is not None
+        self.preprocessed_cache = preprocessed_cache
+        self.normalize = find_normalize(transform) if self.fast_decode else None
 
     def __len__(self):
         return len(self.image_paths)
 
+    def _load_crop(self, image_path):
+        if self.preprocessed_cache is None:
+            return decode_and_resize(image_path, draft=True)
+        content_hash = file_hash(image_path)
+        crop = self.preprocessed_cache.get(content_hash)
+        if crop is not None:
+            metrics.inc("cache_hits_total", cache="preprocessed")
+            return crop
+        metrics.inc("cache_misses_total", cache="preprocessed")
+        crop = decode_and_resize(image_path, draft=True)
+        self.preprocessed_cache.put(content_hash, crop)
+        return crop
+
     def __getitem__(self, idx):
         image_path = self.image_paths[idx]
         try:
-            image = Image.open(image_path).convert("RGB")
-            processed_image = self.transform(image)
+            with metrics.span("decode"):
+                if self.fast_decode:
+                    processed_image = to_clip_tensor(self._load_crop(image_path)[None], self.normalize)[0]
+                else:
+                    image = Image.open(image_path).convert("RGB")
+                    processed_image = self.transform(image)
             return {"path": image_path, "image": processed_image}
         except Exception as e:
             print(f"Skipping invalid image: {image_path}")
@@ -27,4 +54,4 @@ def collate_fn(batch):
     return {
         "path": [b["path"] for b in batch],
         "image": torch.stack([b["image"] for b in batch])
-    }
\ No newline at end of file
+    }
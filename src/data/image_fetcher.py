@@ -1,46 +1,248 @@
 import os
+import time
 import aiohttp
 import asyncio
+import itertools
+from collections import OrderedDict
 from duckduckgo_search import DDGS
+from src.data.download_cache import DownloadCache
 from src.utils.logger import setup_logger
+from src.utils.metrics import metrics
+
+_IMAGE_SIGNATURES = (b"\xff\xd8\xff", b"\x89PNG\r\n\x1a\n", b"GIF87a", b"GIF89a")
+_SIGNATURE_BYTES = 12  # enough for every signature, including WebP's RIFF....WEBP
+
+
+def _is_image(head):
+    """Whether `head` starts with a JPEG, PNG, GIF or WebP signature."""
+    return head.startswith(_IMAGE_SIGNATURES) or (head[:4] == b"RIFF" and head[8:12] == b"WEBP")
+
+
+def _interleave(url_lists):
+    """Merge per-query URL lists best rank first (every query's #1, then every #2, ...), without repeats."""
+    ranked = (url for urls in itertools.zip_longest(*url_lists) for url in urls if url is not None)
+    return list(dict.fromkeys(ranked))
+
+
+class _Rejected(Exception):
+    pass
+
 
 class ImageFetcher:
-    def __init__(self, image_dir):
+    def __init__(self, image_dir, cache=None, executors=None, url_cache_ttl=0, url_cache_size=10000,
+                 max_image_bytes=8 * 1024 * 1024, min_image_bytes=1024, connections=50, connections_per_host=4,
+                 wave_size=16, timeout_seconds=10):
+        """With `url_cache_ttl`, DuckDuckGo results are reused for that many seconds per (query, max_results).
+
+        Downloads share one pooled `aiohttp` session with at most
+        `connections` sockets, `connections_per_host` per host. Payloads that
+        declare or stream more than `max_image_bytes`, fewer than
+        `min_image_bytes`, or don't start with an image signature are dropped
+        mid-transfer.
+        """
         self.image_dir = image_dir
         os.makedirs(image_dir, exist_ok=True)
+        self.cache = cache or DownloadCache(image_dir)
+        self.executors = executors
+        self.inflight = {}  # {url: Task} so concurrent sessions share one download
+        self.url_cache_ttl = url_cache_ttl
+        self.url_cache_size = url_cache_size
+        self.url_cache = OrderedDict()  # {(query, max_results): (expires, urls)}
+        self.max_image_bytes = max_image_bytes
+        self.min_image_bytes = min_image_bytes
+        self.connections = connections
+        self.connections_per_host = connections_per_host
+        self.wave_size = wave_size
+        self.timeout_seconds = timeout_seconds
+        self.session = None
+        self.session_loop = None
         self.logger = setup_logger()
 
+    def _search_urls(self, query, max_results):
+        with DDGS() as ddgs:
+            results = ddgs.images(query, max_results=max_results)
+            return [img["image"] for img in results if img["image"].endswith(".jpg")]
+
     async def fetch_image_urls(self, query, max_results=20):
+        key = (query, max_results)
+        cached = self.url_cache.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            metrics.inc("cache_hits_total", cache="ddg")
+            return cached[1]
         urls = []
         try:
-            with DDGS() as ddgs:
-                results = ddgs.images(query, max_results=max_results)
-                urls = [img["image"] for img in results if img["image"].endswith(".jpg")]
+            # DDGS is synchronous; keep it off the event loop.
+            with metrics.span("ddg"):
+                if self.executors is not None:
+                    urls = await self.executors.run_io(self._search_urls, query, max_results, name="ddg")
+                else:
+                    urls = await asyncio.to_thread(self._search_urls, query, max_results)
         except Exception as e:
             self.logger.error(f"Error fetching images for {query}: {e}")
+            return urls
+        if self.url_cache_ttl:
+            self.url_cache[key] = (time.monotonic() + self.url_cache_ttl, urls)
+            self.url_cache.move_to_end(key)
+            while len(self.url_cache) > self.url_cache_size:
+                self.url_cache.popitem(last=False)
         return urls
 
-    async def download_image(self, session, url, save_path):
+    def _get_session(self):
+        """The pooled client session, created on first use in (and bound to) the running loop.
+
+        A session left over from another loop is closed on that loop if it is
+        still running, or else from this one (sockets already tied to a
+        closed loop are only released when collected).
+        """
+        loop = asyncio.get_running_loop()
+        if self.session is None or self.session.closed or self.session_loop is not loop:
+            if self.session is not None and not self.session.closed:
+                if self.session_loop.is_running():
+                    asyncio.run_coroutine_threadsafe(self.session.close(), self.session_loop)
+                else:
+                    loop.create_task(self.session.close())
+            connector = aiohttp.TCPConnector(
+                limit=self.connections, limit_per_host=self.connections_per_host, ttl_dns_cache=300
+            )
+            self.session = aiohttp.ClientSession(
+                connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout_seconds)
+            )
+            self.session_loop = loop
+        return self.session
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+    async def _read_image(self, response):
+        """Stream the body, giving up as soon as it is clearly not an acceptable image."""
+        if response.status != 200:
+            raise _Rejected("status")
+        # The response headers arrive before the body, so this is the HEAD check without an extra round trip.
+        if response.content_length is not None and response.content_length > self.max_image_bytes:
+            raise _Rejected("too_large")
+        content_type = response.headers.get("Content-Type", "")
+        if content_type.startswith(("text/", "application/json")):
+            raise _Rejected("not_image")
+        chunks, size, checked = [], 0, False
+        async for chunk in response.content.iter_chunked(64 * 1024):
+            size += len(chunk)
+            if size > self.max_image_bytes:
+                raise _Rejected("too_large")
+            chunks.append(chunk)
+            # Chunks can be smaller than a signature; sniff once enough bytes arrived.
+            if not checked and size >= _SIGNATURE_BYTES:
+                if not _is_image(b"".join(chunks)[:_SIGNATURE_BYTES]):
+                    raise _Rejected("not_image")
+                checked = True
+        if not checked and not _is_image(b"".join(chunks)):
+            raise _Rejected("not_image")
+        if size < self.min_image_bytes:
+            raise _Rejected("too_small")
+        return b"".join(chunks)
+
+    async def download_image(self, url):
         try:
-            async with session.get(url, timeout=10) as response:
-                if response.status == 200:
-                    image_data = await response.read()
-                    with open(save_path, "wb") as f:
-                        f.write(image_data)
-                    return save_path
+            with metrics.span("download"):
+                async with self._get_session().get(url) as response:
+                    image_data = await self._read_image(response)
+            # Hashing (and perceptual hashing) plus the write stay off the event loop.
+            if self.executors is not None:
+                path = await self.executors.run_io(self.cache.store, url, image_data)
+            else:
+                path = await asyncio.to_thread(self.cache.store, url, image_data)
+            metrics.inc("images_fetched_total")
+            metrics.inc("image_bytes_total", len(image_data))
+            return path
+        except _Rejected as e:
+            self.logger.debug(f"Skipped {url}: {e}")
+            metrics.inc("images_rejected_total", reason=str(e))
+            return None
         except Exception as e:
             self.logger.error(f"Failed to download {url}: {e}")
+        metrics.inc("images_failed_total")
         return None
 
-    async def fetch_images(self, queries, max_results=20):
-        connector = aiohttp.TCPConnector(limit=50)
-        async with aiohttp.ClientSession(connector=connector) as session:
-            tasks = [self.fetch_image_urls(query, max_results) for query in queries]
-            all_urls = await asyncio.gather(*tasks)
-            image_urls = [url for urls in all_urls for url in urls]
-            tasks = [
-                self.download_image(session, url, f"{self.image_dir}/img_{i}.jpg")
-                for i, url in enumerate(image_urls)
-            ]
-            results = await asyncio.gather(*tasks)
-            return [path for path in results if path]
\ No newline at end of file
+    def _unique_images(self, paths):
+        """Drop repeats: different URLs can resolve to the same (or a near-duplicate) cached file."""
+        seen, unique = set(), []
+        for path in paths:
+            key = self.cache.canonical(path)
+            if key not in seen:
+                seen.add(key)
+                unique.append(path)
+        return unique
+
+    async def get_image(self, url):
+        """Return a cached path for `url`, downloading it at most once across sessions."""
+        path = self.cache.lookup(url)
+        if path is not None:
+            metrics.inc("cache_hits_total", cache="download")
+            return path
+        task = self.inflight.get(url)
+        if task is None:
+            task = asyncio.ensure_future(self.download_image(url))
+            self.inflight[url] = task
+            task.add_done_callback(lambda _: self.inflight.pop(url, None))
+        return await asyncio.shield(task)
+
+    async def stream_images(self, queries, max_results, queue):
+        """Put each image path on `queue` as soon as its download finishes.
+
+        URLs are downloaded best DuckDuckGo rank first across all queries,
+        `wave_size` at a time, so a consumer that stops early (by cancelling
+        this coroutine) has the most promising images and skipped the tail.
+        """
+        pending = asyncio.PriorityQueue()
+        scheduled = set()
+        order = itertools.count()
+
+        async def fetch_query(query):
+            for rank, url in enumerate(await self.fetch_image_urls(query, max_results)):
+                if url not in scheduled:
+                    scheduled.add(url)
+                    pending.put_nowait((rank, next(order), url))
+
+        emitted = set()
+
+        async def download():
+            while True:
+                _, _, url = await pending.get()
+                try:
+                    path = await self.get_image(url)
+                    # Different URLs can resolve to the same (or a near-duplicate) cached file.
+                    if path and self.cache.canonical(path) not in emitted:
+                        emitted.add(self.cache.canonical(path))
+                        await queue.put(path)
+                finally:
+                    pending.task_done()
+
+        workers = [asyncio.ensure_future(download()) for _ in range(self.wave_size)]
+        try:
+            await asyncio.gather(*(fetch_query(query) for query in queries))
+            await pending.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+    async def fetch_images(self, queries, max_results=20, enough=None):
+        """Download the images DuckDuckGo returns for `queries`; returns their cached paths.
+
+        Without `enough` every URL is fetched at once. With it, URLs go best
+        rank first in waves of `wave_size`, and after each wave
+        `await enough(paths)` decides whether the images so far suffice, in
+        which case the lower-ranked rest is never downloaded.
+        """
+        all_urls = await asyncio.gather(*(self.fetch_image_urls(query, max_results) for query in queries))
+        # The same URL often comes back for several query variants.
+        image_urls = _interleave(all_urls)
+        wave_size = self.wave_size if enough is not None else max(len(image_urls), 1)
+        paths = []
+        for start in range(0, len(image_urls), wave_size):
+            results = await asyncio.gather(*(self.get_image(url) for url in image_urls[start:start + wave_size]))
+            paths = self._unique_images(paths + [path for path in results if path])
+            if enough is not None and start + wave_size < len(image_urls) and await enough(paths):
+                metrics.inc("fetch_early_stops_total")
+                self.logger.info(f"Stopped fetching after {start + wave_size} of {len(image_urls)} images")
+                break
+        return paths
@@ -0,0 +1,102 @@
+import os
+import tempfile
+import numpy as np
+import torch
+from PIL import Image
+from torchvision.transforms import Compose, Normalize, ToTensor
+
+CLIP_INPUT_SIZE = 224
+
+
+def decode_and_resize(image_path, size=CLIP_INPUT_SIZE, draft=False):
+    """Decode an image and apply CLIP's resize + center crop, returning (size, size, 3) uint8.
+
+    With `draft`, JPEGs are decoded at the smallest DCT scale (1/2, 1/4, 1/8)
+    that still covers `size` on both sides, skipping most of the decode work
+    for multi-megapixel downloads.
+    """
+    with Image.open(image_path) as image:
+        if draft:
+            image.draft("RGB", (size, size))
+        image = image.convert("RGB")
+        width, height = image.size
+        scale = size / min(width, height)
+        resized = image.resize(
+            (max(size, round(width * scale)), max(size, round(height * scale))), Image.BICUBIC
+        )
+    left = (resized.width - size) // 2
+    top = (resized.height - size) // 2
+    return np.asarray(resized.crop((left, top, left + size, top + size)), dtype=np.uint8)
+
+
+def find_normalize(preprocess):
+    """Return the Normalize step of a torchvision Compose (CLIP's `preprocess`)."""
+    for transform in getattr(preprocess, "transforms", []):
+        if isinstance(transform, Normalize):
+            return transform
+    raise ValueError("preprocess has no Normalize transform")
+
+
+def find_resize(preprocess):
+    """Return the steps of a torchvision Compose (CLIP's `preprocess`) that run before ToTensor.
+
+    They produce exactly the PIL image CLIP would turn into a tensor, so
+    `to_clip_tensor` on it matches `preprocess` without draft decoding.
+    """
+    transforms = getattr(preprocess, "transforms", [])
+    for position, transform in enumerate(transforms):
+        if isinstance(transform, ToTensor):
+            return Compose(transforms[:position])
+    raise ValueError("preprocess has no ToTensor transform")
+
+
+def fast_decode_enabled(data_config):
+    """Whether images are embedded from draft-decoded crops (`fast_decode` or a preprocessed crop cache)."""
+    return bool(data_config["fast_decode"] or data_config["preprocessed_dir"])
+
+
+def to_clip_tensor(images, normalize):
+    """Turn (N, H, W, 3) uint8 images into a normalized (N, 3, H, W) float tensor."""
+    batch = torch.from_numpy(np.ascontiguousarray(images)).permute(0, 3, 1, 2).float().div_(255)
+    mean = torch.tensor(normalize.mean).view(1, 3, 1, 1)
+    std = torch.tensor(normalize.std).view(1, 3, 1, 1)
+    return (batch - mean) / std
+
+
+class PreprocessedCache:
+    """Disk cache of CLIP-ready (224, 224, 3) uint8 crops keyed by image content hash.
+
+    A crop is ~150 KB against ~600 KB for the float tensor, and loading it
+    skips decode and resize entirely.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, content_hash):
+        return os.path.join(self.cache_dir, f"{content_hash}.npy")
+
+    def get(self, content_hash):
+        try:
+            return np.load(self._path(content_hash), allow_pickle=False)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, content_hash, image):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".part")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, np.ascontiguousarray(image, dtype=np.uint8))
+        os.replace(tmp_path, self._path(content_hash))
+
+    def remove(self, paths):
+        """Delete the crops of evicted downloads (named `<content hash>.jpg`).
+
+        Registered as a `DownloadCache` eviction listener, this keeps the crop
+        cache bounded by the download cache's size and age limits.
+        """
+        for path in paths:
+            try:
+                os.remove(self._path(os.path.splitext(os.path.basename(path))[0]))
+            except FileNotFoundError:
+                pass
@@ -1,6 +1,7 @@
 from src.search.query_processor import QueryProcessor
 from src.search.image_searcher import ImageSearcher
 from src.data.image_fetcher import ImageFetcher
+from src.data.embedding_store import EmbeddingStore
 from src.utils.display import display_images
 from src.utils.logger import setup_logger
 import asyncio
@@ -8,7 +9,11 @@ import asyncio
 class CLIInterface:
     def __init__(self, config, clip_model, blip_model, llm_model):
         self.config = config
+        self.clip_model = clip_model
         self.fetcher = ImageFetcher(config["data"]["image_dir"])
+        self.embedding_store = EmbeddingStore(
+            config["data"]["embedding_dir"], clip_model.model_name, config["data"]["embedding_dtype"]
+        )
         self.query_processor = QueryProcessor(llm_model, blip_model)
         self.logger = setup_logger()
 
@@ -27,8 +32,11 @@ class CLIInterface:
                     break
                 continue
 
-            searcher = ImageSearcher(None, image_paths, self.config["data"]["batch_size"])
-            results = searcher.search(query)
+            searcher = ImageSearcher(
+                self.clip_model, image_paths, self.config["data"]["batch_size"],
+                self.embedding_store, self.config["search"]["fusion"]
+            )
+            results = searcher.search([query] + queries)
             print("\nTop images:")
             display_images(results)
 
@@ -1,49 +1,307 @@
 import gradio as gr
 import asyncio
 import os
+import random
 import time
 from src.search.query_processor import QueryProcessor
 from src.search.image_searcher import ImageSearcher
+from src.search.ann_index import IVFIndex
+from src.search.local_searcher import LocalSearcher
+from src.search.hybrid_searcher import HybridSearcher
+from src.search.lexical_index import BM25Index
+from src.search.layered_index import LayeredIVFIndex, LayeredBM25Index
+from src.search.relevance_feedback import RelevanceFeedbackSearcher
+from src.search.prefetch import SpeculativePrefetcher
+from src.search.streaming import StreamingSearcher
 from src.data.image_fetcher import ImageFetcher
+from src.data.download_cache import DownloadCache
+from src.data.embedding_store import EmbeddingStore
+from src.data.preprocessing import PreprocessedCache, fast_decode_enabled
+from src.utils.executors import ExecutorPool
 from src.utils.logger import setup_logger
-from src.utils.session_manager import SessionManager
+from src.utils.metrics import metrics
+from src.utils.profiling import profile_block
+from src.utils.session_manager import SessionManager, create_session_backend
 from PIL import Image
 
 class GradioInterface:
-    def __init__(self, config, clip_model, blip_model, llm_model):
+    def __init__(self, config, clip_model, blip_model, llm_model, base_indexes=None):
+        """`base_indexes` ({"index": IVFIndex, "lexical": BM25Index}) are shared, read-only indexes that
+        the ones at config index.path and lexical.path are layered over, for forked workers."""
         self.config = config
         self.clip_model = clip_model
         self.blip_model = blip_model
         self.llm_model = llm_model
-        self.fetcher = ImageFetcher(config["data"]["image_dir"])
+        executor_config = config["executors"]
+        self.executors = ExecutorPool(
+            executor_config["io_workers"], executor_config["inference_workers"],
+            executor_config["model_concurrency"]
+        )
+        self.download_cache = DownloadCache(
+            config["data"]["image_dir"], config["data"]["cache_max_bytes"], config["data"]["cache_max_age_seconds"],
+            config["data"]["phash_max_distance"]
+        )
+        self.fetcher = ImageFetcher(
+            config["data"]["image_dir"], self.download_cache, self.executors, config["data"]["ddg_cache_ttl_seconds"],
+            **config["data"]["fetch"]
+        )
+        self.embedding_store = EmbeddingStore(
+            config["data"]["embedding_dir"], clip_model.model_name, config["data"]["embedding_dtype"],
+            fast_decode=fast_decode_enabled(config["data"])
+        )
         self.query_processor = QueryProcessor(llm_model, blip_model)
+        data_config = config["data"]
+        preprocessed_cache = PreprocessedCache(data_config["preprocessed_dir"]) if data_config["preprocessed_dir"] else None
+        if preprocessed_cache is not None:
+            self.download_cache.eviction_listeners.append(preprocessed_cache.remove)
+        self.searcher_options = {
+            "dataset_options": {"fast_decode": data_config["fast_decode"], "preprocessed_cache": preprocessed_cache},
+            "decode_workers": data_config["decode_workers"],
+            "decode_backend": data_config["decode_backend"],
+            "diversity": config["diversity"],
+        }
+        base_indexes = base_indexes or {}
+        index_config = config["index"]
+        if os.path.exists(index_config["path"]):
+            self.ann_index = IVFIndex.load(index_config["path"], nprobe=index_config["nprobe"])
+        else:
+            self.ann_index = IVFIndex(nlist=index_config["nlist"], nprobe=index_config["nprobe"])
+        if "index" in base_indexes:
+            self.ann_index = LayeredIVFIndex(base_indexes["index"], self.ann_index)
+        self.download_cache.eviction_listeners.append(self.ann_index.remove)
+        self.download_cache.eviction_listeners.append(self._forget_embeddings)
+        lexical_config = config["lexical"]
+        self.lexical_index = None
+        if lexical_config["enabled"]:
+            if os.path.exists(lexical_config["path"]):
+                self.lexical_index = BM25Index.load(lexical_config["path"])
+            else:
+                self.lexical_index = BM25Index(lexical_config["k1"], lexical_config["b"])
+            if "lexical" in base_indexes:
+                self.lexical_index = LayeredBM25Index(base_indexes["lexical"], self.lexical_index)
+            self.download_cache.eviction_listeners.append(self.lexical_index.remove)
+            self.local_searcher = HybridSearcher(
+                clip_model, self.ann_index, self.lexical_index, config["search"]["fusion"],
+                lexical_config["lexical_candidates"], lexical_config["vector_candidates"], lexical_config["rrf_k"],
+                config["diversity"]
+            )
+        else:
+            self.local_searcher = LocalSearcher(
+                clip_model, self.ann_index, config["search"]["fusion"], diversity=config["diversity"]
+            )
+        feedback_config = config["feedback"]
+        self.feedback_searcher = RelevanceFeedbackSearcher(
+            clip_model, self.embedding_store, self.ann_index, feedback_config["alpha"], feedback_config["beta"],
+            feedback_config["gamma"], data_config["batch_size"], feedback_config["index_candidates"],
+            self.searcher_options
+        )
+        speculation_config = config["speculation"]
+        self.prefetcher = None
+        # Embedding-mode refinement is already local and instant; only the caption path is worth speculating.
+        if speculation_config["enabled"] and feedback_config["mode"] == "caption":
+            self.prefetcher = SpeculativePrefetcher(
+                self.query_processor, blip_model, self.fetcher, self.executors, self._embed_paths,
+                speculation_config["top_k"], data_config["max_results"], speculation_config["budget_seconds"],
+                speculation_config["max_sessions"]
+            )
         self.logger = setup_logger()
         self.temp_dir = config["data"]["temp_dir"]
-        self.session_manager = SessionManager(self.temp_dir, config["session"]["timeout_seconds"])
+        session_config = config["session"]
+        self.session_manager = SessionManager(
+            self.temp_dir, session_config["timeout_seconds"],
+            create_session_backend(session_config["backend"], session_config["sqlite_path"], session_config["num_shards"])
+        )
+        self.background_tasks = set()
+        self.profiled_sessions = set()
         os.makedirs(self.temp_dir, exist_ok=True)
 
+    def _forget_embeddings(self, paths):
+        """Drop store rows of evicted downloads (named `<content hash>.jpg`) so compaction can reclaim them."""
+        self.embedding_store.remove([os.path.splitext(os.path.basename(path))[0] for path in paths])
+
+    def _on_user_action(self, session_id):
+        """Mark the session active and stop any speculation it no longer needs."""
+        self.session_manager.update_session_activity(session_id)
+        if self.prefetcher is not None:
+            self.prefetcher.cancel(session_id)
+
+    def _should_profile(self, session_id):
+        sample_rate = self.config["observability"]["profile_sample_rate"]
+        return session_id in self.profiled_sessions or (sample_rate > 0 and random.random() < sample_rate)
+
+    def toggle_profiling(self, params):
+        """Status-server route: `/profile?session=<id>&enabled=0|1` profiles that session's searches."""
+        session_id = params.get("session")
+        if not session_id:
+            return 400, "text/plain", "Missing session parameter\n"
+        if params.get("enabled", "1") == "1":
+            self.profiled_sessions.add(session_id)
+        else:
+            self.profiled_sessions.discard(session_id)
+        return 200, "text/plain", f"Profiling {'on' if session_id in self.profiled_sessions else 'off'} for {session_id}\n"
+
     async def search_images(self, query, session_id):
         """Run the search pipeline for a given query."""
-        self.session_manager.update_session_activity(session_id)
+        profile = self._should_profile(session_id)
+        with metrics.span("request"), profile_block(self.config["observability"]["profile_dir"], "search", profile):
+            return await self._search_images(query, session_id)
+
+    async def _search_images(self, query, session_id):
+        self._on_user_action(session_id)
         self.logger.info(f"Processing query: {query} for session {session_id}")
-        queries = self.query_processor.enhance_initial_query(query)
+        with metrics.span("expand"):
+            queries = await self.executors.run_io(self.query_processor.enhance_initial_query, query, name="llm")
         self.logger.info(f"Enhanced queries: {queries}")
+        if self.config["index"]["local_first"]:
+            results = await self.executors.run_inference("clip", self.local_searcher.search, [query] + queries)
+            if results and results[0][1] >= self.config["index"]["confidence_threshold"]:
+                self.logger.info(f"Answered from local index for session {session_id}")
+                return self._respond(query, results, session_id)
+        if self.config["search"]["streaming"]:
+            return await self._stream_search(query, queries, session_id)
         image_paths = await self.fetcher.fetch_images(
-            queries, self.config["data"]["max_results"]
+            queries, self.config["data"]["max_results"], self._early_stop([query] + queries)
         )
         if not image_paths:
             self.session_manager.update_session_data(session_id, current_query=query, current_results=[])
             return [], "No images found. Try a different query.", session_id
         
-        searcher = ImageSearcher(self.clip_model, image_paths, self.config["data"]["batch_size"])
-        results = searcher.search(query)
+        searcher = ImageSearcher(
+            self.clip_model, image_paths, self.config["data"]["batch_size"],
+            self.embedding_store, self.config["search"]["fusion"], **self.searcher_options
+        )
+        # Rank against the user's query and every LLM variant in one product.
+        results = await self.executors.run_inference("clip", searcher.search, [query] + queries)
+        self._index_images(searcher.paths, searcher.embeddings)
+        return self._respond(query, results, session_id)
+
+    def _early_stop_options(self):
+        early_stop = self.config["search"]["early_stop"]
+        if early_stop["score_threshold"] is None:
+            return None
+        return early_stop["min_results"], early_stop["score_threshold"]
+
+    def _early_stop(self, queries):
+        """An `enough` callback for `fetch_images` that embeds each wave and checks the early-stop threshold."""
+        options = self._early_stop_options()
+        if options is None:
+            return None
+        min_results, threshold = options
+
+        def confident(image_paths):
+            searcher = ImageSearcher(
+                self.clip_model, image_paths, self.config["data"]["batch_size"],
+                self.embedding_store, self.config["search"]["fusion"], **self.searcher_options
+            )
+            # Results are in diversified (MMR/dedup) order, not score order: count, don't check the last.
+            results = searcher.search(queries, len(image_paths))
+            return sum(score >= threshold for _, score in results) >= min_results
+
+        async def enough(image_paths):
+            # Embeddings land in the store, so the final ranking reuses them.
+            if len(image_paths) < min_results:
+                return False
+            return await self.executors.run_inference("clip", confident, image_paths)
+
+        return enough
+
+    async def _stream_search(self, query, queries, session_id):
+        """Fetch, embed and rank concurrently, returning the best results by the deadline."""
+        search_config = self.config["search"]
+        searcher = StreamingSearcher(
+            self.clip_model, self.fetcher, self.embedding_store, self.config["data"]["batch_size"],
+            search_config["queue_size"], search_config["batch_wait_ms"] / 1000, search_config["fusion"],
+            self.executors, self.searcher_options, self._early_stop_options()
+        )
+        results = await searcher.search(
+            [query] + queries, queries, self.config["data"]["max_results"],
+            deadline=search_config["deadline_seconds"]
+        )
+        if not results:
+            self.session_manager.update_session_data(session_id, current_query=query, current_results=[])
+            return [], "No images found. Try a different query.", session_id
+        self._index_images(searcher.paths, searcher.embeddings)
+        return self._respond(query, results, session_id)
+
+    def _respond(self, query, results, session_id):
+        """Store ranked results on the session and format them for the gallery."""
         self.session_manager.update_session_data(session_id, current_query=query, current_results=results)
+        if self.prefetcher is not None:
+            self.prefetcher.start(session_id, query, [path for path, _ in results])
+        else:
+            self._precompute_captions([path for path, _ in results])
         gallery = [(path, f"Score: {score:.4f}") for path, score in results]
         return gallery, f"Found {len(gallery)} images.", session_id
 
+    def _precompute_captions(self, paths):
+        """Caption the top results in the background so "Refine with Image" hits the cache."""
+        top_k = self.config["captions"]["precompute_top_k"]
+        # Embedding-mode feedback never captions, so only load BLIP for it to tag the lexical index.
+        if not top_k or not paths or (self.config["feedback"]["mode"] != "caption" and self.lexical_index is None):
+            return
+        paths = paths[:top_k]
+        task = asyncio.ensure_future(
+            self.executors.run_inference("blip", self.blip_model.generate_captions, paths)
+        )
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        if self.lexical_index is not None:
+            def tag(task):
+                if not task.cancelled() and task.exception() is None:
+                    self._tag_images(paths, task.result())
+            task.add_done_callback(tag)
+
+    def _tag_images(self, paths, captions):
+        """Add captions of indexed, still untagged images to the lexical index."""
+        tagged = [
+            (path, caption) for path, caption in zip(paths, captions)
+            if caption and path in self.ann_index and path not in self.lexical_index
+        ]
+        if tagged:
+            self.lexical_index.add([path for path, _ in tagged], [caption for _, caption in tagged])
+
+    def _embed_paths(self, paths):
+        """Embed `paths` into the embedding store (used to warm it ahead of a search)."""
+        searcher = ImageSearcher(
+            self.clip_model, paths, self.config["data"]["batch_size"], self.embedding_store, **self.searcher_options
+        )
+        return searcher.embed_images()
+
+    def _index_images(self, paths, embeddings):
+        """Add freshly ranked images to the local ANN index in the background.
+
+        Results don't wait on the insert; training and saving are left to the
+        index maintenance job.
+        """
+        if not paths:
+            return
+        task = asyncio.ensure_future(self.executors.run_io(self.ann_index.add, paths, embeddings))
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+
+    async def _enhance_with_image(self, user_query, image_path):
+        """Caption the image on the inference pool, then merge it into the query via the LLM."""
+        caption = await self.executors.run_inference("blip", self.query_processor.caption_image, image_path)
+        return await self.executors.run_io(
+            self.query_processor.enhance_with_caption, user_query, caption, name="llm"
+        )
+
+    async def _feedback_search(self, query, session_id, positive_paths=(), negative_paths=()):
+        """Rank the current results and the local index by a Rocchio query; no BLIP, LLM or network."""
+        _, current_results = self.session_manager.get_session_data(session_id)
+        candidates = [path for path, _ in current_results]
+        with metrics.span("feedback"):
+            results = await self.executors.run_inference(
+                "clip", self.feedback_searcher.search, [query] if query else [], positive_paths, negative_paths,
+                candidates
+            )
+        if not results:
+            return None
+        return self._respond(query, results, session_id)
+
     async def search_with_image(self, query, uploaded_image, session_id):
         """Run the search pipeline with an uploaded image and optional text query."""
-        self.session_manager.update_session_activity(session_id)
+        self._on_user_action(session_id)
         if uploaded_image is None:
             return [], "Please upload an image.", session_id
         
@@ -53,9 +311,15 @@ class GradioInterface:
         uploaded_image.save(temp_image_path)
         self.session_manager.add_temp_file(session_id, temp_image_path)
         
-        # Enhance query with image
         current_query, _ = self.session_manager.get_session_data(session_id)
-        enhanced_query = self.query_processor.enhance_with_image(query or current_query or "", temp_image_path)
+        if self.config["feedback"]["mode"] == "embedding":
+            response = await self._feedback_search(query or current_query, session_id, [temp_image_path])
+            if response is not None:
+                return response
+            # Nothing local to compare against yet: caption the image and search the web.
+
+        # Enhance query with image
+        enhanced_query = await self._enhance_with_image(query or current_query or "", temp_image_path)
         self.logger.info(f"Enhanced query from image: {enhanced_query} for session {session_id}")
         
         # Run search with enhanced query
@@ -64,102 +328,143 @@ class GradioInterface:
 
     async def refine_with_feedback(self, feedback, session_id):
         """Refine query based on user feedback."""
-        self.session_manager.update_session_activity(session_id)
+        self._on_user_action(session_id)
         if not feedback:
             return [], "Please provide feedback.", session_id
         current_query, _ = self.session_manager.get_session_data(session_id)
         if not current_query:
             return [], "Please run a search first.", session_id
-        refined_query = self.query_processor.refine_with_feedback(current_query, feedback)
+        refined_query = await self.executors.run_io(
+            self.query_processor.refine_with_feedback, current_query, feedback, name="llm"
+        )
         gallery, status, session_id = await self.search_images(refined_query, session_id)
         return gallery, status, session_id
 
     async def refine_with_image(self, selected_image_idx, session_id):
         """Refine query based on selected image."""
-        self.session_manager.update_session_activity(session_id)
+        self._on_user_action(session_id)
         current_query, current_results = self.session_manager.get_session_data(session_id)
         if not current_results:
             return [], "Please run a search first.", session_id
         try:
-            selected_image_path = current_results[selected_image_idx][0]
-            refined_query = self.query_processor.enhance_with_image(current_query or "", selected_image_path)
+            selected_image_path = current_results[int(selected_image_idx)][0]
+            if self.config["feedback"]["mode"] == "embedding":
+                response = await self._feedback_search(current_query, session_id, [selected_image_path])
+                return response or ([], "No similar images found.", session_id)
+            refined_query = None
+            if self.prefetcher is not None:
+                refined_query = self.prefetcher.enhanced_query(session_id, current_query or "", selected_image_path)
+            if refined_query is None:
+                refined_query = await self._enhance_with_image(current_query or "", selected_image_path)
             gallery, status, session_id = await self.search_images(refined_query, session_id)
             return gallery, status, session_id
         except IndexError:
             return [], "Invalid image selection.", session_id
 
+    async def reject_image(self, selected_image_idx, session_id):
+        """Re-rank away from the selected image (negative relevance feedback)."""
+        self._on_user_action(session_id)
+        current_query, current_results = self.session_manager.get_session_data(session_id)
+        if not current_results:
+            return [], "Please run a search first.", session_id
+        try:
+            rejected_image_path = current_results[int(selected_image_idx)][0]
+        except IndexError:
+            return [], "Invalid image selection.", session_id
+        response = await self._feedback_search(current_query, session_id, negative_paths=[rejected_image_path])
+        return response or ([], "No other images found.", session_id)
+
     def reset(self, session_id):
         """Clear session data and temporary files."""
+        if self.prefetcher is not None:
+            self.prefetcher.forget(session_id)
         self.session_manager.cleanup_session(session_id)
         # Recreate session to allow immediate reuse
         new_session_id = self.session_manager.create_session()
         return [], "Session reset. Enter a new query or upload an image to start.", new_session_id
 
-    def create_session(self):
+    def create_session(self, session_id=None):
         """Create a new session for a user."""
-        return self.session_manager.create_session()
+        return self.session_manager.create_session(session_id)
+
+    def end_session(self, session_id):
+        """Drop a session and its temporary files without starting a new one."""
+        if self.prefetcher is not None:
+            self.prefetcher.forget(session_id)
+        self.session_manager.cleanup_session(session_id)
 
     def create_interface(self):
         """Define the Gradio interface layout."""
-        with gr.Blocks(title="Image Search Engine") as app:
-            gr.Markdown("# Image Search Engine")
-            gr.Markdown("Enter a query and/or upload an image to search for similar images. Refine results by selecting an image or providing feedback.")
-            
-            session_id = gr.State(value=None)  # Store session ID per user
-            
-            with gr.Row():
-                with gr.Column():
-                    query_input = gr.Textbox(label="Search Query (Optional)", placeholder="e.g., 'sunset over mountains'")
-                    image_input = gr.Image(type="pil", label="Upload Image (Optional)")
-                with gr.Column():
-                    search_button = gr.Button("Search with Text")
-                    image_search_button = gr.Button("Search with Image/Text")
-
-            gallery = gr.Gallery(label="Top Images", columns=5, height="auto")
-            status = gr.Textbox(label="Status", interactive=False)
-
-            with gr.Row():
-                feedback_input = gr.Textbox(label="Feedback", placeholder="e.g., 'remove trees', 'focus on blue sky'")
-                feedback_button = gr.Button("Refine with Feedback")
-
-            with gr.Row():
-                image_selector = gr.Slider(minimum=0, maximum=9, step=1, label="Select Image (Index)")
-                image_button = gr.Button("Refine with Image")
-
-            reset_button = gr.Button("Reset")
-
-            # Initialize session on page load
-            app.load(
-                fn=self.create_session,
-                inputs=None,
-                outputs=session_id
-            )
+        return build_app(self)
 
-            # Bind actions to buttons
-            search_button.click(
-                fn=self.search_images,
-                inputs=[query_input, session_id],
-                outputs=[gallery, status, session_id]
-            )
-            image_search_button.click(
-                fn=self.search_with_image,
-                inputs=[query_input, image_input, session_id],
-                outputs=[gallery, status, session_id]
-            )
-            feedback_button.click(
-                fn=self.refine_with_feedback,
-                inputs=[feedback_input, session_id],
-                outputs=[gallery, status, session_id]
-            )
-            image_button.click(
-                fn=self.refine_with_image,
-                inputs=[image_selector, session_id],
-                outputs=[gallery, status, session_id]
-            )
-            reset_button.click(
-                fn=self.reset,
-                inputs=session_id,
-                outputs=[gallery, status, session_id]
-            )
 
-        return app
\ No newline at end of file
+def build_app(handlers):
+    """Gradio layout wired to `handlers`: a GradioInterface, or a WorkerPool routing to several."""
+    with gr.Blocks(title="Image Search Engine") as app:
+        gr.Markdown("# Image Search Engine")
+        gr.Markdown("Enter a query and/or upload an image to search for similar images. Refine results by selecting an image or providing feedback.")
+        
+        session_id = gr.State(value=None)  # Store session ID per user
+        
+        with gr.Row():
+            with gr.Column():
+                query_input = gr.Textbox(label="Search Query (Optional)", placeholder="e.g., 'sunset over mountains'")
+                image_input = gr.Image(type="pil", label="Upload Image (Optional)")
+            with gr.Column():
+                search_button = gr.Button("Search with Text")
+                image_search_button = gr.Button("Search with Image/Text")
+
+        gallery = gr.Gallery(label="Top Images", columns=5, height="auto")
+        status = gr.Textbox(label="Status", interactive=False)
+
+        with gr.Row():
+            feedback_input = gr.Textbox(label="Feedback", placeholder="e.g., 'remove trees', 'focus on blue sky'")
+            feedback_button = gr.Button("Refine with Feedback")
+
+        with gr.Row():
+            image_selector = gr.Slider(minimum=0, maximum=9, step=1, label="Select Image (Index)")
+            image_button = gr.Button("Refine with Image")
+            reject_button = gr.Button("Reject Image")
+
+        reset_button = gr.Button("Reset")
+
+        # Initialize session on page load
+        app.load(
+            fn=handlers.create_session,
+            inputs=None,
+            outputs=session_id
+        )
+
+        # Bind actions to buttons
+        search_button.click(
+            fn=handlers.search_images,
+            inputs=[query_input, session_id],
+            outputs=[gallery, status, session_id]
+        )
+        image_search_button.click(
+            fn=handlers.search_with_image,
+            inputs=[query_input, image_input, session_id],
+            outputs=[gallery, status, session_id]
+        )
+        feedback_button.click(
+            fn=handlers.refine_with_feedback,
+            inputs=[feedback_input, session_id],
+            outputs=[gallery, status, session_id]
+        )
+        image_button.click(
+            fn=handlers.refine_with_image,
+            inputs=[image_selector, session_id],
+            outputs=[gallery, status, session_id]
+        )
+        reject_button.click(
+            fn=handlers.reject_image,
+            inputs=[image_selector, session_id],
+            outputs=[gallery, status, session_id]
+        )
+        reset_button.click(
+            fn=handlers.reset,
+            inputs=session_id,
+            outputs=[gallery, status, session_id]
+        )
+
+    return app
\ No newline at end of file
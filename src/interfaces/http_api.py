@@ -0,0 +1,321 @@
+import asyncio
+import base64
+import binascii
+import os
+import tempfile
+import time
+from aiohttp import web
+from src.search.query_processor import QueryProcessor
+from src.search.image_searcher import ImageSearcher
+from src.search.relevance_feedback import RelevanceFeedbackSearcher
+from src.search.scoring import ScoringEngine
+from src.data.image_fetcher import ImageFetcher
+from src.data.download_cache import DownloadCache
+from src.data.embedding_store import EmbeddingStore
+from src.data.preprocessing import PreprocessedCache, fast_decode_enabled
+from src.utils.executors import ExecutorPool
+from src.utils.logger import setup_logger
+from src.utils.metrics import metrics
+
+
+class _BadRequest(Exception):
+    pass
+
+
+class HTTPSearchAPI:
+    """Headless JSON API over the search pipeline.
+
+    Stateless: refine calls carry the previous query instead of a session.
+    Every response includes per-stage timings in milliseconds. Pass a
+    `fetcher` / stub `llm_model` (see `src.utils.stubs`) to load-test
+    without touching DuckDuckGo or Gemini.
+    """
+
+    def __init__(self, config, clip_model, blip_model, llm_model, fetcher=None):
+        self.config = config
+        self.clip_model = clip_model
+        data_config = config["data"]
+        executor_config = config["executors"]
+        self.executors = ExecutorPool(
+            executor_config["io_workers"], executor_config["inference_workers"],
+            executor_config["model_concurrency"]
+        )
+        self.download_cache = DownloadCache(
+            data_config["image_dir"], data_config["cache_max_bytes"], data_config["cache_max_age_seconds"],
+            data_config["phash_max_distance"]
+        )
+        self.fetcher = fetcher or ImageFetcher(
+            data_config["image_dir"], self.download_cache, self.executors, data_config["ddg_cache_ttl_seconds"],
+            **data_config["fetch"]
+        )
+        self.embedding_store = EmbeddingStore(
+            data_config["embedding_dir"], clip_model.model_name, data_config["embedding_dtype"],
+            fast_decode=fast_decode_enabled(data_config)
+        )
+        self.download_cache.eviction_listeners.append(self._forget_embeddings)
+        self.query_processor = QueryProcessor(llm_model, blip_model)
+        preprocessed_cache = PreprocessedCache(data_config["preprocessed_dir"]) if data_config["preprocessed_dir"] else None
+        if preprocessed_cache is not None:
+            self.download_cache.eviction_listeners.append(preprocessed_cache.remove)
+        self.searcher_options = {
+            "dataset_options": {"fast_decode": data_config["fast_decode"], "preprocessed_cache": preprocessed_cache},
+            "decode_workers": data_config["decode_workers"],
+            "decode_backend": data_config["decode_backend"],
+            "diversity": config["diversity"],
+        }
+        feedback_config = config["feedback"]
+        self.feedback_searcher = RelevanceFeedbackSearcher(
+            clip_model, self.embedding_store, None, feedback_config["alpha"], feedback_config["beta"],
+            feedback_config["gamma"], data_config["batch_size"], searcher_options=self.searcher_options
+        )
+        self.image_dir = os.path.abspath(data_config["image_dir"])
+        self.temp_dir = data_config["temp_dir"]
+        self.logger = setup_logger()
+        os.makedirs(self.temp_dir, exist_ok=True)
+
+    def _forget_embeddings(self, paths):
+        """Drop store rows of evicted downloads (named `<content hash>.jpg`) so compaction can reclaim them."""
+        self.embedding_store.remove([os.path.splitext(os.path.basename(path))[0] for path in paths])
+
+    async def _expand(self, query, expand, timings):
+        if not expand:
+            return []
+        started = time.perf_counter()
+        with metrics.span("expand"):
+            queries = await self.executors.run_io(self.query_processor.enhance_initial_query, query, name="llm")
+        # Batch expansions run concurrently; report the slowest rather than their sum.
+        timings["expand"] = max(timings.get("expand", 0.0), (time.perf_counter() - started) * 1000)
+        return queries
+
+    def _rank(self, image_paths, query_sets, top_k):
+        """Embed the shared image pool once and rank it for each set of query variants."""
+        searcher = ImageSearcher(
+            self.clip_model, image_paths, self.config["data"]["batch_size"],
+            self.embedding_store, self.config["search"]["fusion"], **self.searcher_options
+        )
+        paths, image_embeddings = searcher.embed_images()
+        if not paths:
+            return [[] for _ in query_sets]
+        flat = [query for queries in query_sets for query in queries]
+        text_embeddings = self.clip_model.encode_texts(flat).float().cpu().numpy()
+        engine = ScoringEngine(image_embeddings, self.config["search"]["fusion"], **self.config["diversity"])
+        results, offset = [], 0
+        for queries in query_sets:
+            indices, scores = engine.rank(text_embeddings[offset:offset + len(queries)], top_k)
+            offset += len(queries)
+            results.append([(paths[i], float(s)) for i, s in zip(indices, scores)])
+        return results
+
+    async def _search_many(self, user_queries, top_k, expand):
+        """Expand each query, fetch the union of all variants once, and rank every query against it."""
+        timings = {}
+        started = time.perf_counter()
+        expansions = await asyncio.gather(*(self._expand(query, expand, timings) for query in user_queries))
+        query_sets = [[query] + queries for query, queries in zip(user_queries, expansions)]
+        fetch_queries = list(dict.fromkeys(query for queries in query_sets for query in queries))
+        fetch_started = time.perf_counter()
+        image_paths = await self.fetcher.fetch_images(fetch_queries, self.config["data"]["max_results"])
+        timings["fetch"] = (time.perf_counter() - fetch_started) * 1000
+        rank_started = time.perf_counter()
+        if image_paths:
+            results = await self.executors.run_inference("clip", self._rank, image_paths, query_sets, top_k)
+        else:
+            results = [[] for _ in query_sets]
+        timings["embed_rank"] = (time.perf_counter() - rank_started) * 1000
+        timings["total"] = (time.perf_counter() - started) * 1000
+        return query_sets, results, len(image_paths), timings
+
+    def _format(self, results):
+        formatted = []
+        for path, score in results:
+            absolute = os.path.abspath(path)
+            url = None
+            if absolute.startswith(self.image_dir + os.sep):
+                url = "/images/" + os.path.relpath(absolute, self.image_dir).replace(os.sep, "/")
+            formatted.append({"path": path, "url": url, "score": score})
+        return formatted
+
+    async def _search_one(self, query, top_k, expand, extra_timings=None):
+        query_sets, results, candidates, timings = await self._search_many([query], top_k, expand)
+        if extra_timings:
+            timings.update(extra_timings)
+            timings["total"] += sum(extra_timings.values())
+        return {
+            "query": query, "queries": query_sets[0], "candidates": candidates,
+            "results": self._format(results[0]), "timings_ms": timings,
+        }
+
+    async def _caption_query(self, query, image_path):
+        started = time.perf_counter()
+        caption = await self.executors.run_inference("blip", self.query_processor.caption_image, image_path)
+        enhanced = await self.executors.run_io(self.query_processor.enhance_with_caption, query, caption, name="llm")
+        return caption, enhanced, {"caption": (time.perf_counter() - started) * 1000}
+
+    async def _json(self, request):
+        try:
+            body = await request.json()
+        except ValueError:
+            raise _BadRequest("Body must be JSON")
+        if not isinstance(body, dict):
+            raise _BadRequest("Body must be a JSON object")
+        return body
+
+    def _options(self, body):
+        top_k = body.get("top_k", 10)
+        # bool is an int subclass, so `true` would otherwise pass as top_k 1.
+        if isinstance(top_k, bool) or not isinstance(top_k, int) or not 1 <= top_k <= self.config["data"]["max_results"] * 10:
+            raise _BadRequest("top_k must be a positive integer")
+        expand = body.get("expand", True)
+        if not isinstance(expand, bool):
+            raise _BadRequest("expand must be true or false")
+        return top_k, expand
+
+    def _text(self, body, key, required=True):
+        value = body.get(key)
+        if value is None and not required:
+            return ""
+        if not isinstance(value, str) or not value.strip():
+            raise _BadRequest(f"'{key}' must be a non-empty string")
+        return value.strip()
+
+    def _local_image(self, image_path):
+        # Only images the service itself stored (i.e. earlier results) may be referenced by path.
+        absolute = os.path.abspath(image_path)
+        stub_paths = getattr(self.fetcher, "image_paths", ())
+        allowed = absolute.startswith(self.image_dir + os.sep) or image_path in stub_paths
+        if not allowed or not os.path.isfile(absolute):
+            raise _BadRequest("image_path must be a result path from this service")
+        return absolute
+
+    async def search(self, request):
+        body = await self._json(request)
+        top_k, expand = self._options(body)
+        return web.json_response(await self._search_one(self._text(body, "query"), top_k, expand))
+
+    async def search_batch(self, request):
+        body = await self._json(request)
+        top_k, expand = self._options(body)
+        queries = body.get("queries")
+        if not isinstance(queries, list) or not queries or not all(isinstance(q, str) and q.strip() for q in queries):
+            raise _BadRequest("'queries' must be a non-empty list of strings")
+        if len(queries) > self.config["api"]["max_batch_queries"]:
+            raise _BadRequest(f"At most {self.config['api']['max_batch_queries']} queries per batch")
+        queries = [q.strip() for q in queries]
+        query_sets, results, candidates, timings = await self._search_many(queries, top_k, expand)
+        return web.json_response({
+            "results": [
+                {"query": query, "queries": query_set, "results": self._format(ranked)}
+                for query, query_set, ranked in zip(queries, query_sets, results)
+            ],
+            "candidates": candidates,
+            "timings_ms": timings,
+        })
+
+    async def search_image(self, request):
+        body = await self._json(request)
+        top_k, expand = self._options(body)
+        query = self._text(body, "query", required=False)
+        try:
+            data = base64.b64decode(self._text(body, "image"), validate=True)
+        except binascii.Error:
+            raise _BadRequest("'image' must be base64-encoded")
+        if len(data) > self.config["api"]["max_image_bytes"]:
+            raise _BadRequest("Image too large")
+        fd, image_path = tempfile.mkstemp(dir=self.temp_dir, suffix=".jpg")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            try:
+                caption, enhanced, timings = await self._caption_query(query, image_path)
+            except ValueError as e:
+                raise _BadRequest(str(e))
+        finally:
+            os.remove(image_path)
+        response = await self._search_one(enhanced, top_k, expand, timings)
+        response["caption"] = caption
+        return web.json_response(response)
+
+    async def refine(self, request):
+        body = await self._json(request)
+        top_k, expand = self._options(body)
+        query = self._text(body, "query")
+        if body.get("feedback") is not None:
+            started = time.perf_counter()
+            refined = await self.executors.run_io(
+                self.query_processor.refine_with_feedback, query, self._text(body, "feedback"), name="llm"
+            )
+            timings = {"refine": (time.perf_counter() - started) * 1000}
+            return web.json_response(await self._search_one(refined, top_k, expand, timings))
+        if body.get("image_path") is not None:
+            image_path = self._local_image(self._text(body, "image_path"))
+            try:
+                caption, refined, timings = await self._caption_query(query, image_path)
+            except ValueError as e:
+                raise _BadRequest(str(e))
+            response = await self._search_one(refined, top_k, expand, timings)
+            response["caption"] = caption
+            return web.json_response(response)
+        if body.get("positive_paths") is not None or body.get("negative_paths") is not None:
+            return web.json_response(await self._feedback(query, body, top_k))
+        raise _BadRequest("Provide 'feedback', 'image_path' or 'positive_paths'/'negative_paths'")
+
+    def _paths(self, body, key):
+        paths = body.get(key) or []
+        if not isinstance(paths, list) or not all(isinstance(p, str) for p in paths):
+            raise _BadRequest(f"'{key}' must be a list of result paths")
+        return [self._local_image(p) for p in paths]
+
+    async def _feedback(self, query, body, top_k):
+        """Rocchio re-rank of `candidate_paths` in CLIP space; no LLM, BLIP or fetch."""
+        positive = self._paths(body, "positive_paths")
+        negative = self._paths(body, "negative_paths")
+        candidates = self._paths(body, "candidate_paths")
+        if not candidates:
+            raise _BadRequest("'candidate_paths' must list the results to re-rank")
+        started = time.perf_counter()
+        with metrics.span("feedback"):
+            results = await self.executors.run_inference(
+                "clip", self.feedback_searcher.search, [query], positive, negative, candidates, top_k
+            )
+        elapsed = (time.perf_counter() - started) * 1000
+        return {
+            "query": query, "queries": [query], "candidates": len(candidates),
+            "results": self._format(results), "timings_ms": {"feedback": elapsed, "total": elapsed},
+        }
+
+    async def healthz(self, request):
+        return web.json_response({"status": "alive"})
+
+    @web.middleware
+    async def _errors(self, request, handler):
+        try:
+            return await handler(request)
+        except _BadRequest as e:
+            return web.json_response({"error": str(e)}, status=400)
+        except web.HTTPException:
+            raise
+        except Exception as e:
+            self.logger.error(f"{request.method} {request.path} failed: {e}")
+            return web.json_response({"error": "Internal error"}, status=500)
+
+    def create_app(self):
+        app = web.Application(middlewares=[self._errors], client_max_size=self.config["api"]["max_image_bytes"] * 2)
+        app.add_routes([
+            web.post("/search", self.search),
+            web.post("/search/batch", self.search_batch),
+            web.post("/search/image", self.search_image),
+            web.post("/refine", self.refine),
+            web.get("/healthz", self.healthz),
+        ])
+        app.router.add_static("/images", self.image_dir)
+        app.on_cleanup.append(self._close)
+        return app
+
+    async def _close(self, app):
+        close = getattr(self.fetcher, "close", None)
+        if close is not None:
+            await close()
+
+    def run(self):
+        api_config = self.config["api"]
+        web.run_app(self.create_app(), host=api_config["host"], port=api_config["port"])
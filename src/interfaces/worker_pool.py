@@ -0,0 +1,324 @@
+import asyncio
+import atexit
+import gc
+import itertools
+import multiprocessing
+import os
+import signal
+import time
+import uuid
+import zlib
+from concurrent.futures import Future
+from multiprocessing import reduction
+from multiprocessing.connection import Connection, wait
+from threading import Event, Lock, Thread
+from src.utils.logger import setup_logger
+
+
+def _serve(conn, build_handler, index, torch_threads):
+    """Worker process body: build a handler, then run requests from `conn` on its own event loop."""
+    if torch_threads:
+        import torch
+        torch.set_num_threads(torch_threads)
+    logger = setup_logger()
+    handler = build_handler(index)
+    loop = asyncio.new_event_loop()
+    Thread(target=loop.run_forever, name="worker-loop", daemon=True).start()
+    send_lock = Lock()
+
+    def reply(request_id, future):
+        try:
+            message = (request_id, True, future.result())
+        except Exception as e:
+            message = (request_id, False, e)
+        with send_lock:
+            try:
+                conn.send(message)
+            except Exception as e:  # unpicklable result or exception
+                conn.send((request_id, False, RuntimeError(repr(e))))
+
+    async def call(fn, args):
+        if asyncio.iscoroutinefunction(fn):
+            return await fn(*args)
+        return await asyncio.to_thread(fn, *args)
+
+    logger.info(f"Worker {index} ready")
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        if message is None:  # shutdown; other workers hold copies of the pipe, so EOF alone may never come
+            break
+        request_id, method, args = message
+        future = asyncio.run_coroutine_threadsafe(call(getattr(handler, method), args), loop)
+        future.add_done_callback(lambda f, request_id=request_id: reply(request_id, f))
+
+
+def _reap(children, logger):
+    """Collect exited workers so they don't linger as zombies."""
+    while children:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            children.clear()
+            return
+        if not pid:
+            return
+        index = children.pop(pid, None)
+        if index is not None:
+            logger.info(f"Worker {index} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)}")
+
+
+def _zygote(control, build_handler, torch_threads, shutdown_timeout_seconds):
+    """Fork server for the workers, forked from the pool's parent before it starts any threads.
+
+    It stays single-threaded, so forking from it is safe at any time, unlike
+    forking the parent once Gradio, reader threads and the status server run
+    (a lock held by another thread at fork time would deadlock the child).
+    Each request is a worker index followed by the worker's end of its pipe,
+    passed as a file descriptor; the reply is the new worker's pid.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent handles Ctrl-C and shuts workers down
+    logger = setup_logger()
+    children = {}  # {pid: worker index}
+    while True:
+        if wait([control], timeout=1.0):
+            try:
+                index = control.recv()
+            except (EOFError, OSError):
+                break
+            if index is None:
+                break
+            fd = reduction.recv_handle(control)
+            pid = os.fork()
+            if pid == 0:
+                control.close()
+                code = 0
+                try:
+                    _serve(Connection(fd), build_handler, index, torch_threads)
+                except BaseException:
+                    logger.exception(f"Worker {index} failed")
+                    code = 1
+                finally:
+                    os._exit(code)
+            os.close(fd)
+            children[pid] = index
+            control.send(pid)
+        _reap(children, logger)
+    # The parent has asked every worker to stop; give them time, then insist.
+    deadline = time.monotonic() + shutdown_timeout_seconds
+    while children and time.monotonic() < deadline:
+        time.sleep(0.1)
+        _reap(children, logger)
+    for pid, index in list(children.items()):
+        logger.warning(f"Worker {index} didn't exit, terminating it")
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+
+
+class _WorkerClient:
+    """Front-end side of one worker's pipe: numbered requests, futures resolved by a reader thread."""
+
+    def __init__(self, index, conn, pid, on_exit):
+        self.index = index
+        self.conn = conn
+        self.pid = pid
+        self.on_exit = on_exit
+        self.pending = {}  # {request_id: Future}
+        self.request_ids = itertools.count()
+        self.closing = False
+        self.exited = Event()
+        self.lock = Lock()
+        self.logger = setup_logger()
+        Thread(target=self._read, name=f"worker-{index}-reader", daemon=True).start()
+
+    def _read(self):
+        while True:
+            try:
+                request_id, ok, value = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            with self.lock:
+                future = self.pending.pop(request_id, None)
+            if future is None:
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+        if not self.closing:
+            self.logger.error(f"Worker {self.index} (pid {self.pid}) exited")
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        for future in pending.values():
+            future.set_exception(RuntimeError(f"Worker {self.index} exited"))
+        self.exited.set()
+        self.on_exit()
+
+    def call(self, method, *args):
+        future = Future()
+        with self.lock:
+            request_id = next(self.request_ids)
+            self.pending[request_id] = future
+            self.conn.send((request_id, method, args))
+        return future
+
+
+class WorkerPool:
+    """Serves the Gradio handlers from `num_workers` forked processes.
+
+    Models are loaded in the parent before `start`, so forked workers share
+    the weights copy-on-write instead of each reading several GB. Each
+    worker builds its own pipeline with `build_handler(index)` (threads
+    don't survive fork, so executors, batchers and schedulers must be
+    created there) and caps torch at `torch_threads` intra-op threads so
+    workers don't oversubscribe the cores. Session ids are minted here and
+    routed by hash, so every request of a session reaches the worker that
+    holds its state, with no routing table to keep.
+
+    Workers are forked by a zygote process (see `_zygote`) that `start`
+    forks first, while the parent is still single-threaded; it also holds
+    the preloaded weights, so restarted workers share them too. Workers
+    aren't daemonic, so they can start DataLoader processes
+    (`decode_backend: processes`); `shutdown` (also run at exit) stops them.
+    A watcher thread has a worker that dies re-forked in the same slot, so
+    its sessions keep routing there (in-memory session state is lost with
+    it; use the sqlite session backend to keep it). A worker that dies
+    within `min_uptime_seconds` of starting is restarted after an
+    increasing delay.
+    """
+
+    def __init__(self, build_handler, num_workers, torch_threads=None, min_uptime_seconds=30,
+                 max_restart_delay_seconds=60, shutdown_timeout_seconds=10):
+        self.build_handler = build_handler
+        self.num_workers = num_workers
+        self.torch_threads = torch_threads
+        self.min_uptime_seconds = min_uptime_seconds
+        self.max_restart_delay_seconds = max_restart_delay_seconds
+        self.shutdown_timeout_seconds = shutdown_timeout_seconds
+        self.workers = []
+        self.started_at = []
+        self.restart_delays = []
+        self.context = multiprocessing.get_context("fork")
+        self.zygote = None
+        self.control = None
+        self.control_lock = Lock()
+        self.worker_exited = Event()
+        self.stopping = Event()
+        self.logger = setup_logger()
+
+    def _spawn(self, index):
+        parent_conn, child_conn = self.context.Pipe()
+        try:
+            with self.control_lock:
+                self.control.send(index)
+                reduction.send_handle(self.control, child_conn.fileno(), self.zygote.pid)
+                pid = self.control.recv()
+        finally:
+            child_conn.close()
+        return _WorkerClient(index, parent_conn, pid, self.worker_exited.set)
+
+    def start(self):
+        # Move everything allocated so far out of the collector's reach, so GC
+        # passes in the workers don't write to (and un-share) the parent's pages.
+        gc.freeze()
+        self.control, zygote_conn = self.context.Pipe()
+        self.zygote = self.context.Process(
+            target=_zygote, args=(zygote_conn, self.build_handler, self.torch_threads, self.shutdown_timeout_seconds),
+            name="worker-zygote"
+        )
+        self.zygote.start()
+        zygote_conn.close()
+        for index in range(self.num_workers):
+            self.workers.append(self._spawn(index))
+            self.started_at.append(time.monotonic())
+            self.restart_delays.append(0)
+        atexit.register(self.shutdown)
+        Thread(target=self._watch, name="worker-watcher", daemon=True).start()
+        self.logger.info(f"Started {self.num_workers} workers")
+
+    def _watch(self):
+        """Have workers that exit while the pool is running re-forked."""
+        while not self.stopping.is_set():
+            self.worker_exited.wait(1.0)
+            self.worker_exited.clear()
+            for index, worker in enumerate(self.workers):
+                if not worker.exited.is_set() or self.stopping.is_set():
+                    continue
+                if time.monotonic() - self.started_at[index] < self.min_uptime_seconds:
+                    delay = min(max(2 * self.restart_delays[index], 1), self.max_restart_delay_seconds)
+                else:
+                    delay = 0
+                self.restart_delays[index] = delay
+                self.logger.error(f"Worker {index} died, restarting in {delay}s")
+                if self.stopping.wait(delay):
+                    return
+                try:
+                    replacement = self._spawn(index)
+                except (EOFError, OSError) as e:
+                    self.logger.error(f"Couldn't restart worker {index}: {e}")
+                    self.started_at[index] = time.monotonic()
+                    continue
+                worker.conn.close()
+                self.workers[index] = replacement
+                self.started_at[index] = time.monotonic()
+
+    def shutdown(self):
+        """Stop the watcher, ask every worker and the zygote to exit, and wait for them."""
+        if self.stopping.is_set():
+            return
+        self.stopping.set()
+        for worker in self.workers:
+            with worker.lock:
+                worker.closing = True
+                try:
+                    worker.conn.send(None)
+                except OSError:
+                    pass
+        with self.control_lock:
+            try:
+                self.control.send(None)
+            except OSError:
+                pass
+        # The zygote waits shutdown_timeout_seconds for the workers before terminating them.
+        self.zygote.join(self.shutdown_timeout_seconds + 5)
+        if self.zygote.is_alive():
+            self.logger.warning("Worker zygote didn't exit, terminating it")
+            self.zygote.terminate()
+            self.zygote.join()
+        for worker in self.workers:
+            worker.conn.close()
+        self.control.close()
+        self.logger.info(f"Stopped {len(self.workers)} workers")
+
+    def _worker_for(self, session_id):
+        return self.workers[zlib.crc32((session_id or "").encode("utf-8")) % len(self.workers)]
+
+    async def _call(self, session_id, method, *args):
+        return await asyncio.wrap_future(self._worker_for(session_id).call(method, *args))
+
+    async def create_session(self):
+        session_id = str(uuid.uuid4())
+        return await self._call(session_id, "create_session", session_id)
+
+    async def search_images(self, query, session_id):
+        return await self._call(session_id, "search_images", query, session_id)
+
+    async def search_with_image(self, query, uploaded_image, session_id):
+        return await self._call(session_id, "search_with_image", query, uploaded_image, session_id)
+
+    async def refine_with_feedback(self, feedback, session_id):
+        return await self._call(session_id, "refine_with_feedback", feedback, session_id)
+
+    async def refine_with_image(self, selected_image_idx, session_id):
+        return await self._call(session_id, "refine_with_image", selected_image_idx, session_id)
+
+    async def reject_image(self, selected_image_idx, session_id):
+        return await self._call(session_id, "reject_image", selected_image_idx, session_id)
+
+    async def reset(self, session_id):
+        # The new id may hash to another worker, so reset is end + create rather than a worker call.
+        await self._call(session_id, "end_session", session_id)
+        new_session_id = await self.create_session()
+        return [], "Session reset. Enter a new query or upload an image to start.", new_session_id
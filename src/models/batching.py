@@ -0,0 +1,115 @@
+import queue
+import time
+import torch
+from concurrent.futures import Future
+from threading import Thread
+from src.utils.logger import setup_logger
+from src.utils.metrics import metrics
+
+BATCH_SIZE_BUCKETS = [1, 2, 4, 8, 16, 32, 64, 128, 256]
+QUEUE_WAIT_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0]
+
+
+class _Batcher:
+    """Worker thread that coalesces queued requests into one forward pass.
+
+    After the first request arrives the worker keeps collecting for up to
+    `max_wait` seconds or until `max_batch_size` items are queued, runs
+    `encode_fn` over the concatenated inputs and resolves each caller's future
+    with its slice of the output.
+    """
+
+    def __init__(self, name, encode_fn, join_fn, max_batch_size, max_wait):
+        self.name = name
+        self.encode_fn = encode_fn
+        self.join_fn = join_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.batch_sizes = metrics.histogram("batch_size", BATCH_SIZE_BUCKETS, batcher=name)
+        self.queue_waits = metrics.histogram("batch_queue_wait_seconds", QUEUE_WAIT_BUCKETS, batcher=name)
+        self.logger = setup_logger()
+        self.thread = Thread(target=self._loop, name=f"{name}-batcher", daemon=True)
+        self.thread.start()
+
+    def submit(self, items, size):
+        future = Future()
+        self.requests.put((items, size, time.monotonic(), future))
+        return future
+
+    def _collect(self):
+        batch = [self.requests.get()]
+        total = batch[0][1]
+        deadline = time.monotonic() + self.max_wait
+        while total < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self.requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(request)
+            total += request[1]
+        return batch, total
+
+    def _loop(self):
+        while True:
+            batch, total = self._collect()
+            started = time.monotonic()
+            for _, _, enqueued, _ in batch:
+                self.queue_waits.observe(started - enqueued)
+            self.batch_sizes.observe(total)
+            try:
+                outputs = self.encode_fn(self.join_fn([items for items, _, _, _ in batch]))
+            except Exception as e:
+                self.logger.error(f"{self.name} batch of {total} failed: {e}")
+                for _, _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            offset = 0
+            for _, size, _, future in batch:
+                future.set_result(outputs[offset:offset + size])
+                offset += size
+
+
+class BatchingCLIPModel:
+    """Drop-in front end for CLIPModel that batches encode calls across sessions.
+
+    Concurrent `encode_text(s)` and `encode_image_batch` calls from different
+    requests are merged into shared forward passes, one batcher per modality.
+    Everything else is delegated to the wrapped model.
+    """
+
+    def __init__(self, clip_model, max_batch_size=32, max_wait_ms=5):
+        self.clip_model = clip_model
+        self.text_batcher = _Batcher(
+            "clip-text", lambda texts: self.clip_model.encode_texts(texts), lambda parts: [t for texts in parts for t in texts],
+            max_batch_size, max_wait_ms / 1000
+        )
+        self.image_batcher = _Batcher(
+            "clip-image", lambda images: self.clip_model.encode_image_batch(images), torch.cat, max_batch_size, max_wait_ms / 1000
+        )
+
+    def __getattr__(self, name):
+        return getattr(self.clip_model, name)
+
+    def encode_text(self, text):
+        return self.encode_texts([text])
+
+    def encode_texts(self, texts):
+        texts = list(texts)
+        return self.text_batcher.submit(texts, len(texts)).result()
+
+    def encode_image_batch(self, images):
+        return self.image_batcher.submit(images, images.shape[0]).result()
+
+    def stats(self):
+        """Batch-size and queue-wait histograms for each modality."""
+        return {
+            batcher.name: {
+                "batch_size": batcher.batch_sizes.snapshot(),
+                "queue_wait_seconds": batcher.queue_waits.snapshot(),
+            }
+            for batcher in (self.text_batcher, self.image_batcher)
+        }
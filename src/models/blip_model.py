@@ -1,15 +1,101 @@
 from transformers import AutoProcessor, AutoModelForCausalLM
 from PIL import Image
+from threading import Lock
+import json
+import os
 import torch
+from src.utils.hashing import file_hash
+from src.utils.logger import setup_logger
+from src.utils.metrics import metrics
+
 class BLIPModel:
-    def __init__(self, model_name, device="cpu"):
+    def __init__(self, model_name, device="cpu", cache_path=None, batch_size=8):
         self.device = device
         self.processor = AutoProcessor.from_pretrained(model_name, use_fast=True)
         self.model = AutoModelForCausalLM.from_pretrained(model_name).to(device)
+        self.batch_size = batch_size
+        self.cache_path = cache_path
+        self.captions = {}  # {content_hash: caption}
+        self.lock = Lock()
+        self.logger = setup_logger()
+        self._load_captions()
 
-    def generate_caption(self, image_path):
-        image = Image.open(image_path).convert("RGB")
-        inputs = self.processor(images=image, return_tensors="pt").to(self.device)
+    def _load_captions(self):
+        """Read the append-only `{"hash", "caption"}` JSON-lines caption log."""
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+        with open(self.cache_path, "r") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue  # torn final line after a crash
+                self.captions[entry["hash"]] = entry["caption"]
+        self.logger.info(f"Loaded {len(self.captions)} cached captions")
+
+    def _store_captions(self, entries):
+        with self.lock:
+            self.captions.update(entries)
+            if self.cache_path:
+                os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+                with open(self.cache_path, "a") as f:
+                    for content_hash, caption in entries.items():
+                        f.write(json.dumps({"hash": content_hash, "caption": caption}) + "\n")
+
+    def _caption_batch(self, image_paths):
+        images = [Image.open(path).convert("RGB") for path in image_paths]
+        inputs = self.processor(images=images, return_tensors="pt").to(self.device)
+        with torch.no_grad(), metrics.span("blip"):
+            captions = self.model.generate(**inputs, max_length=80)
+        return self.processor.batch_decode(captions, skip_special_tokens=True)
+
+    def warmup(self):
+        """Caption a blank image once; bypasses the cache so nothing is stored."""
+        inputs = self.processor(images=[Image.new("RGB", (224, 224))], return_tensors="pt").to(self.device)
         with torch.no_grad():
-            caption = self.model.generate(**inputs, max_length=80)
-        return self.processor.decode(caption[0], skip_special_tokens=True)
\ No newline at end of file
+            self.model.generate(**inputs, max_length=5)
+
+    def generate_captions(self, image_paths):
+        """Caption many images, reusing cached captions and batching the rest.
+
+        Images that cannot be read get a None caption.
+        """
+        hashes = []
+        for path in image_paths:
+            try:
+                hashes.append(file_hash(path))
+            except OSError:
+                hashes.append(None)
+        with self.lock:
+            results = {h: self.captions[h] for h in hashes if h in self.captions}
+        # One forward pass per distinct image, however many paths point at it.
+        misses = {}
+        for path, content_hash in zip(image_paths, hashes):
+            if content_hash is not None and content_hash not in results:
+                misses.setdefault(content_hash, path)
+        miss_items = list(misses.items())
+        metrics.inc("cache_hits_total", len(results), cache="caption")
+        metrics.inc("cache_misses_total", len(miss_items), cache="caption")
+        for start in range(0, len(miss_items), self.batch_size):
+            chunk = miss_items[start:start + self.batch_size]
+            try:
+                captions = self._caption_batch([path for _, path in chunk])
+            except Exception as e:
+                self.logger.error(f"Batched captioning failed, falling back to single images: {e}")
+                captions = []
+                for _, path in chunk:
+                    try:
+                        captions.append(self._caption_batch([path])[0])
+                    except Exception as e:
+                        self.logger.error(f"Failed to caption {path}: {e}")
+                        captions.append(None)
+            new_entries = {h: c for (h, _), c in zip(chunk, captions) if c is not None}
+            self._store_captions(new_entries)
+            results.update(new_entries)
+        return [results.get(h) for h in hashes]
+
+    def generate_caption(self, image_path):
+        caption = self.generate_captions([image_path])[0]
+        if caption is None:
+            raise ValueError(f"Could not caption image: {image_path}")
+        return caption
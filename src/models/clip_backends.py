@@ -0,0 +1,142 @@
+import copy
+import os
+import numpy as np
+import torch
+from src.utils.logger import setup_logger
+
+
+class TorchBackend:
+    """fp32 eager PyTorch; the reference the other backends are checked against."""
+
+    def __init__(self, model, **options):
+        self.model = model.eval()
+
+    def encode_image(self, images):
+        return self.model.encode_image(images)
+
+    def encode_text(self, tokens):
+        return self.model.encode_text(tokens)
+
+
+class QuantizedBackend(TorchBackend):
+    """Dynamic int8 quantization of every nn.Linear (weights int8, activations quantized per batch)."""
+
+    def __init__(self, model, **options):
+        quantized = torch.ao.quantization.quantize_dynamic(
+            copy.deepcopy(model).eval(), {torch.nn.Linear}, dtype=torch.qint8
+        )
+        super().__init__(quantized)
+
+
+class CompiledBackend(TorchBackend):
+    """torch.compile'd encoders over a copy of the model, with channels-last image tensors for the conv stem.
+
+    The default mode avoids CUDA graphs ("reduce-overhead"), whose static
+    buffers don't suit dynamic batch sizes served from several threads;
+    "max-autotune-no-cudagraphs" trades a longer compile for faster kernels.
+    """
+
+    def __init__(self, model, mode=None, channels_last=True, **options):
+        super().__init__(copy.deepcopy(model))
+        self.channels_last = channels_last
+        if channels_last:
+            self.model.visual.to(memory_format=torch.channels_last)
+        self._encode_image = torch.compile(self.model.encode_image, mode=mode, dynamic=True)
+        self._encode_text = torch.compile(self.model.encode_text, mode=mode, dynamic=True)
+
+    def encode_image(self, images):
+        if self.channels_last:
+            images = images.contiguous(memory_format=torch.channels_last)
+        return self._encode_image(images)
+
+    def encode_text(self, tokens):
+        return self._encode_text(tokens)
+
+
+class _TextEncoder(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, tokens):
+        return self.model.encode_text(tokens)
+
+
+class _ImageEncoder(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, images):
+        return self.model.encode_image(images)
+
+
+class OnnxBackend:
+    """ONNX Runtime sessions for both encoders, exported once to `export_dir` and reused."""
+
+    def __init__(self, model, export_dir="data/onnx", model_name="clip", intra_op_threads=0, **options):
+        import onnxruntime as ort
+
+        self.logger = setup_logger()
+        export_dir = os.path.join(export_dir, model_name.replace("/", "_"))
+        os.makedirs(export_dir, exist_ok=True)
+        image_path = os.path.join(export_dir, "image_encoder.onnx")
+        text_path = os.path.join(export_dir, "text_encoder.onnx")
+        model = model.eval()
+        resolution = model.visual.input_resolution
+        context_length = model.context_length
+        if not os.path.exists(image_path):
+            self._export(_ImageEncoder(model), torch.randn(1, 3, resolution, resolution), "images", image_path)
+        if not os.path.exists(text_path):
+            self._export(_TextEncoder(model), torch.zeros(1, context_length, dtype=torch.long), "tokens", text_path)
+        session_options = ort.SessionOptions()
+        session_options.intra_op_num_threads = intra_op_threads
+        providers = ["CPUExecutionProvider"]
+        self.image_session = ort.InferenceSession(image_path, session_options, providers=providers)
+        self.text_session = ort.InferenceSession(text_path, session_options, providers=providers)
+
+    def _export(self, module, example, input_name, path):
+        self.logger.info(f"Exporting {path}...")
+        tmp_path = f"{path}.tmp"
+        with torch.no_grad():
+            torch.onnx.export(
+                module, example, tmp_path, input_names=[input_name], output_names=["embeddings"],
+                dynamic_axes={input_name: {0: "batch"}, "embeddings": {0: "batch"}}, opset_version=17
+            )
+        os.replace(tmp_path, path)
+
+    def encode_image(self, images):
+        outputs = self.image_session.run(None, {"images": images.cpu().numpy().astype(np.float32)})
+        return torch.from_numpy(outputs[0])
+
+    def encode_text(self, tokens):
+        outputs = self.text_session.run(None, {"tokens": tokens.cpu().numpy().astype(np.int64)})
+        return torch.from_numpy(outputs[0])
+
+
+BACKENDS = {
+    "torch": TorchBackend,
+    "quantized": QuantizedBackend,
+    "compiled": CompiledBackend,
+    "onnx": OnnxBackend,
+}
+
+
+def create_backend(name, model, **options):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown CLIP backend: {name}")
+    return BACKENDS[name](model, **options)
+
+
+def _cosine(a, b):
+    a = a.float() / a.float().norm(dim=-1, keepdim=True)
+    b = b.float() / b.float().norm(dim=-1, keepdim=True)
+    return (a * b).sum(dim=-1)
+
+
+def check_parity(reference, candidate, images, tokens):
+    """Minimum cosine similarity between reference and candidate embeddings over both encoders."""
+    with torch.no_grad():
+        image_cosine = _cosine(reference.encode_image(images), candidate.encode_image(images)).min()
+        text_cosine = _cosine(reference.encode_text(tokens), candidate.encode_text(tokens)).min()
+    return float(min(image_cosine, text_cosine))
@@ -1,25 +1,102 @@
+import os
 import torch
 import clip
 from PIL import Image
+from src.models.clip_backends import TorchBackend, check_parity, create_backend
+from src.utils.logger import setup_logger
+from src.utils.metrics import metrics
+
+PARITY_PROMPTS = ["a photo of a dog", "a red sports car on a highway", "mountains at sunset", "a bowl of fruit"]
+PARITY_IMAGES = 4
 
 class CLIPModel:
-    def __init__(self, model_name, device="cpu"):
+    def __init__(self, model_name, device="cpu", backend="torch", backend_options=None, parity_min_cosine=0.99,
+                 parity_image_dir=None):
+        """`backend` picks how the encoders run ("torch", "quantized", "compiled", "onnx").
+
+        Non-reference backends are checked against fp32 on a fixed probe batch
+        of images from `parity_image_dir` (topped up with generated ones); if any
+        embedding falls below `parity_min_cosine` the fp32 backend is used instead.
+        """
         self.device = device
+        self.model_name = model_name
+        self.logger = setup_logger()
         self.model, self.preprocess = clip.load(model_name, device=device)
+        self.backend_name = backend
+        self.parity_image_dir = parity_image_dir
+        self.backend = self._build_backend(backend, backend_options or {}, parity_min_cosine)
+
+    def _parity_images(self):
+        """A preprocessed probe batch: the first decodable images in `parity_image_dir`, then generated ones.
+
+        Real photos matter here: quantization and compilation errors show up
+        on natural pixel statistics that random noise doesn't exercise.
+        """
+        images = []
+        if self.parity_image_dir and os.path.isdir(self.parity_image_dir):
+            for name in sorted(os.listdir(self.parity_image_dir)):
+                if len(images) == PARITY_IMAGES:
+                    break
+                try:
+                    with Image.open(os.path.join(self.parity_image_dir, name)) as image:
+                        images.append(self.preprocess(image.convert("RGB")))
+                except Exception:
+                    continue
+        generated = [
+            Image.effect_mandelbrot((256, 256), (-2.0, -1.5, 1.0, 1.5), 100).convert("RGB"),
+            Image.merge("RGB", (
+                Image.linear_gradient("L"), Image.radial_gradient("L"), Image.linear_gradient("L").rotate(90)
+            )),
+            Image.effect_noise((256, 256), 64).convert("RGB"),
+            Image.radial_gradient("L").convert("RGB"),
+        ]
+        images.extend(self.preprocess(image) for image in generated[:PARITY_IMAGES - len(images)])
+        return torch.stack(images).to(self.device)
+
+    def _build_backend(self, name, options, parity_min_cosine):
+        reference = TorchBackend(self.model)
+        if name == "torch":
+            return reference
+        if name == "onnx":
+            options = {"model_name": self.model_name, **options}
+        try:
+            backend = create_backend(name, self.model, **options)
+            images = self._parity_images()
+            tokens = clip.tokenize(PARITY_PROMPTS).to(self.device)
+            cosine = check_parity(reference, backend, images, tokens)
+        except Exception as e:
+            self.logger.error(f"CLIP backend '{name}' unavailable, using fp32: {e}")
+            self.backend_name = "torch"
+            return reference
+        if cosine < parity_min_cosine:
+            self.logger.error(
+                f"CLIP backend '{name}' failed parity (min cosine {cosine:.4f} < {parity_min_cosine}), using fp32"
+            )
+            self.backend_name = "torch"
+            return reference
+        self.logger.info(f"CLIP backend '{name}' passed parity (min cosine {cosine:.4f})")
+        return backend
+
+    def warmup(self):
+        """One dummy forward pass per encoder, so the first request doesn't pay for lazy init."""
+        resolution = self.model.visual.input_resolution
+        self.encode_texts(["warmup"])
+        self.encode_image_batch(torch.zeros(1, 3, resolution, resolution, device=self.device))
 
     def encode_text(self, text):
-        tokenized = clip.tokenize([text]).to(self.device)
-        with torch.no_grad():
-            embedding = self.model.encode_text(tokenized)
-        return embedding / embedding.norm(dim=-1, keepdim=True)
+        return self.encode_texts([text])
+
+    def encode_texts(self, texts):
+        tokenized = clip.tokenize(texts, truncate=True).to(self.device)
+        with torch.no_grad(), metrics.span("clip_text"):
+            embeddings = self.backend.encode_text(tokenized)
+        return embeddings / embeddings.norm(dim=-1, keepdim=True)
 
     def encode_image(self, image):
         processed = self.preprocess(Image.open(image).convert("RGB")).unsqueeze(0).to(self.device)
-        with torch.no_grad():
-            embedding = self.model.encode_image(processed)
-        return embedding / embedding.norm(dim=-1, keepdim=True)
+        return self.encode_image_batch(processed)
 
     def encode_image_batch(self, images):
-        with torch.no_grad():
-            embeddings = self.model.encode_image(images)
-        return embeddings / embeddings.norm(dim=-1, keepdim=True)
\ No newline at end of file
+        with torch.no_grad(), metrics.span("clip_image"):
+            embeddings = self.backend.encode_image(images)
+        return embeddings / embeddings.norm(dim=-1, keepdim=True)
@@ -0,0 +1,117 @@
+import json
+import time
+from threading import Lock, Thread
+from src.utils.logger import setup_logger
+from src.utils.metrics import metrics
+
+
+class LazyModel:
+    """Proxy that builds a model on first attribute access.
+
+    `factory` is called at most once, under a lock, the first time anything
+    other than the eager `attributes` (e.g. `model_name`) is looked up, so
+    wrappers and interfaces can be wired up before any weights are read.
+    """
+
+    def __init__(self, name, factory, **attributes):
+        self._name = name
+        self._factory = factory
+        self._attributes = attributes
+        self._target = None
+        self._lock = Lock()
+        self._error = None
+        self._load_seconds = None
+
+    @property
+    def loaded(self):
+        return self._target is not None
+
+    def load(self):
+        if self._target is not None:
+            return self._target
+        with self._lock:
+            if self._target is None:
+                logger = setup_logger()
+                logger.info(f"Loading {self._name} model...")
+                started = time.perf_counter()
+                try:
+                    target = self._factory()
+                except Exception as e:
+                    self._error = str(e)
+                    metrics.inc("model_load_failures_total", model=self._name)
+                    raise
+                self._load_seconds = time.perf_counter() - started
+                self._error = None
+                self._target = target
+                metrics.set_gauge("model_loaded", 1, model=self._name)
+                metrics.set_gauge("model_load_seconds", self._load_seconds, model=self._name)
+                logger.info(f"Loaded {self._name} model in {self._load_seconds:.1f}s")
+        return self._target
+
+    def status(self):
+        return {"loaded": self.loaded, "load_seconds": self._load_seconds, "error": self._error}
+
+    def __getattr__(self, name):
+        # Only reached for names not set in __init__.
+        attributes = self.__dict__.get("_attributes", {})
+        if name in attributes:
+            return attributes[name]
+        return getattr(self.load(), name)
+
+
+class ModelRegistry:
+    """Named lazy models plus the background warmup that preloads some of them."""
+
+    def __init__(self):
+        self.models = {}
+        self.warmup_pending = set()
+        self.lock = Lock()
+        self.logger = setup_logger()
+
+    def register(self, name, factory, **attributes):
+        model = LazyModel(name, factory, **attributes)
+        self.models[name] = model
+        metrics.set_gauge("model_loaded", 0, model=name)
+        return model
+
+    def status(self):
+        return {name: model.status() for name, model in self.models.items()}
+
+    @property
+    def ready(self):
+        """True once every model queued for warmup has been loaded (or failed)."""
+        with self.lock:
+            return not self.warmup_pending
+
+    def _warmup(self, names):
+        for name in names:
+            try:
+                model = self.models[name].load()
+                warmup = getattr(model, "warmup", None)
+                if warmup is not None:
+                    started = time.perf_counter()
+                    warmup()
+                    self.logger.info(f"Warmed up {name} in {time.perf_counter() - started:.1f}s")
+            except Exception as e:
+                self.logger.error(f"Warmup of {name} failed: {e}")
+            finally:
+                with self.lock:
+                    self.warmup_pending.discard(name)
+
+    def start_warmup(self, names):
+        """Load `names` in order on a daemon thread, running each model's `warmup()` if it has one."""
+        names = [name for name in names if name in self.models]
+        with self.lock:
+            self.warmup_pending.update(names)
+        Thread(target=self._warmup, args=(names,), name="model-warmup", daemon=True).start()
+
+    def healthz(self, params):
+        """Status-server route: liveness, always 200 while the process can answer."""
+        return 200, "application/json", json.dumps({"status": "alive", "models": self.status()}) + "\n"
+
+    def readyz(self, params):
+        """Status-server route: 503 until warmup has finished."""
+        ready = self.ready
+        body = {"status": "ready" if ready else "warming", "models": self.status()}
+        return (200 if ready else 503), "application/json", json.dumps(body) + "\n"
+
@@ -0,0 +1,227 @@
+import json
+import os
+import re
+import tempfile
+import time
+import numpy as np
+from collections import OrderedDict
+from threading import Lock
+from src.utils.logger import setup_logger
+from src.utils.metrics import metrics
+
+
+def _normalize(text):
+    return re.sub(r"\s+", " ", (text or "").strip().lower())
+
+
+class CachedLLM:
+    """Caching front end for LocalLLM with the same query-enhancement methods.
+
+    Results are kept in an LRU keyed by the method name and its normalized
+    inputs and expire after `ttl_seconds`. When a `clip_model` and
+    `semantic_threshold` are given, `enhance_query` misses fall back to the
+    cached query whose CLIP text embedding is most similar, if it clears the
+    threshold. Those embeddings live in one preallocated matrix updated as
+    entries come and go, and are scored outside the lock. Empty results (a
+    failed or refused LLM call) expire after `empty_ttl_seconds` instead. The
+    cache is reloaded from `cache_path` on start; the maintenance scheduler
+    calls `save` to write it back, so puts never touch the disk.
+    """
+
+    def __init__(self, llm_model, cache_path=None, max_entries=10000, ttl_seconds=86400,
+                 clip_model=None, semantic_threshold=None, empty_ttl_seconds=60):
+        self.llm_model = llm_model
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.clip_model = clip_model
+        self.semantic_threshold = semantic_threshold if clip_model is not None else None
+        self.empty_ttl_seconds = empty_ttl_seconds
+        self.entries = OrderedDict()  # {key: {"value", "expires", "group", "embedding"}}
+        self.vectors = None  # (capacity, D) embeddings of semantic entries
+        self.row_keys = []  # key per matrix row, None when free
+        self.row_groups = []  # group per matrix row
+        self.key_rows = {}  # {key: row}
+        self.free_rows = []
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.unsaved = 0
+        self.lock = Lock()
+        self.save_lock = Lock()  # one writer at a time; held while serializing outside `lock`
+        self.logger = setup_logger()
+        self._load()
+
+    def __getattr__(self, name):
+        return getattr(self.llm_model, name)
+
+    def _load(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, "r") as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            self.logger.error(f"Ignoring unreadable LLM cache {self.cache_path}: {e}")
+            return
+        now = time.time()
+        for key, entry in entries:
+            if entry["expires"] > now:
+                if entry.get("embedding") is not None:
+                    entry["embedding"] = np.asarray(entry["embedding"], dtype=np.float32)
+                    self._index_add(key, entry["group"], entry["embedding"])
+                self.entries[key] = entry
+        self.logger.info(f"Loaded {len(self.entries)} cached LLM responses")
+
+    def save(self):
+        """Write the cache to `cache_path` if anything changed since the last save; returns the entries written."""
+        if not self.cache_path:
+            return 0
+        with self.save_lock:
+            with self.lock:
+                if not self.unsaved:
+                    return 0
+                entries = [
+                    (key, dict(entry, embedding=entry["embedding"].tolist() if entry.get("embedding") is not None else None))
+                    for key, entry in self.entries.items()
+                ]
+                unsaved = self.unsaved
+                self.unsaved = 0
+            directory = os.path.dirname(self.cache_path) or "."
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(entries, f)
+                os.replace(tmp_path, self.cache_path)
+            except BaseException:
+                os.remove(tmp_path)
+                with self.lock:
+                    self.unsaved += unsaved
+                raise
+        return len(entries)
+
+    def _index_add(self, key, group, embedding):
+        """Put `embedding` in a free matrix row, growing the matrix when full. Caller holds the lock."""
+        if self.free_rows:
+            row = self.free_rows.pop()
+            self.row_keys[row], self.row_groups[row] = key, group
+        else:
+            row = len(self.row_keys)
+            self.row_keys.append(key)
+            self.row_groups.append(group)
+            if self.vectors is None or row >= len(self.vectors):
+                grown = np.zeros((max(64, 2 * row), len(embedding)), dtype=np.float32)
+                if self.vectors is not None:
+                    grown[:row] = self.vectors[:row]
+                self.vectors = grown
+        self.vectors[row] = embedding
+        self.key_rows[key] = row
+
+    def _index_remove(self, key):
+        row = self.key_rows.pop(key, None)
+        if row is not None:
+            self.row_keys[row] = self.row_groups[row] = None
+            self.free_rows.append(row)
+
+    def _delete(self, key):
+        del self.entries[key]
+        self._index_remove(key)
+
+    def _get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry["expires"] <= time.time():
+                self._delete(key)
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        metrics.inc("cache_hits_total", cache="llm")
+        return entry["value"]
+
+    def _semantic_get(self, group, embedding):
+        with self.lock:
+            if self.vectors is None:
+                return None
+            vectors = self.vectors[:len(self.row_keys)]
+            groups = np.array([g == group for g in self.row_groups], dtype=bool)
+        # Rows can be reused while scoring; the winner is re-checked under the lock below.
+        scores = vectors @ embedding
+        scores[~groups] = -np.inf
+        best = int(np.argmax(scores)) if len(scores) else 0
+        if not len(scores) or scores[best] < self.semantic_threshold:
+            return None
+        with self.lock:
+            key = self.row_keys[best] if best < len(self.row_keys) else None
+            entry = self.entries.get(key) if key is not None else None
+            if entry is None or entry["group"] != group or entry["expires"] <= time.time():
+                return None
+            self.entries.move_to_end(key)
+            self.semantic_hits += 1
+        metrics.inc("cache_hits_total", cache="llm_semantic")
+        return entry["value"]
+
+    def _put(self, key, value, group=None, embedding=None):
+        if not value:
+            # Don't let one failed call pin an empty answer for the full TTL or serve it to similar queries.
+            ttl, group, embedding = self.empty_ttl_seconds, None, None
+        else:
+            ttl = self.ttl_seconds
+        with self.lock:
+            self._index_remove(key)
+            self.entries[key] = {
+                "value": value,
+                "expires": time.time() + ttl,
+                "group": group,
+                "embedding": embedding,
+            }
+            self.entries.move_to_end(key)
+            if embedding is not None:
+                self._index_add(key, group, embedding)
+            while len(self.entries) > self.max_entries:
+                oldest, _ = self.entries.popitem(last=False)
+                self._index_remove(oldest)
+            self.misses += 1
+            self.unsaved += 1
+        metrics.inc("cache_misses_total", cache="llm")
+
+    def _cached(self, method, *args, semantic=False):
+        normalized = [_normalize(str(a)) for a in args]
+        key = json.dumps([method] + normalized)
+        value = self._get(key)
+        if value is not None:
+            return value
+        group, embedding = None, None
+        if semantic and self.semantic_threshold is not None and normalized[0]:
+            # Near-duplicates must agree on everything except the free-text first argument.
+            group = json.dumps([method] + normalized[1:])
+            embedding = self.clip_model.encode_text(normalized[0]).float().cpu().numpy()[0]
+            value = self._semantic_get(group, embedding)
+            if value is not None:
+                return value
+        with metrics.span("llm"):
+            value = getattr(self.llm_model, method)(*args)
+        self._put(key, value, group, embedding)
+        return value
+
+    def enhance_query(self, user_query, num_variations=5):
+        return self._cached("enhance_query", user_query, num_variations, semantic=True)
+
+    def refine_with_feedback(self, user_query, feedback):
+        return self._cached("refine_with_feedback", user_query, feedback)
+
+    def enhance_with_caption(self, user_query, blip_caption):
+        return self._cached("enhance_with_caption", user_query, blip_caption)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.semantic_hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.semantic_hits) / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,268 @@
+import os
+import numpy as np
+from threading import RLock
+from src.search.scoring import top_k
+from src.utils.logger import setup_logger
+
+
+def _kmeans(vectors, nlist, iterations=10, seed=0):
+    """Spherical k-means on normalized vectors; returns (nlist, D) unit centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, vectors)
+        counts = np.bincount(assign, minlength=nlist)
+        empty = counts == 0
+        if empty.any():
+            # Re-seed empty lists from random points so every list stays useful.
+            sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = sums / np.maximum(norms, 1e-12)
+    return centroids.astype(np.float32)
+
+
+class IVFIndex:
+    """Inverted-file approximate nearest-neighbour index over normalized embeddings.
+
+    Vectors are bucketed by their nearest k-means centroid; a query scans only
+    the `nprobe` closest buckets, so `nprobe` trades recall for latency
+    (`nprobe == nlist` is exact search). Until enough vectors have been added
+    to train the centroids, search falls back to a brute-force scan.
+
+    `add` never trains: the owner calls `train` when `needs_training` says
+    so (the app's index maintenance job, or the ingest script before a save),
+    keeping k-means off the request path.
+    """
+
+    def __init__(self, dim=None, nlist=64, nprobe=8, min_points_per_list=16, max_train_points=65536):
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_points_per_list = min_points_per_list
+        self.max_train_points = max_train_points
+        self.vectors = np.zeros((0, dim or 0), dtype=np.float32)
+        self.ids = []
+        self.alive = np.zeros(0, dtype=bool)
+        self.assign = np.zeros(0, dtype=np.int32)
+        self.id_rows = {}  # {id: row}
+        self.size = 0  # rows used in self.vectors, including deleted ones
+        self.centroids = None
+        self.trained_size = 0
+        self.lists = []
+        self._list_cache = {}
+        self.dirty = 0
+        self.file_mtime = None  # mtime_ns of the file this index last loaded or saved
+        self.lock = RLock()
+        self.logger = setup_logger()
+
+    def __len__(self):
+        return len(self.id_rows)
+
+    def __contains__(self, item_id):
+        return item_id in self.id_rows
+
+    def _reserve(self, extra):
+        needed = self.size + extra
+        if needed <= len(self.vectors):
+            return
+        capacity = max(needed, 2 * len(self.vectors), 1024)
+        vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+        vectors[:self.size] = self.vectors[:self.size]
+        alive = np.zeros(capacity, dtype=bool)
+        alive[:self.size] = self.alive[:self.size]
+        assign = np.full(capacity, -1, dtype=np.int32)
+        assign[:self.size] = self.assign[:self.size]
+        self.vectors, self.alive, self.assign = vectors, alive, assign
+
+    def add(self, ids, vectors):
+        """Insert or replace vectors for `ids`."""
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        if len(ids) == 0:
+            return
+        with self.lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                self.vectors = np.zeros((0, self.dim), dtype=np.float32)
+            self.remove([i for i in ids if i in self.id_rows])
+            self._reserve(len(ids))
+            rows = np.arange(self.size, self.size + len(ids))
+            self.vectors[rows] = vectors
+            self.alive[rows] = True
+            self.ids.extend(ids)
+            self.id_rows.update(zip(ids, rows.tolist()))
+            self.size += len(ids)
+            if self.centroids is not None:
+                self._assign_rows(rows)
+            self.dirty += len(ids)
+
+    def remove(self, ids):
+        """Delete `ids` from the index; unknown ids are ignored."""
+        with self.lock:
+            for item_id in ids:
+                row = self.id_rows.pop(item_id, None)
+                if row is not None:
+                    self.alive[row] = False
+                    self.dirty += 1
+            # Dead rows are skipped at query time and dropped by compact().
+            if self.size > 1024 and len(self.id_rows) < self.size // 2:
+                self.compact()
+
+    def get(self, ids):
+        """Return the stored vectors for `ids` (all of which must be present)."""
+        with self.lock:
+            return self.vectors[[self.id_rows[i] for i in ids]].copy()
+
+    def _assign_rows(self, rows):
+        assign = np.argmax(self.vectors[rows] @ self.centroids.T, axis=1).astype(np.int32)
+        self.assign[rows] = assign
+        for row, list_id in zip(rows.tolist(), assign.tolist()):
+            self.lists[list_id].append(row)
+            self._list_cache.pop(list_id, None)
+
+    def needs_training(self):
+        """Whether there are enough vectors for a first training, or the corpus outgrew the last one."""
+        alive = len(self.id_rows)
+        if alive < self.nlist * self.min_points_per_list:
+            return False
+        # Retrain as the corpus grows so lists stay balanced.
+        return self.centroids is None or alive >= 4 * self.trained_size
+
+    def train(self):
+        """(Re)compute the centroids from the live vectors and rebuild the lists.
+
+        k-means runs on a copied sample without the lock, so searches and
+        adds continue meanwhile; only reassigning the rows holds it.
+        """
+        with self.lock:
+            rows = np.flatnonzero(self.alive[:self.size])
+            if len(rows) < self.nlist:
+                return
+            sample = rows
+            if len(rows) > self.max_train_points:
+                sample = np.random.default_rng(0).choice(rows, self.max_train_points, replace=False)
+            sample = self.vectors[sample].copy()
+        centroids = _kmeans(sample, self.nlist)
+        with self.lock:
+            rows = np.flatnonzero(self.alive[:self.size])
+            self.centroids = centroids
+            self.trained_size = len(rows)
+            self.lists = [[] for _ in range(self.nlist)]
+            self._list_cache = {}
+            self.assign[:self.size] = -1
+            self._assign_rows(rows)
+            self.logger.info(f"Trained IVF index with {self.nlist} lists over {len(rows)} vectors")
+
+    def compact(self):
+        """Drop deleted rows and renumber the remaining ones."""
+        with self.lock:
+            rows = np.flatnonzero(self.alive[:self.size])
+            self.vectors = self.vectors[rows].copy()
+            self.ids = [self.ids[r] for r in rows.tolist()]
+            self.alive = np.ones(len(rows), dtype=bool)
+            self.assign = self.assign[rows].copy()
+            self.id_rows = {item_id: row for row, item_id in enumerate(self.ids)}
+            self.size = len(rows)
+            if self.centroids is not None:
+                self.lists = [[] for _ in range(self.nlist)]
+                for row, list_id in enumerate(self.assign.tolist()):
+                    self.lists[list_id].append(row)
+                self._list_cache = {}
+
+    def _list_rows(self, list_id):
+        cached = self._list_cache.get(list_id)
+        if cached is None:
+            cached = np.asarray(self.lists[list_id], dtype=np.int64)
+            self._list_cache[list_id] = cached
+        return cached
+
+    def _candidate_rows(self, query, nprobe):
+        if self.centroids is None or nprobe >= self.nlist:
+            return np.flatnonzero(self.alive[:self.size])
+        probe, _ = top_k(self.centroids @ query, nprobe)
+        rows = np.concatenate([self._list_rows(list_id) for list_id in probe.tolist()])
+        return rows[self.alive[rows]]
+
+    def search(self, query_embeddings, k=10, nprobe=None):
+        """Return, for each query, a list of (id, score) pairs, best first."""
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        nprobe = nprobe or self.nprobe
+        results = []
+        with self.lock:
+            for query in queries:
+                rows = self._candidate_rows(query, nprobe)
+                if len(rows) == 0:
+                    results.append([])
+                    continue
+                best, scores = top_k(self.vectors[rows] @ query, k)
+                results.append([(self.ids[r], float(s)) for r, s in zip(rows[best].tolist(), scores)])
+        return results
+
+    def _merge_newer(self, path):
+        """Add ids another process saved to `path` since we last read or wrote it (e.g. a bulk ingest)."""
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if self.file_mtime is not None and mtime <= self.file_mtime:
+            return
+        other = IVFIndex.load(path)
+        new_ids = [item_id for item_id in other.ids if item_id not in self.id_rows]
+        if new_ids:
+            self.add(new_ids, other.get(new_ids))
+            self.logger.info(f"Merged {len(new_ids)} vectors saved to {path} by another process")
+
+    def save(self, path):
+        """Write the live vectors, ids and centroids to a single .npz file atomically.
+
+        Vectors another process added to `path` in the meantime are merged in
+        first, so the app and a concurrent bulk ingest don't drop each other's
+        additions.
+        """
+        with self.lock:
+            self._merge_newer(path)
+            rows = np.flatnonzero(self.alive[:self.size])
+            data = {
+                "vectors": self.vectors[rows],
+                "ids": np.array([self.ids[r] for r in rows.tolist()], dtype=str),
+                "params": np.array([self.nlist, self.nprobe, self.trained_size], dtype=np.int64),
+            }
+            if self.centroids is not None:
+                data["centroids"] = self.centroids
+                data["assign"] = self.assign[rows]
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            tmp_path = f"{path}.tmp.npz"
+            np.savez(tmp_path, **data)
+            os.replace(tmp_path, path)
+            self.file_mtime = os.stat(path).st_mtime_ns
+            self.dirty = 0
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        """Load an index written by `save`; keyword arguments override saved parameters."""
+        mtime = os.stat(path).st_mtime_ns
+        with np.load(path, allow_pickle=False) as data:
+            nlist, nprobe, trained_size = data["params"].tolist()
+            params = {"nlist": nlist, "nprobe": nprobe}
+            params.update(kwargs)
+            vectors = data["vectors"]
+            index = cls(dim=vectors.shape[1], **params)
+            index.vectors = vectors.copy()
+            index.ids = data["ids"].tolist()
+            index.size = len(index.ids)
+            index.alive = np.ones(index.size, dtype=bool)
+            index.assign = np.full(index.size, -1, dtype=np.int32)
+            index.id_rows = {item_id: row for row, item_id in enumerate(index.ids)}
+            if "centroids" in data.files and data["centroids"].shape[0] == index.nlist:
+                index.centroids = data["centroids"]
+                index.trained_size = trained_size
+                index.assign = data["assign"].astype(np.int32)
+                index.lists = [[] for _ in range(index.nlist)]
+                for row, list_id in enumerate(index.assign.tolist()):
+                    index.lists[list_id].append(row)
+            elif index.needs_training():
+                index.train()
+        index.file_mtime = mtime
+        index.logger.info(f"Loaded IVF index with {len(index)} vectors from {path}")
+        return index
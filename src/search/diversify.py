@@ -0,0 +1,68 @@
+import numpy as np
+from src.search.scoring import top_k
+
+
+def collapse_near_duplicates(embeddings, order, threshold):
+    """Drop every candidate whose cosine similarity to a better-ranked kept one exceeds `threshold`.
+
+    `order` lists candidate rows best first; returns the surviving rows in
+    the same order. One (P, P) similarity product, then a greedy pass of
+    vector ORs, so a pool of a few thousand costs milliseconds.
+    """
+    order = np.asarray(order)
+    if len(order) < 2:
+        return order
+    pool = np.asarray(embeddings, dtype=np.float32)[order]
+    duplicate = (pool @ pool.T) > threshold
+    suppressed = np.zeros(len(order), dtype=bool)
+    keep = []
+    for i in range(len(order)):
+        if suppressed[i]:
+            continue
+        keep.append(i)
+        suppressed |= duplicate[i]
+    return order[keep]
+
+
+def mmr(relevance, embeddings, k, mmr_lambda=0.7):
+    """Maximal marginal relevance: greedily pick `k` rows maximizing
+    `lambda * relevance - (1 - lambda) * max similarity to the rows already picked`.
+
+    `relevance` is rescaled to [0, 1] first so fused scores (e.g. RRF) trade
+    off against cosine similarity on the same scale. Returns row indices.
+    """
+    relevance = np.asarray(relevance, dtype=np.float32)
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    k = min(k, len(relevance))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    spread = relevance.max() - relevance.min()
+    scaled = (relevance - relevance.min()) / spread if spread > 0 else np.ones_like(relevance)
+    max_similarity = np.full(len(relevance), -np.inf, dtype=np.float32)
+    available = np.ones(len(relevance), dtype=bool)
+    selected = []
+    for _ in range(k):
+        redundancy = np.where(np.isfinite(max_similarity), max_similarity, 0.0)
+        objective = mmr_lambda * scaled - (1 - mmr_lambda) * redundancy
+        objective[~available] = -np.inf
+        best = int(np.argmax(objective))
+        selected.append(best)
+        available[best] = False
+        max_similarity = np.maximum(max_similarity, embeddings @ embeddings[best])
+    return np.array(selected, dtype=np.int64)
+
+
+def diversify(relevance, embeddings, k, dedup_threshold=None, mmr_lambda=1.0, pool_size=1000):
+    """Top-`k` row indices and relevance scores after near-duplicate collapse and MMR.
+
+    Only the best `pool_size` rows by relevance are considered, which bounds
+    the quadratic similarity work on large candidate sets.
+    """
+    pool, _ = top_k(relevance, max(k, pool_size))
+    if dedup_threshold is not None:
+        pool = collapse_near_duplicates(embeddings, pool, dedup_threshold)
+    if mmr_lambda < 1.0:
+        pool = pool[mmr(relevance[pool], np.asarray(embeddings)[pool], k, mmr_lambda)]
+    else:
+        pool = pool[:k]
+    return pool, relevance[pool]
@@ -0,0 +1,60 @@
+import os
+import numpy as np
+from src.search.diversify import diversify
+from src.search.scoring import fuse_scores, score_matrix
+
+
+class HybridSearcher:
+    """Local search combining BM25 over image tags with CLIP vector scores.
+
+    BM25 picks up to `lexical_candidates` tagged images; the ANN index adds
+    its `vector_candidates` nearest neighbours per query so untagged images
+    can still surface. Only that union is scored with CLIP, which keeps
+    vector scoring cheap on large corpora. The two rankings are merged with
+    reciprocal-rank fusion; images the lexical stage didn't match count as
+    ranked last there. Results carry their fused CLIP score (not the RRF
+    score), so thresholds like `index.confidence_threshold` keep their
+    meaning.
+    """
+
+    def __init__(self, clip_model, ann_index, lexical_index, fusion="max", lexical_candidates=1000,
+                 vector_candidates=50, rrf_k=60, diversity=None):
+        self.clip_model = clip_model
+        self.ann_index = ann_index
+        self.lexical_index = lexical_index
+        self.fusion = fusion
+        self.lexical_candidates = lexical_candidates
+        self.vector_candidates = vector_candidates
+        self.rrf_k = rrf_k
+        self.diversity = diversity or {}
+
+    def search(self, query_text, top_k=10, nprobe=None):
+        queries = [query_text] if isinstance(query_text, str) else list(query_text)
+        text_embeddings = self.clip_model.encode_texts(queries).float().cpu().numpy()
+        lexical_hits = self.lexical_index.search(queries, self.lexical_candidates)
+        candidates = dict.fromkeys(item_id for item_id, _ in lexical_hits)
+        for hits in self.ann_index.search(text_embeddings, self.vector_candidates, nprobe):
+            candidates.update(dict.fromkeys(item_id for item_id, _ in hits))
+        # Files can disappear between indexing and now (eviction, manual cleanup).
+        missing = [p for p in candidates if not os.path.exists(p)]
+        if missing:
+            self.ann_index.remove(missing)
+            self.lexical_index.remove(missing)
+        paths = [p for p in candidates if p in self.ann_index and os.path.exists(p)]
+        if not paths:
+            return []
+        embeddings = self.ann_index.get(paths)
+        vector_scores = fuse_scores(score_matrix(text_embeddings, embeddings), self.fusion)
+
+        lexical_rank = {item_id: rank for rank, item_id in enumerate(item_id for item_id, _ in lexical_hits)}
+        lexical_ranks = np.array([lexical_rank.get(p, len(lexical_rank)) for p in paths], dtype=np.float32)
+        vector_ranks = np.empty(len(paths), dtype=np.float32)
+        vector_ranks[np.argsort(-vector_scores, kind="stable")] = np.arange(len(paths))
+        fused = 1.0 / (self.rrf_k + 1 + lexical_ranks) + 1.0 / (self.rrf_k + 1 + vector_ranks)
+
+        diversity = self.diversity
+        indices, _ = diversify(
+            fused, embeddings, top_k, diversity.get("dedup_threshold"), diversity.get("mmr_lambda", 1.0),
+            diversity.get("pool_size", 1000)
+        )
+        return [(paths[i], float(vector_scores[i])) for i in indices]
@@ -1,26 +1,96 @@
-import torch
-import torch.nn.functional as F
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from src.data.image_dataset import ImageDataset, collate_fn
-from src.models.clip_model import CLIPModel
+from src.search.scoring import ScoringEngine
+from src.utils.metrics import metrics
 from torch.utils.data import DataLoader
 
 class ImageSearcher:
-    def __init__(self, clip_model, image_paths, batch_size=4):
+    def __init__(self, clip_model, image_paths, batch_size=4, embedding_store=None, fusion="max",
+                 dataset_options=None, decode_workers=0, decode_backend="threads", diversity=None):
         self.clip_model = clip_model
-        self.dataset = ImageDataset(image_paths, transform=clip_model.preprocess)
-        self.data_loader = DataLoader(
-            self.dataset, batch_size=batch_size, shuffle=False, collate_fn=collate_fn
+        self.image_paths = image_paths
+        self.batch_size = batch_size
+        self.embedding_store = embedding_store
+        self.fusion = fusion
+        self.dataset_options = dataset_options or {}
+        self.decode_workers = decode_workers
+        self.decode_backend = decode_backend
+        self.diversity = diversity or {}  # ScoringEngine dedup/MMR options
+        self.paths = []
+        self.embeddings = None
+
+    def _batches(self, dataset):
+        """Yield collated batches, decoding in worker threads or processes if configured."""
+        if self.decode_workers > 0 and self.decode_backend == "threads":
+            # PIL releases the GIL while decoding, so threads parallelize without forking.
+            with ThreadPoolExecutor(self.decode_workers, thread_name_prefix="decode") as pool:
+                items = pool.map(dataset.__getitem__, range(len(dataset)))
+                batch = []
+                for item in items:
+                    batch.append(item)
+                    if len(batch) == self.batch_size:
+                        yield collate_fn(batch)
+                        batch = []
+                if batch:
+                    yield collate_fn(batch)
+            return
+        num_workers = self.decode_workers if self.decode_backend == "processes" else 0
+        yield from DataLoader(
+            dataset, batch_size=self.batch_size, shuffle=False, collate_fn=collate_fn, num_workers=num_workers
         )
 
-    def search(self, query_text, top_k=10):
-        text_embedding = self.clip_model.encode_text(query_text)
-        ranked_scores = []
-        for batch in self.data_loader:
+    def _encode_paths(self, image_paths):
+        """Run CLIP over `image_paths`, returning the decodable paths and their embeddings."""
+        dataset = ImageDataset(image_paths, transform=self.clip_model.preprocess, **self.dataset_options)
+        paths, embeddings = [], []
+        for batch in self._batches(dataset):
             if batch is None:
                 continue
-            paths = batch["path"]
             images = batch["image"].to(self.clip_model.device)
-            image_embeddings = self.clip_model.encode_image_batch(images)
-            scores = F.cosine_similarity(text_embedding, image_embeddings).tolist()
-            ranked_scores.extend(zip(paths, scores))
-        return sorted(ranked_scores, key=lambda x: x[1], reverse=True)[:top_k]
\ No newline at end of file
+            paths.extend(batch["path"])
+            embeddings.append(self.clip_model.encode_image_batch(images).float().cpu().numpy())
+        if not embeddings:
+            return [], None
+        return paths, np.concatenate(embeddings)
+
+    def embed_images(self):
+        """Return (paths, embeddings) for every decodable image, encoding only store misses."""
+        if self.embedding_store is None:
+            return self._encode_paths(self.image_paths)
+
+        hashes = self.embedding_store.hash_paths(self.image_paths)
+        vectors, found = self.embedding_store.get_many(hashes)
+        metrics.inc("cache_hits_total", int(found.sum()), cache="embedding")
+        metrics.inc("cache_misses_total", int((~found).sum()), cache="embedding")
+        path_hash = dict(zip(self.image_paths, hashes))
+        embeddings = {h: v for h, v, hit in zip(hashes, vectors, found) if hit}
+
+        # Identical content under different paths only needs one forward pass.
+        misses = {}
+        for path, content_hash, hit in zip(self.image_paths, hashes, found):
+            if content_hash is not None and not hit:
+                misses.setdefault(content_hash, path)
+        if misses:
+            encoded_paths, encoded = self._encode_paths(list(misses.values()))
+            if encoded_paths:
+                encoded_hashes = [path_hash[p] for p in encoded_paths]
+                self.embedding_store.put_many(encoded_hashes, encoded)
+                embeddings.update(zip(encoded_hashes, encoded))
+
+        paths = [p for p, h in zip(self.image_paths, hashes) if h in embeddings]
+        if not paths:
+            return [], None
+        return paths, np.stack([embeddings[path_hash[p]] for p in paths])
+
+    def search(self, query_text, top_k=10, fusion=None):
+        """Rank images against one query or a list of queries fused into one ranking."""
+        paths, image_embeddings = self.embed_images()
+        self.paths, self.embeddings = paths, image_embeddings
+        if not paths:
+            return []
+        queries = [query_text] if isinstance(query_text, str) else list(query_text)
+        text_embeddings = self.clip_model.encode_texts(queries).float().cpu().numpy()
+        engine = ScoringEngine(image_embeddings, fusion or self.fusion, **self.diversity)
+        indices, scores = engine.rank(text_embeddings, top_k)
+        return [(paths[i], float(s)) for i, s in zip(indices, scores)]
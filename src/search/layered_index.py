@@ -0,0 +1,100 @@
+import numpy as np
+from threading import RLock
+
+
+class LayeredIndex:
+    """A shared, read-only base index with a small writable overlay in front of it.
+
+    Forked workers all point at one base (loaded in the parent before
+    forking, so its arrays stay shared copy-on-write) and keep what they add
+    in their own overlay, which is what `save` writes. Removing a base id
+    only hides it in this process; the files it pointed at are gone anyway,
+    so searches drop it again after a restart. Ids added to the overlay
+    shadow the same id in the base.
+    """
+
+    def __init__(self, base, overlay):
+        self.base = base
+        self.overlay = overlay
+        self.hidden = set()  # base ids removed in this process
+        self.lock = RLock()
+
+    @property
+    def dirty(self):
+        return self.overlay.dirty
+
+    def __len__(self):
+        with self.lock:
+            shadowed = sum(1 for item_id in self.overlay.id_rows if item_id in self.base and item_id not in self.hidden)
+            return len(self.base) - len(self.hidden) + len(self.overlay) - shadowed
+
+    def __contains__(self, item_id):
+        return item_id in self.overlay or (item_id in self.base and item_id not in self.hidden)
+
+    def _in_base(self, item_id):
+        return item_id not in self.overlay and item_id in self.base and item_id not in self.hidden
+
+    def add(self, ids, *args):
+        self.overlay.add(ids, *args)
+        with self.lock:
+            self.hidden.difference_update(ids)
+
+    def remove(self, ids):
+        self.overlay.remove(ids)
+        with self.lock:
+            self.hidden.update(item_id for item_id in ids if item_id in self.base)
+
+    def _merge(self, base_hits, overlay_hits, k):
+        """Best `k` of both layers' (id, score) hits, without hidden or shadowed base ids."""
+        hits = [(item_id, score) for item_id, score in base_hits if self._in_base(item_id)] + overlay_hits
+        return sorted(hits, key=lambda hit: hit[1], reverse=True)[:k]
+
+    def save(self, path):
+        self.overlay.save(path)
+
+
+class LayeredIVFIndex(LayeredIndex):
+    """`LayeredIndex` over two `IVFIndex`es; cosine scores of both layers compare directly."""
+
+    def get(self, ids):
+        vectors = np.empty((len(ids), self.base.dim or self.overlay.dim), dtype=np.float32)
+        in_overlay = [item_id in self.overlay for item_id in ids]
+        overlay_rows = [row for row, hit in enumerate(in_overlay) if hit]
+        base_rows = [row for row, hit in enumerate(in_overlay) if not hit]
+        if overlay_rows:
+            vectors[overlay_rows] = self.overlay.get([ids[row] for row in overlay_rows])
+        if base_rows:
+            vectors[base_rows] = self.base.get([ids[row] for row in base_rows])
+        return vectors
+
+    def search(self, query_embeddings, k=10, nprobe=None):
+        # Ask the base for extra hits to make up for the ones hidden or shadowed here.
+        extra = min(len(self.hidden) + len(self.overlay), k)
+        base_results = self.base.search(query_embeddings, k + extra, nprobe) if len(self.base) else None
+        overlay_results = self.overlay.search(query_embeddings, k, nprobe)
+        if base_results is None:
+            return overlay_results
+        return [self._merge(b, o, k) for b, o in zip(base_results, overlay_results)]
+
+    def needs_training(self):
+        return self.overlay.needs_training()
+
+    def train(self):
+        self.overlay.train()
+
+
+class LayeredBM25Index(LayeredIndex):
+    """`LayeredIndex` over two `BM25Index`es.
+
+    Each layer scores with its own corpus statistics; the overlay is small,
+    so merging by score only reorders hits near the cut-off.
+    """
+
+    def get_text(self, item_id):
+        if item_id in self.overlay:
+            return self.overlay.get_text(item_id)
+        return self.base.get_text(item_id) if self._in_base(item_id) else None
+
+    def search(self, query, k=10):
+        extra = min(len(self.hidden) + len(self.overlay), k)
+        return self._merge(self.base.search(query, k + extra), self.overlay.search(query, k), k)
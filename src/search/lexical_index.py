@@ -0,0 +1,173 @@
+import json
+import math
+import os
+import re
+import numpy as np
+from threading import RLock
+from src.search.scoring import top_k
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has in is it its of on or that the this to with there".split()
+)
+
+
+def tokenize(text):
+    """Lowercased alphanumeric terms of `text`, minus common stopwords."""
+    return [term for term in _TOKEN.findall(text.lower()) if term not in _STOPWORDS]
+
+
+class BM25Index:
+    """Inverted keyword index over image tags (captions, expanded queries) with BM25 scoring.
+
+    Each id (an image path, as in `IVFIndex`) has one text document. Rows
+    are append-only with an `alive` mask, as in the ANN index; re-adding an
+    id replaces its document. Per-term postings are kept as Python lists and
+    turned into NumPy arrays on first use, so a query costs one vectorized
+    update per term rather than a loop over matching documents.
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.dirty = 0
+        self.file_mtime = None  # mtime_ns of the file this index last loaded or saved
+        self.lock = RLock()
+        self._reset()
+
+    def _reset(self):
+        self.ids = []
+        self.texts = []
+        self.lengths = []
+        self.alive = []
+        self.id_rows = {}  # {id: row}
+        self.postings = {}  # {term: ([row], [term frequency])}
+        self._posting_arrays = {}
+        self._row_arrays = None  # (lengths, alive) as arrays
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.id_rows)
+
+    def __contains__(self, item_id):
+        return item_id in self.id_rows
+
+    def add(self, ids, texts):
+        with self.lock:
+            self.remove(ids)
+            for item_id, text in zip(ids, texts):
+                terms = tokenize(text)
+                if not terms:
+                    continue
+                row = len(self.ids)
+                self.ids.append(item_id)
+                self.texts.append(text)
+                self.lengths.append(len(terms))
+                self.alive.append(True)
+                self.id_rows[item_id] = row
+                self.total_length += len(terms)
+                self._row_arrays = None
+                counts = {}
+                for term in terms:
+                    counts[term] = counts.get(term, 0) + 1
+                for term, count in counts.items():
+                    rows, frequencies = self.postings.setdefault(term, ([], []))
+                    rows.append(row)
+                    frequencies.append(count)
+                    self._posting_arrays.pop(term, None)
+                self.dirty += 1
+
+    def remove(self, ids):
+        with self.lock:
+            for item_id in ids:
+                row = self.id_rows.pop(item_id, None)
+                if row is not None:
+                    self.alive[row] = False
+                    self.total_length -= self.lengths[row]
+                    self._row_arrays = None
+                    self.dirty += 1
+            # Dead rows only cost memory; rebuild once they dominate.
+            if len(self.ids) > 1000 and len(self.id_rows) < len(self.ids) // 2:
+                self.compact()
+
+    def compact(self):
+        """Rebuild the postings from the live documents only."""
+        with self.lock:
+            ids, texts = list(self.id_rows), [self.texts[row] for row in self.id_rows.values()]
+            dirty = self.dirty
+            self._reset()
+            self.add(ids, texts)
+            self.dirty = dirty
+
+    def get_text(self, item_id):
+        row = self.id_rows.get(item_id)
+        return None if row is None else self.texts[row]
+
+    def _posting(self, term):
+        arrays = self._posting_arrays.get(term)
+        if arrays is None:
+            rows, frequencies = self.postings[term]
+            arrays = (np.array(rows, dtype=np.int64), np.array(frequencies, dtype=np.float32))
+            self._posting_arrays[term] = arrays
+        return arrays
+
+    def search(self, query, k=10):
+        """Return [(id, score)] of the `k` best BM25 matches for `query` (a string or list of strings)."""
+        queries = [query] if isinstance(query, str) else list(query)
+        terms = set(term for text in queries for term in tokenize(text))
+        with self.lock:
+            count = len(self.id_rows)
+            terms = [term for term in terms if term in self.postings]
+            if not count or not terms:
+                return []
+            if self._row_arrays is None:
+                self._row_arrays = (np.asarray(self.lengths, dtype=np.float32), np.asarray(self.alive, dtype=bool))
+            lengths, alive = self._row_arrays
+            norm = self.k1 * (1 - self.b + self.b * lengths / (self.total_length / count))
+            scores = np.zeros(len(self.ids), dtype=np.float32)
+            for term in terms:
+                rows, frequencies = self._posting(term)
+                live = alive[rows]
+                rows, frequencies = rows[live], frequencies[live]
+                if not len(rows):
+                    continue
+                idf = math.log(1 + (count - len(rows) + 0.5) / (len(rows) + 0.5))
+                scores[rows] += idf * frequencies * (self.k1 + 1) / (frequencies + norm[rows])
+            matched = np.flatnonzero(scores > 0)
+            best, best_scores = top_k(scores[matched], k)
+            return [(self.ids[r], float(s)) for r, s in zip(matched[best].tolist(), best_scores.tolist())]
+
+    def save(self, path):
+        """Write the live documents as JSON atomically; postings are rebuilt on load.
+
+        As with `IVFIndex.save`, documents another process saved to `path` in
+        the meantime are merged in first.
+        """
+        with self.lock:
+            if os.path.exists(path) and (self.file_mtime is None or os.stat(path).st_mtime_ns > self.file_mtime):
+                other = BM25Index.load(path)
+                new_ids = [item_id for item_id in other.id_rows if item_id not in self.id_rows]
+                self.add(new_ids, [other.get_text(item_id) for item_id in new_ids])
+            documents = {item_id: self.texts[row] for item_id, row in self.id_rows.items()}
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"k1": self.k1, "b": self.b, "documents": documents}, f)
+            os.replace(tmp_path, path)
+            self.file_mtime = os.stat(path).st_mtime_ns
+            self.dirty = 0
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        """Load an index written by `save`; keyword arguments override saved parameters."""
+        mtime = os.stat(path).st_mtime_ns
+        with open(path, "r") as f:
+            data = json.load(f)
+        params = {"k1": data["k1"], "b": data["b"]}
+        params.update(kwargs)
+        index = cls(**params)
+        documents = data["documents"]
+        index.add(list(documents), list(documents.values()))
+        index.dirty = 0
+        index.file_mtime = mtime
+        return index
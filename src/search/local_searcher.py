@@ -0,0 +1,30 @@
+import os
+from src.search.scoring import ScoringEngine
+
+class LocalSearcher:
+    """Answers queries from the local ANN index instead of fetching new images."""
+
+    def __init__(self, clip_model, index, fusion="max", candidates_per_query=50, diversity=None):
+        self.clip_model = clip_model
+        self.index = index
+        self.fusion = fusion
+        self.candidates_per_query = candidates_per_query
+        self.diversity = diversity or {}
+
+    def search(self, query_text, top_k=10, nprobe=None):
+        queries = [query_text] if isinstance(query_text, str) else list(query_text)
+        text_embeddings = self.clip_model.encode_texts(queries).float().cpu().numpy()
+        candidates = {}
+        for hits in self.index.search(text_embeddings, self.candidates_per_query, nprobe):
+            for item_id, _ in hits:
+                candidates[item_id] = True
+        # Files can disappear between indexing and now (eviction, manual cleanup).
+        missing = {p for p in candidates if not os.path.exists(p)}
+        if missing:
+            self.index.remove(list(missing))
+        paths = [p for p in candidates if p not in missing and p in self.index]
+        if not paths:
+            return []
+        engine = ScoringEngine(self.index.get(paths), self.fusion, **self.diversity)
+        indices, scores = engine.rank(text_embeddings, top_k)
+        return [(paths[i], float(s)) for i, s in zip(indices, scores)]
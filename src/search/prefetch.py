@@ -0,0 +1,93 @@
+import asyncio
+from collections import OrderedDict
+from src.utils.logger import setup_logger
+from src.utils.metrics import metrics
+
+
+class SpeculativePrefetcher:
+    """Precomputes the likely "Refine with Image" paths while a user looks at results.
+
+    For the top `top_k` results of a session it captions the images (one
+    BLIP batch), merges each caption into the query with the LLM, expands
+    that, and fetches and embeds the candidate images, best-ranked result
+    first. Everything lands in the existing caches (captions, LLM, DDG URL
+    results, downloads, embeddings), so the real refine replays it as cache
+    hits. Each session gets at most one speculation, bounded by
+    `budget_seconds` and cancelled as soon as the user acts; at most
+    `max_sessions` speculate at once, extra ones are skipped.
+    """
+
+    def __init__(self, query_processor, blip_model, fetcher, executors, embed_fn, top_k=3, max_results=20,
+                 budget_seconds=30, max_sessions=4, max_memo_sessions=1000):
+        self.query_processor = query_processor
+        self.blip_model = blip_model
+        self.fetcher = fetcher
+        self.executors = executors
+        self.embed_fn = embed_fn
+        self.top_k = top_k
+        self.max_results = max_results
+        self.budget_seconds = budget_seconds
+        self.max_sessions = max_sessions
+        self.max_memo_sessions = max_memo_sessions
+        self.tasks = {}  # {session_id: Task}
+        self.enhanced = OrderedDict()  # {session_id: {(query, path): enhanced query}}
+        self.logger = setup_logger()
+
+    def start(self, session_id, query, paths):
+        """Speculate on `paths` (best first) for `session_id`, replacing any earlier speculation."""
+        self.cancel(session_id)
+        if not query or not paths or len(self.tasks) >= self.max_sessions:
+            return
+        self.enhanced[session_id] = {}
+        self.enhanced.move_to_end(session_id)
+        while len(self.enhanced) > self.max_memo_sessions:
+            self.enhanced.popitem(last=False)
+        task = asyncio.ensure_future(self._run(session_id, query, paths[:self.top_k]))
+        self.tasks[session_id] = task
+        task.add_done_callback(lambda t: self._finished(session_id, t))
+        metrics.inc("speculation_total", outcome="started")
+
+    def _finished(self, session_id, task):
+        if self.tasks.get(session_id) is task:
+            del self.tasks[session_id]
+        if task.cancelled():
+            metrics.inc("speculation_total", outcome="cancelled")
+        elif task.exception() is not None:
+            self.logger.debug(f"Speculation for session {session_id} stopped: {task.exception()!r}")
+            metrics.inc("speculation_total", outcome="failed")
+        else:
+            metrics.inc("speculation_total", outcome="completed")
+
+    async def _run(self, session_id, query, paths):
+        await asyncio.wait_for(self._speculate(session_id, query, paths), self.budget_seconds)
+
+    async def _speculate(self, session_id, query, paths):
+        captions = await self.executors.run_inference("blip", self.blip_model.generate_captions, paths)
+        for path, caption in zip(paths, captions):
+            if caption is None:
+                continue
+            enhanced = await self.executors.run_io(
+                self.query_processor.enhance_with_caption, query, caption, name="llm"
+            )
+            self.enhanced.get(session_id, {})[(query, path)] = enhanced
+            queries = await self.executors.run_io(
+                self.query_processor.enhance_initial_query, enhanced, name="llm"
+            )
+            image_paths = await self.fetcher.fetch_images(queries, self.max_results)
+            if image_paths:
+                await self.executors.run_inference("clip", self.embed_fn, image_paths)
+
+    def cancel(self, session_id):
+        task = self.tasks.pop(session_id, None)
+        if task is not None and not task.done():
+            task.cancel()
+
+    def enhanced_query(self, session_id, query, path):
+        """The speculatively enhanced query for refining `query` with `path`, if already computed."""
+        enhanced = self.enhanced.get(session_id, {}).get((query, path))
+        metrics.inc("speculation_lookups_total", outcome="hit" if enhanced is not None else "miss")
+        return enhanced
+
+    def forget(self, session_id):
+        self.cancel(session_id)
+        self.enhanced.pop(session_id, None)
@@ -1,5 +1,3 @@
-from src.models.llm_model import LocalLLM
-from src.models.blip_model import BLIPModel
 
 class QueryProcessor:
     def __init__(self, llm_model, blip_model):
@@ -12,10 +10,15 @@ class QueryProcessor:
     def refine_with_feedback(self, user_query, feedback):
         return self.llm_model.refine_with_feedback(user_query, feedback)
 
-    def enhance_with_image(self, user_query, image_path):
-        caption = self.blip_model.generate_caption(image_path)
+    def caption_image(self, image_path):
+        return self.blip_model.generate_caption(image_path)
+
+    def enhance_with_caption(self, user_query, caption):
         if user_query:
             return self.llm_model.enhance_with_caption(user_query, caption)
         else:
             # If no user query, use caption as the query
-            return caption
\ No newline at end of file
+            return caption
+
+    def enhance_with_image(self, user_query, image_path):
+        return self.enhance_with_caption(user_query, self.caption_image(image_path))
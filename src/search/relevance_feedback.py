@@ -0,0 +1,83 @@
+import os
+import numpy as np
+from src.search.image_searcher import ImageSearcher
+from src.search.scoring import ScoringEngine
+
+
+def _normalize(vector):
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def rocchio(text_embeddings=None, positive=None, negative=None, alpha=1.0, beta=0.75, gamma=0.15):
+    """Rocchio query vector: alpha * mean(text) + beta * mean(positive) - gamma * mean(negative).
+
+    All inputs are (n, D) arrays of normalized CLIP embeddings, any of which
+    may be None or empty; the result is L2-normalized so it scores like a
+    plain text embedding.
+    """
+    parts = []
+    for embeddings, weight in ((text_embeddings, alpha), (positive, beta), (negative, -gamma)):
+        if embeddings is not None and len(embeddings):
+            parts.append(weight * _normalize(np.asarray(embeddings, dtype=np.float32).mean(axis=0)))
+    if not parts:
+        raise ValueError("Relevance feedback needs a query or at least one image")
+    return _normalize(np.sum(parts, axis=0))
+
+
+class RelevanceFeedbackSearcher:
+    """Query-by-image and image feedback ranked in CLIP space, with no BLIP or LLM hop.
+
+    Selected (positive) and rejected (negative) images are embedded with
+    CLIP (usually an embedding-store hit, since they came from earlier
+    results), combined with the text query by `rocchio`, and the resulting
+    vector ranks the given candidates (e.g. the session's current results)
+    plus the nearest neighbours from the local ANN index.
+    """
+
+    def __init__(self, clip_model, embedding_store=None, ann_index=None, alpha=1.0, beta=0.75, gamma=0.15,
+                 batch_size=4, index_candidates=50, searcher_options=None):
+        self.clip_model = clip_model
+        self.embedding_store = embedding_store
+        self.ann_index = ann_index
+        self.alpha = alpha
+        self.beta = beta
+        self.gamma = gamma
+        self.batch_size = batch_size
+        self.index_candidates = index_candidates
+        self.searcher_options = searcher_options or {}
+
+    def _embed(self, paths):
+        if not paths:
+            return [], None
+        searcher = ImageSearcher(
+            self.clip_model, list(dict.fromkeys(paths)), self.batch_size, self.embedding_store,
+            **self.searcher_options
+        )
+        return searcher.embed_images()
+
+    def search(self, query_texts=(), positive_paths=(), negative_paths=(), candidate_paths=(), top_k=10,
+               nprobe=None):
+        """Return [(path, score)] for the Rocchio query, best first; rejected images are left out."""
+        query_texts = [query_texts] if isinstance(query_texts, str) else [q for q in query_texts if q]
+        text_embeddings = self.clip_model.encode_texts(query_texts).float().cpu().numpy() if query_texts else None
+        _, positive = self._embed(positive_paths)
+        _, negative = self._embed(negative_paths)
+        query = rocchio(text_embeddings, positive, negative, self.alpha, self.beta, self.gamma)
+
+        excluded = set(negative_paths)
+        paths, embeddings = self._embed([p for p in candidate_paths if p not in excluded])
+        paths = list(paths)
+        if self.ann_index is not None and len(self.ann_index):
+            seen = set(paths) | excluded
+            hits = self.ann_index.search(query[None], self.index_candidates, nprobe)[0]
+            index_paths = [p for p, _ in hits if p not in seen and os.path.exists(p)]
+            index_paths = [p for p in index_paths if p in self.ann_index]
+            if index_paths:
+                index_embeddings = self.ann_index.get(index_paths)
+                embeddings = index_embeddings if embeddings is None else np.concatenate([embeddings, index_embeddings])
+                paths.extend(index_paths)
+        if not paths:
+            return []
+        indices, scores = ScoringEngine(embeddings, **self.searcher_options.get("diversity", {})).rank(query, top_k)
+        return [(paths[i], float(s)) for i, s in zip(indices, scores)]
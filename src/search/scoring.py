@@ -0,0 +1,72 @@
+import numpy as np
+from src.utils.metrics import metrics
+
+FUSION_METHODS = ("max", "mean", "rrf")
+
+
+def score_matrix(query_embeddings, image_embeddings):
+    """Cosine scores of shape (Q, N) for normalized (Q, D) queries and (N, D) images."""
+    return np.asarray(query_embeddings, dtype=np.float32) @ np.asarray(image_embeddings, dtype=np.float32).T
+
+
+def fuse_scores(scores, method="max", rrf_k=60):
+    """Collapse a (Q, N) score matrix into one (N,) ranking score."""
+    if method not in FUSION_METHODS:
+        raise ValueError(f"Unknown fusion method: {method}")
+    if scores.shape[0] == 1:
+        return scores[0]
+    if method == "max":
+        return scores.max(axis=0)
+    if method == "mean":
+        return scores.mean(axis=0)
+    # Reciprocal rank fusion: rank of each image under each query, 1-based.
+    ranks = np.empty_like(scores, dtype=np.int64)
+    order = np.argsort(-scores, axis=1)
+    np.put_along_axis(ranks, order, np.arange(1, scores.shape[1] + 1)[None, :], axis=1)
+    return (1.0 / (rrf_k + ranks)).sum(axis=0)
+
+
+def top_k(scores, k):
+    """Indices and scores of the k best entries of a 1-D array, best first."""
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=scores.dtype)
+    if k < scores.shape[0]:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(scores.shape[0])
+    order = candidates[np.argsort(-scores[candidates], kind="stable")]
+    return order, scores[order]
+
+
+class ScoringEngine:
+    """Ranks a fixed (N, D) matrix of normalized image embeddings against text queries.
+
+    Many queries are scored with one (Q, D) x (D, N) product and fused into a
+    single ranking, so LLM-expanded query variants cost no extra passes.
+    """
+
+    def __init__(self, image_embeddings, fusion="max", rrf_k=60, dedup_threshold=None, mmr_lambda=1.0,
+                 pool_size=1000):
+        """`dedup_threshold` and `mmr_lambda` < 1 turn on near-duplicate collapse and
+        MMR diversification (see `src.search.diversify`) over the best `pool_size`.
+        """
+        self.image_embeddings = np.ascontiguousarray(image_embeddings, dtype=np.float32)
+        self.fusion = fusion
+        self.rrf_k = rrf_k
+        self.dedup_threshold = dedup_threshold
+        self.mmr_lambda = mmr_lambda
+        self.pool_size = pool_size
+
+    def __len__(self):
+        return self.image_embeddings.shape[0]
+
+    def rank(self, query_embeddings, k=10, fusion=None):
+        with metrics.span("rank"):
+            query_embeddings = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+            scores = score_matrix(query_embeddings, self.image_embeddings)
+            fused = fuse_scores(scores, fusion or self.fusion, self.rrf_k)
+            if self.dedup_threshold is None and self.mmr_lambda >= 1.0:
+                return top_k(fused, k)
+            from src.search.diversify import diversify
+            return diversify(fused, self.image_embeddings, k, self.dedup_threshold, self.mmr_lambda, self.pool_size)
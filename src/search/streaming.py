@@ -0,0 +1,130 @@
+import asyncio
+import numpy as np
+from src.search.image_searcher import ImageSearcher
+from src.search.scoring import ScoringEngine, fuse_scores, score_matrix
+from src.utils.logger import setup_logger
+from src.utils.metrics import metrics
+
+_DONE = object()
+
+
+class StreamingSearcher:
+    """Embeds images as their downloads finish instead of after the slowest one.
+
+    Downloads feed a bounded queue (a full queue pauses producers); a single
+    consumer drains it into CLIP batches of up to `batch_size`, waiting at most
+    `max_wait` seconds to fill a batch. When `deadline` seconds have passed the
+    fetch is cancelled and the best `top_k` images embedded so far are returned.
+    With `early_stop=(min_results, score_threshold)` the fetch is also cancelled
+    as soon as `min_results` embedded images score at least `score_threshold`.
+    """
+
+    def __init__(self, clip_model, fetcher, embedding_store=None, batch_size=4,
+                 queue_size=32, max_wait=0.05, fusion="max", executors=None, searcher_options=None,
+                 early_stop=None):
+        self.clip_model = clip_model
+        self.fetcher = fetcher
+        self.embedding_store = embedding_store
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.fusion = fusion
+        self.executors = executors
+        self.searcher_options = searcher_options or {}
+        self.early_stop = early_stop
+        self.paths = []
+        self.embeddings = None
+        self.logger = setup_logger()
+
+    def _run_clip(self, fn, *args):
+        if self.executors is not None:
+            return asyncio.ensure_future(self.executors.run_inference("clip", fn, *args))
+        return asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+    def _encode_queries(self, queries):
+        return self.clip_model.encode_texts(queries).float().cpu().numpy()
+
+    def _embed(self, paths):
+        searcher = ImageSearcher(
+            self.clip_model, paths, self.batch_size, self.embedding_store, **self.searcher_options
+        )
+        return searcher.embed_images()
+
+    async def _next_batch(self, queue, deadline):
+        """Collect up to `batch_size` paths; returns (paths, producer_finished)."""
+        loop = asyncio.get_running_loop()
+        batch = []
+        while len(batch) < self.batch_size:
+            remaining = deadline - loop.time()
+            if batch:
+                remaining = min(remaining, self.max_wait)
+            if remaining <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(queue.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            if item is _DONE:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    async def _enough(self, text_embeddings, embeddings):
+        if self.early_stop is None:
+            return False
+        min_results, threshold = self.early_stop
+        if threshold is None or sum(len(e) for e in embeddings) < min_results:
+            return False
+        fused = fuse_scores(score_matrix(await text_embeddings, np.concatenate(embeddings)), self.fusion)
+        return int(np.count_nonzero(fused >= threshold)) >= min_results
+
+    async def search(self, query_text, fetch_queries, max_results=20, top_k=10, deadline=10.0):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + deadline
+        queries = [query_text] if isinstance(query_text, str) else list(query_text)
+        queue = asyncio.Queue(maxsize=self.queue_size)
+
+        async def produce():
+            try:
+                await self.fetcher.stream_images(fetch_queries, max_results, queue)
+            except Exception as e:
+                self.logger.error(f"Image stream failed: {e}")
+            await queue.put(_DONE)
+
+        producer = asyncio.ensure_future(produce())
+        text_embeddings = self._run_clip(self._encode_queries, queries)
+        seen, paths, embeddings = set(), [], []
+        finished = False
+        try:
+            while not finished and loop.time() < deadline:
+                batch, finished = await self._next_batch(queue, deadline)
+                batch = [p for p in batch if p not in seen]
+                if not batch:
+                    continue
+                seen.update(batch)
+                embed = self._run_clip(self._embed, batch)
+                try:
+                    batch_paths, batch_embeddings = await asyncio.wait_for(
+                        asyncio.shield(embed), max(deadline - loop.time(), 0)
+                    )
+                except asyncio.TimeoutError:
+                    break
+                if batch_paths:
+                    paths.extend(batch_paths)
+                    embeddings.append(batch_embeddings)
+                    if await self._enough(text_embeddings, embeddings):
+                        metrics.inc("fetch_early_stops_total")
+                        break
+        finally:
+            if not producer.done():
+                self.logger.info(f"Enough results or deadline reached after {len(paths)} images; cancelling fetch")
+                producer.cancel()
+        text_embeddings = await text_embeddings
+
+        self.paths = paths
+        self.embeddings = np.concatenate(embeddings) if embeddings else None
+        if not paths:
+            return []
+        engine = ScoringEngine(self.embeddings, self.fusion, **self.searcher_options.get("diversity", {}))
+        indices, scores = engine.rank(text_embeddings, top_k)
+        return [(paths[i], float(s)) for i, s in zip(indices, scores)]
@@ -1,5 +1,25 @@
+import json
+import os
 import yaml
 
 def load_config(config_path="config/app_config.yaml"):
     with open(config_path, "r") as f:
-        return yaml.safe_load(f)
\ No newline at end of file
+        return yaml.safe_load(f)
+
+def _ingest_roots_path(config):
+    return os.path.join(os.path.dirname(config["index"]["path"]), "ingest_roots.json")
+
+def load_ingest_roots(config):
+    """Directories bulk ingestion indexed images from; the UI must be allowed to serve them."""
+    path = _ingest_roots_path(config)
+    if not os.path.exists(path):
+        return []
+    with open(path, "r") as f:
+        return json.load(f)
+
+def record_ingest_roots(config, roots):
+    roots = list(dict.fromkeys(load_ingest_roots(config) + [os.path.abspath(root) for root in roots]))
+    path = _ingest_roots_path(config)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(roots, f, indent=2)
@@ -0,0 +1,47 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ExecutorPool:
+    """Runs blocking work off the event loop.
+
+    Network-bound calls (Gemini, DuckDuckGo) go to a wide I/O thread pool;
+    torch inference goes to a small inference pool so concurrent requests
+    don't oversubscribe the CPU. Each named model can additionally be capped
+    with its own concurrency limit.
+    """
+
+    def __init__(self, io_workers=16, inference_workers=2, model_concurrency=None):
+        self.io_executor = ThreadPoolExecutor(io_workers, thread_name_prefix="io")
+        self.inference_executor = ThreadPoolExecutor(inference_workers, thread_name_prefix="inference")
+        self.model_concurrency = model_concurrency or {}
+        self.semaphores = {}
+
+    def _semaphore(self, name):
+        if name is None or name not in self.model_concurrency:
+            return None
+        if name not in self.semaphores:
+            self.semaphores[name] = asyncio.Semaphore(self.model_concurrency[name])
+        return self.semaphores[name]
+
+    async def _run(self, executor, name, fn, args, kwargs):
+        loop = asyncio.get_running_loop()
+        call = functools.partial(fn, *args, **kwargs)
+        semaphore = self._semaphore(name)
+        if semaphore is None:
+            return await loop.run_in_executor(executor, call)
+        async with semaphore:
+            return await loop.run_in_executor(executor, call)
+
+    async def run_io(self, fn, *args, name=None, **kwargs):
+        """Await a network-bound call on the I/O pool, limited by `name` if configured."""
+        return await self._run(self.io_executor, name, fn, args, kwargs)
+
+    async def run_inference(self, name, fn, *args, **kwargs):
+        """Await a model call on the inference pool, limited per model `name`."""
+        return await self._run(self.inference_executor, name, fn, args, kwargs)
+
+    def shutdown(self, wait=False):
+        self.io_executor.shutdown(wait=wait)
+        self.inference_executor.shutdown(wait=wait)
@@ -0,0 +1,55 @@
+import hashlib
+import io
+import os
+from threading import Lock
+from PIL import Image
+
+_CHUNK_SIZE = 1 << 20
+_MEMO_LIMIT = 100000
+_memo = {}
+_memo_lock = Lock()
+
+
+def bytes_hash(data):
+    """Return the hex SHA-256 digest of a bytes object."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def perceptual_hash(data):
+    """Return the 64-bit difference hash (dHash) of encoded image bytes.
+
+    Re-encodes, resizes and small crops of one photo land within a few bits
+    of each other, so stock images served from different URLs match.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        image.draft("L", (64, 64))
+        pixels = list(image.convert("L").resize((9, 8), Image.BILINEAR).getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return bits
+
+
+def file_hash(path):
+    """Return the hex SHA-256 digest of a file's content.
+
+    Digests are memoized on (path, size, mtime) so repeated lookups of an
+    unchanged file cost a single stat call.
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _memo_lock:
+        digest = _memo.get(key)
+    if digest is not None:
+        return digest
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+            sha.update(chunk)
+    digest = sha.hexdigest()
+    with _memo_lock:
+        if len(_memo) >= _MEMO_LIMIT:
+            _memo.clear()
+        _memo[key] = digest
+    return digest
@@ -0,0 +1,37 @@
+import cProfile
+import os
+import time
+from contextlib import contextmanager
+from threading import Lock
+from src.utils.logger import setup_logger
+
+# Only one cProfile profiler can be active per interpreter.
+_active = Lock()
+
+
+@contextmanager
+def profile_block(output_dir, name, enabled=True):
+    """cProfile the enclosed block and dump `<output_dir>/<name>-<timestamp>.prof`.
+
+    Open the dump with `python -m pstats` or snakeviz. cProfile only sees the
+    calling thread. Around an async handler that is the event loop, so the
+    dump covers every coroutine that ran during the block, including other
+    sessions', and none of the executor threads where CLIP, BLIP and the LLM
+    run. Treat it as a profile of the loop while that request was in flight.
+    For executor threads use `py-spy dump`, whose thread names ("io_*",
+    "inference_*", "clip-*-batcher") map back to the pools.
+    """
+    if not enabled or not _active.acquire(blocking=False):
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        _active.release()
+        os.makedirs(output_dir, exist_ok=True)
+        path = os.path.join(output_dir, f"{name}-{int(time.time() * 1000)}.prof")
+        profiler.dump_stats(path)
+        setup_logger().info(f"Wrote profile {path}")
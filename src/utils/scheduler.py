@@ -0,0 +1,92 @@
+import heapq
+import json
+import random
+import time
+from threading import Event, Lock, Thread
+from src.utils.logger import setup_logger
+from src.utils.metrics import metrics
+
+
+class MaintenanceScheduler:
+    """Runs periodic housekeeping jobs on one daemon thread, off the request path.
+
+    Each job is called as `fn(deadline)`, where `deadline` is a
+    `time.monotonic()` value `budget_seconds` away; jobs that can stop
+    partway (e.g. cache eviction) should, and overruns are counted either
+    way. Intervals are spread by +/- `jitter` (a fraction of the interval)
+    so replicas don't all sweep the disk at the same moment.
+    """
+
+    def __init__(self):
+        self.jobs = {}  # {name: {"fn", "interval", "jitter", "budget", "last_run", ...}}
+        self.queue = []  # [(next_run, name)]
+        self.lock = Lock()
+        self.stopped = Event()
+        self.wakeup = Event()
+        self.thread = None
+        self.logger = setup_logger()
+
+    def _next_run(self, job, now):
+        return now + job["interval"] * (1 + random.uniform(-job["jitter"], job["jitter"]))
+
+    def add_job(self, name, fn, interval_seconds, jitter=0.1, budget_seconds=None, run_immediately=False):
+        job = {
+            "fn": fn, "interval": interval_seconds, "jitter": jitter,
+            "budget": budget_seconds if budget_seconds is not None else interval_seconds,
+            "last_run": None, "last_duration": None, "last_status": None, "last_result": None,
+        }
+        now = time.monotonic()
+        with self.lock:
+            self.jobs[name] = job
+            heapq.heappush(self.queue, (now if run_immediately else self._next_run(job, now), name))
+        self.wakeup.set()
+
+    def _run(self, name):
+        job = self.jobs[name]
+        started = time.monotonic()
+        try:
+            result = job["fn"](started + job["budget"])
+            status = "ok"
+        except Exception as e:
+            self.logger.error(f"Maintenance job {name} failed: {e}")
+            result, status = str(e), "error"
+        duration = time.monotonic() - started
+        if duration > job["budget"]:
+            metrics.inc("maintenance_overruns_total", job=name)
+            self.logger.warning(f"Maintenance job {name} took {duration:.1f}s, over its {job['budget']}s budget")
+        job.update(last_run=time.time(), last_duration=duration, last_status=status, last_result=result)
+        metrics.inc("maintenance_runs_total", job=name, status=status)
+        metrics.set_gauge("maintenance_last_run_timestamp", job["last_run"], job=name)
+        metrics.set_gauge("maintenance_last_duration_seconds", duration, job=name)
+
+    def _loop(self):
+        while not self.stopped.is_set():
+            with self.lock:
+                next_run, name = self.queue[0] if self.queue else (None, None)
+            now = time.monotonic()
+            if next_run is None or next_run > now:
+                self.wakeup.wait(None if next_run is None else next_run - now)
+                self.wakeup.clear()
+                continue
+            with self.lock:
+                heapq.heappop(self.queue)
+            self._run(name)
+            with self.lock:
+                heapq.heappush(self.queue, (self._next_run(self.jobs[name], time.monotonic()), name))
+
+    def start(self):
+        self.thread = Thread(target=self._loop, name="maintenance", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.wakeup.set()
+
+    def status(self, params=None):
+        """Status-server route: last run time, duration, status and result of every job."""
+        with self.lock:
+            body = {
+                name: {key: job[key] for key in ("interval", "budget", "last_run", "last_duration", "last_status", "last_result")}
+                for name, job in self.jobs.items()
+            }
+        return 200, "application/json", json.dumps(body, default=str) + "\n"
@@ -1,90 +1,299 @@
+import heapq
+import json
 import os
+import queue
+import sqlite3
 import time
 import uuid
-from threading import Lock
+from contextlib import contextmanager
+from threading import Lock, Thread, local
 from src.utils.logger import setup_logger
+from src.utils.metrics import metrics
+
+
+def _new_session(now):
+    return {"files": [], "last_active": now, "current_query": None, "current_results": []}
+
+
+class SessionBackend:
+    """Storage for session records: `{"files", "last_active", "current_query", "current_results"}`."""
+
+    def create(self, session_id, now):
+        raise NotImplementedError
+
+    def update(self, session_id, now, current_query=None, current_results=None, new_file=None):
+        """Refresh `last_active` and apply any given fields; False if the session is unknown."""
+        raise NotImplementedError
+
+    def get(self, session_id):
+        raise NotImplementedError
+
+    def pop(self, session_id):
+        """Remove a session and return its record, or None."""
+        raise NotImplementedError
+
+    def pop_expired(self, cutoff):
+        """Remove and return `[(session_id, record)]` for sessions idle since before `cutoff`."""
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+
+class MemorySessionBackend(SessionBackend):
+    """In-process sessions, sharded by id so concurrent requests rarely share a lock.
+
+    Every session has one entry in an expiry min-heap keyed by the
+    `last_active` it had when pushed. Updates don't touch the heap; when an
+    entry reaches the front, a session that was active since is pushed back
+    with its real timestamp, so expiry costs O(expired + refreshed) heap
+    operations instead of a scan of every session.
+    """
+
+    def __init__(self, num_shards=16):
+        self.shards = [({}, Lock()) for _ in range(num_shards)]
+        self.heap = []  # [(last_active, session_id)]
+        self.heap_lock = Lock()
+
+    def _shard(self, session_id):
+        return self.shards[hash(session_id) % len(self.shards)]
+
+    def create(self, session_id, now):
+        sessions, lock = self._shard(session_id)
+        with lock:
+            sessions[session_id] = _new_session(now)
+        with self.heap_lock:
+            heapq.heappush(self.heap, (now, session_id))
+
+    def update(self, session_id, now, current_query=None, current_results=None, new_file=None):
+        sessions, lock = self._shard(session_id)
+        with lock:
+            session = sessions.get(session_id)
+            if session is None:
+                return False
+            if current_query is not None:
+                session["current_query"] = current_query
+            if current_results is not None:
+                session["current_results"] = current_results
+            if new_file is not None:
+                session["files"].append(new_file)
+            session["last_active"] = now
+            return True
+
+    def get(self, session_id):
+        sessions, lock = self._shard(session_id)
+        with lock:
+            session = sessions.get(session_id)
+            return dict(session) if session is not None else None
+
+    def pop(self, session_id):
+        # The heap entry goes stale and is dropped when it reaches the front.
+        sessions, lock = self._shard(session_id)
+        with lock:
+            return sessions.pop(session_id, None)
+
+    def pop_expired(self, cutoff):
+        expired = []
+        with self.heap_lock:
+            while self.heap and self.heap[0][0] < cutoff:
+                _, session_id = heapq.heappop(self.heap)
+                sessions, lock = self._shard(session_id)
+                with lock:
+                    session = sessions.get(session_id)
+                    if session is None:
+                        continue
+                    if session["last_active"] >= cutoff:
+                        heapq.heappush(self.heap, (session["last_active"], session_id))
+                        continue
+                    del sessions[session_id]
+                expired.append((session_id, session))
+        return expired
+
+    def __len__(self):
+        return sum(len(sessions) for sessions, _ in self.shards)
+
+
+class SQLiteSessionBackend(SessionBackend):
+    """Sessions in a SQLite file, so several worker processes on one host share state.
+
+    Runs in WAL mode with one connection per thread; `last_active` is
+    indexed, so expiry is a range query over the expired rows only.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.local = local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, last_active REAL NOT NULL, "
+            "current_query TEXT, current_results TEXT NOT NULL, files TEXT NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS sessions_last_active ON sessions (last_active)")
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self.local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @staticmethod
+    def _record(row):
+        last_active, current_query, current_results, files = row
+        return {
+            "files": json.loads(files),
+            "last_active": last_active,
+            "current_query": current_query,
+            "current_results": [tuple(result) for result in json.loads(current_results)],
+        }
+
+    def create(self, session_id, now):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO sessions VALUES (?, ?, NULL, '[]', '[]')", (session_id, now)
+        )
+
+    def update(self, session_id, now, current_query=None, current_results=None, new_file=None):
+        with self._transaction() as conn:
+            row = conn.execute("SELECT files FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            if row is None:
+                return False
+            fields, values = ["last_active = ?"], [now]
+            if current_query is not None:
+                fields.append("current_query = ?")
+                values.append(current_query)
+            if current_results is not None:
+                fields.append("current_results = ?")
+                values.append(json.dumps([(path, float(score)) for path, score in current_results]))
+            if new_file is not None:
+                fields.append("files = ?")
+                values.append(json.dumps(json.loads(row[0]) + [new_file]))
+            conn.execute(f"UPDATE sessions SET {', '.join(fields)} WHERE id = ?", values + [session_id])
+            return True
+
+    def get(self, session_id):
+        row = self._conn().execute(
+            "SELECT last_active, current_query, current_results, files FROM sessions WHERE id = ?", (session_id,)
+        ).fetchone()
+        return self._record(row) if row is not None else None
+
+    def pop(self, session_id):
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT last_active, current_query, current_results, files FROM sessions WHERE id = ?",
+                (session_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+            return self._record(row)
+
+    def pop_expired(self, cutoff):
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT id, last_active, current_query, current_results, files FROM sessions WHERE last_active < ?",
+                (cutoff,)
+            ).fetchall()
+            conn.execute("DELETE FROM sessions WHERE last_active < ?", (cutoff,))
+        return [(row[0], self._record(row[1:])) for row in rows]
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+def create_session_backend(name="memory", path=None, num_shards=16):
+    if name == "memory":
+        return MemorySessionBackend(num_shards)
+    if name == "sqlite":
+        return SQLiteSessionBackend(path)
+    raise ValueError(f"Unknown session backend: {name}")
+
 
 class SessionManager:
-    def __init__(self, temp_dir, timeout_seconds):
+    def __init__(self, temp_dir, timeout_seconds, backend=None):
+        """Session state lives in `backend` (in-memory by default); temp files of
+        removed sessions are deleted by a background thread, never under a lock.
+        """
         self.temp_dir = temp_dir
         self.timeout_seconds = timeout_seconds
-        self.sessions = {}  # {session_id: {"files": [], "last_active": timestamp, "current_query": str, "current_results": list}}
-        self.lock = Lock()
+        self.backend = backend or MemorySessionBackend()
         self.logger = setup_logger()
+        self.deletions = queue.Queue()
         os.makedirs(temp_dir, exist_ok=True)
+        Thread(target=self._delete_files, name="session-file-deleter", daemon=True).start()
+
+    def _delete_files(self):
+        while True:
+            file_path = self.deletions.get()
+            try:
+                os.remove(file_path)
+                self.logger.debug(f"Deleted temp file: {file_path}")
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                self.logger.error(f"Failed to delete {file_path}: {e}")
+
+    def _discard(self, session):
+        for file_path in session["files"]:
+            self.deletions.put(file_path)
 
-    def create_session(self):
-        """Create a new session with a unique ID."""
-        session_id = str(uuid.uuid4())
-        with self.lock:
-            self.sessions[session_id] = {
-                "files": [],
-                "last_active": time.time(),
-                "current_query": None,
-                "current_results": []
-            }
-        self.logger.info(f"Created session: {session_id}")
+    def create_session(self, session_id=None):
+        """Create a new session, with a unique ID unless the caller (e.g. a router) picked one."""
+        session_id = session_id or str(uuid.uuid4())
+        self.backend.create(session_id, time.time())
+        metrics.set_gauge("sessions_active", len(self.backend))
+        self.logger.debug(f"Created session: {session_id}")
         return session_id
 
     def add_temp_file(self, session_id, file_path):
         """Add a temporary file to a session."""
-        with self.lock:
-            if session_id in self.sessions:
-                self.sessions[session_id]["files"].append(file_path)
-                self.sessions[session_id]["last_active"] = time.time()
-                self.logger.info(f"Added temp file {file_path} to session {session_id}")
+        if self.backend.update(session_id, time.time(), new_file=file_path):
+            self.logger.debug(f"Added temp file {file_path} to session {session_id}")
 
     def update_session_data(self, session_id, current_query=None, current_results=None):
         """Update query and results for a session."""
-        with self.lock:
-            if session_id in self.sessions:
-                if current_query is not None:
-                    self.sessions[session_id]["current_query"] = current_query
-                if current_results is not None:
-                    self.sessions[session_id]["current_results"] = current_results
-                self.sessions[session_id]["last_active"] = time.time()
-                self.logger.info(f"Updated session {session_id}: query={current_query}, results_len={len(current_results or [])}")
+        self.backend.update(session_id, time.time(), current_query=current_query, current_results=current_results)
+        self.logger.debug(f"Updated session {session_id}: query={current_query}, results_len={len(current_results or [])}")
 
     def get_session_data(self, session_id):
         """Get query and results for a session."""
-        with self.lock:
-            if session_id in self.sessions:
-                return (
-                    self.sessions[session_id]["current_query"],
-                    self.sessions[session_id]["current_results"]
-                )
+        session = self.backend.get(session_id)
+        if session is None:
             return None, []
+        return session["current_query"], session["current_results"]
 
     def cleanup_session(self, session_id):
         """Delete all temporary files and session data."""
-        with self.lock:
-            if session_id in self.sessions:
-                for file_path in self.sessions[session_id]["files"]:
-                    try:
-                        if os.path.exists(file_path):
-                            os.remove(file_path)
-                            self.logger.info(f"Deleted temp file: {file_path}")
-                    except Exception as e:
-                        self.logger.error(f"Failed to delete {file_path}: {e}")
-                del self.sessions[session_id]
-                self.logger.info(f"Cleaned up session: {session_id}")
+        session = self.backend.pop(session_id)
+        if session is not None:
+            self._discard(session)
+            metrics.set_gauge("sessions_active", len(self.backend))
+            self.logger.debug(f"Cleaned up session: {session_id}")
 
     def cleanup_expired_sessions(self):
         """Clean up sessions that have timed out."""
-        current_time = time.time()
-        with self.lock:
-            expired_sessions = [
-                sid for sid, data in self.sessions.items()
-                if current_time - data["last_active"] > self.timeout_seconds
-            ]
-            for session_id in expired_sessions:
-                self.cleanup_session(session_id)
-        self.logger.info(f"Cleaned up {len(expired_sessions)} expired sessions")
-        return f"Cleaned up {len(expired_sessions)} expired sessions"
+        expired = self.backend.pop_expired(time.time() - self.timeout_seconds)
+        for _, session in expired:
+            self._discard(session)
+        metrics.set_gauge("sessions_active", len(self.backend))
+        metrics.inc("sessions_expired_total", len(expired))
+        if expired:
+            self.logger.info(f"Cleaned up {len(expired)} expired sessions")
+        return f"Cleaned up {len(expired)} expired sessions"
 
     def update_session_activity(self, session_id):
         """Update the last active time for a session."""
-        with self.lock:
-            if session_id in self.sessions:
-                self.sessions[session_id]["last_active"] = time.time()
-                self.logger.debug(f"Updated activity for session: {session_id}")
\ No newline at end of file
+        self.backend.update(session_id, time.time())
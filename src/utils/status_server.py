@@ -0,0 +1,65 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from urllib.parse import parse_qs, urlparse
+from src.utils.logger import setup_logger
+from src.utils.metrics import metrics
+
+
+class StatusServer:
+    """Small side-car HTTP server for operational endpoints.
+
+    Runs on its own port in a daemon thread so it answers even while the
+    Gradio event loop is busy. `/metrics` is always registered; other
+    handlers are added with `add_route` and receive the parsed query string,
+    returning `(status, content_type, body)`.
+    """
+
+    def __init__(self, host="127.0.0.1", port=9100):
+        self.host = host
+        self.port = port
+        self.routes = {"/metrics": self._metrics}
+        self.server = None
+        self.logger = setup_logger()
+
+    def _metrics(self, params):
+        return 200, "text/plain; version=0.0.4", metrics.render()
+
+    def add_route(self, path, handler):
+        self.routes[path] = handler
+
+    def _handler_class(self):
+        routes, logger = self.routes, self.logger
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                handler = routes.get(url.path)
+                if handler is None:
+                    status, content_type, body = 404, "text/plain", "Not found\n"
+                else:
+                    params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                    try:
+                        status, content_type, body = handler(params)
+                    except Exception as e:
+                        logger.error(f"Status endpoint {url.path} failed: {e}")
+                        status, content_type, body = 500, "text/plain", f"{e}\n"
+                payload = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass  # scrapes every few seconds would drown the app log
+
+        return Handler
+
+    def start(self):
+        self.server = ThreadingHTTPServer((self.host, self.port), self._handler_class())
+        Thread(target=self.server.serve_forever, name="status-server", daemon=True).start()
+        self.logger.info(f"Status server listening on {self.host}:{self.port}")
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
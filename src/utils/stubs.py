@@ -0,0 +1,67 @@
+import asyncio
+import random
+import time
+
+
+class StubLLM:
+    """Deterministic stand-in for LocalLLM with optional latency and failure rate."""
+
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.calls = 0
+
+    def _call(self):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.failure_rate and self.random.random() < self.failure_rate:
+            raise RuntimeError("Stub LLM failure")
+
+    def generate(self, prompt, max_length=1000):
+        self._call()
+        return prompt.strip().splitlines()[-1] if prompt.strip() else ""
+
+    def enhance_query(self, user_query, num_variations=5):
+        self._call()
+        suffixes = ["", "photo", "high resolution", "close up", "wide shot", "natural light"]
+        return [f"{user_query} {suffix}".strip() for suffix in suffixes][:num_variations]
+
+    def refine_with_feedback(self, user_query, feedback):
+        self._call()
+        return f"{user_query}, {feedback}"
+
+    def enhance_with_caption(self, user_query, blip_caption):
+        self._call()
+        return f"{user_query}, {blip_caption}"
+
+
+class StubFetcher:
+    """Stand-in for ImageFetcher that serves a fixed local image pool.
+
+    Every query returns the same `image_paths`, after `latency` seconds, with
+    each image dropped with probability `failure_rate` to mimic dead URLs.
+    """
+
+    def __init__(self, image_paths, latency=0.0, failure_rate=0.0, seed=0):
+        self.image_paths = list(image_paths)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+
+    def _sample(self):
+        if not self.failure_rate:
+            return list(self.image_paths)
+        return [p for p in self.image_paths if self.random.random() >= self.failure_rate]
+
+    async def fetch_images(self, queries, max_results=20):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._sample()
+
+    async def stream_images(self, queries, max_results, queue):
+        for path in self._sample():
+            if self.latency:
+                await asyncio.sleep(self.latency / max(len(self.image_paths), 1))
+            await queue.put(path)